@@ -4,15 +4,71 @@ import os
 import aws_cdk as cdk
 
 from stacks.iac_pipeline_stack import ControlBrokerCodepipelineExampleStack
+from stacks.evaluation_service_stack import ControlBrokerEvaluationServiceStack
 
 expecting_control_broker_version = "0.10.0"
 
 app = cdk.App()
+
+# deployed once and shared, pipelines in other apps set evaluation-service-queue-arn and -worker-role-arn instead
+evaluation_service = None
+if app.node.try_get_context("control-broker/deploy-evaluation-service"):
+    evaluation_service = ControlBrokerEvaluationServiceStack(app, "CBEvaluationService",
+        env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')),
+        control_broker_apigw_url=app.node.try_get_context("control-broker/apigw-url"),
+        max_workers=int(app.node.try_get_context("control-broker/evaluation-service-max-workers") or 5),
+        batch_chunk_size=int(app.node.try_get_context("control-broker/batch-chunk-size") or 10),
+        apigw_requests_per_second=float(app.node.try_get_context("control-broker/apigw-requests-per-second") or 10),
+        apigw_burst=int(app.node.try_get_context("control-broker/apigw-burst") or 10),
+        apigw_max_retries=int(app.node.try_get_context("control-broker/apigw-max-retries") or 5),
+        log_level=app.node.try_get_context("control-broker/log-level") or "INFO",
+        log_sample_rate=float(app.node.try_get_context("control-broker/log-sample-rate") or 0),
+        tracing=bool(app.node.try_get_context("control-broker/tracing")),
+    )
+
 ControlBrokerCodepipelineExampleStack(app, "CBConsumerCodepipeline",
     env=cdk.Environment(account=os.getenv('CDK_DEFAULT_ACCOUNT'), region=os.getenv('CDK_DEFAULT_REGION')),
     pipeline_ownership_metadata=app.node.try_get_context("control-broker/pipeline-ownership-metadata"),
     control_broker_apigw_url=app.node.try_get_context("control-broker/apigw-url"),
     source_iac=app.node.try_get_context("control-broker/source-iac"),
+    upload_max_workers=int(app.node.try_get_context("control-broker/upload-max-workers") or 8),
+    upload_part_size_mb=int(app.node.try_get_context("control-broker/upload-part-size-mb") or 8),
+    upload_max_concurrency=int(app.node.try_get_context("control-broker/upload-max-concurrency") or 10),
+    content_addressed_uploads=bool(app.node.try_get_context("control-broker/content-addressed-uploads")),
+    verdict_cache=bool(app.node.try_get_context("control-broker/verdict-cache")),
+    verdict_cache_ttl_days=int(app.node.try_get_context("control-broker/verdict-cache-ttl-days") or 7),
+    policy_fingerprint=app.node.try_get_context("control-broker/policy-fingerprint") or expecting_control_broker_version,
+    batch_evaluation=bool(app.node.try_get_context("control-broker/batch-evaluation")),
+    batch_chunk_size=int(app.node.try_get_context("control-broker/batch-chunk-size") or 10),
+    max_concurrency=int(app.node.try_get_context("control-broker/max-concurrency") or 0),
+    apigw_requests_per_second=float(app.node.try_get_context("control-broker/apigw-requests-per-second") or 10),
+    apigw_burst=int(app.node.try_get_context("control-broker/apigw-burst") or 10),
+    apigw_max_retries=int(app.node.try_get_context("control-broker/apigw-max-retries") or 5),
+    results_callback=bool(app.node.try_get_context("control-broker/results-callback")),
+    results_bucket=app.node.try_get_context("control-broker/results-bucket"),
+    results_callback_timeout_seconds=int(app.node.try_get_context("control-broker/results-callback-timeout-seconds") or 300),
+    compact_results=bool(app.node.try_get_context("control-broker/compact-results")),
+    fail_fast=bool(app.node.try_get_context("control-broker/fail-fast")),
+    tfplan_shard_by=app.node.try_get_context("control-broker/tfplan-shard-by"),
+    tfplan_shard_size=int(app.node.try_get_context("control-broker/tfplan-shard-size") or 500),
+    slim_tfplan=bool(app.node.try_get_context("control-broker/slim-tfplan")),
+    cb_inputs_encoding=app.node.try_get_context("control-broker/cb-inputs-encoding"),
+    apigw_request_content_encoding=app.node.try_get_context("control-broker/apigw-request-content-encoding"),
+    toolchain_cache=app.node.try_get_context("control-broker/toolchain-cache"),
+    terraform_version=app.node.try_get_context("control-broker/terraform-version") or "1.2.0",
+    sam_cli_version=app.node.try_get_context("control-broker/sam-cli-version") or "1.53.0",
+    sam_cli_sha256=app.node.try_get_context("control-broker/sam-cli-sha256"),
+    lean_artifacts=bool(app.node.try_get_context("control-broker/lean-artifacts")),
+    artifact_extra_files=app.node.try_get_context("control-broker/artifact-extra-files"),
+    streaming_evaluation=bool(app.node.try_get_context("control-broker/streaming-evaluation")),
+    streaming_collect_timeout_seconds=int(app.node.try_get_context("control-broker/streaming-collect-timeout-seconds") or 1200),
+    evaluation_service_queue_arn=evaluation_service.queue_evaluation.queue_arn if evaluation_service else app.node.try_get_context("control-broker/evaluation-service-queue-arn"),
+    evaluation_service_worker_role_arn=evaluation_service.lambda_evaluation_worker.role.role_arn if evaluation_service else app.node.try_get_context("control-broker/evaluation-service-worker-role-arn"),
+    evaluation_service_timeout_seconds=int(app.node.try_get_context("control-broker/evaluation-service-timeout-seconds") or 3600),
+    incremental_evaluation=bool(app.node.try_get_context("control-broker/incremental-evaluation")),
+    log_level=app.node.try_get_context("control-broker/log-level") or "INFO",
+    log_sample_rate=float(app.node.try_get_context("control-broker/log-sample-rate") or 0),
+    tracing=bool(app.node.try_get_context("control-broker/tracing")),
 )
 
 app.synth()
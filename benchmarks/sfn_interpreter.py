@@ -0,0 +1,348 @@
+import copy
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# runs an Amazon States Language definition in process, covering the subset the evaluation
+# workflow uses: Map, Task, Pass, Choice, Succeed and Fail states, Retry and Catch,
+# Parameters, ResultSelector and ResultPath, task tokens and States.JsonToString
+
+# MaxConcurrency 0 means as many iterations as possible, bounded here by a thread pool
+default_max_map_concurrency = 64
+
+class StatesError(Exception):
+    # an error raised by a state, matched against Retry and Catch ErrorEquals
+
+    def __init__(self, error, cause=None):
+        super().__init__(error)
+        self.error = error
+        self.cause = cause
+        # the state the error was raised in, reported when it fails the execution
+        self.state = None
+
+class TaskTimedOut(Exception):
+    # the task waiting on a token already timed out or finished
+    pass
+
+class InvalidToken(Exception):
+    pass
+
+class TaskTokens:
+    # task tokens handed out by .waitForTaskToken tasks, completed by SendTaskSuccess/Failure
+
+    def __init__(self):
+        # waiters stay until their task reads them, a result can arrive before the task waits
+        self.waiters = {}
+        self.pending = set()
+        self.issued = set()
+        self.lock = threading.Lock()
+
+    def create(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.waiters[token] = {'event': threading.Event()}
+            self.pending.add(token)
+            self.issued.add(token)
+        return token
+
+    def complete(self, token, **outcome):
+        with self.lock:
+            if token not in self.issued:
+                raise InvalidToken(token[:32])
+            if token not in self.pending:
+                raise TaskTimedOut(token[:32])
+            self.pending.discard(token)
+            waiter = self.waiters[token]
+        waiter.update(outcome)
+        waiter['event'].set()
+
+    def succeed(self, token, output):
+        self.complete(token, output=output)
+
+    def fail(self, token, *, error=None, cause=None):
+        self.complete(token, error=error or 'States.TaskFailed', cause=cause)
+
+    def wait(self, token, timeout):
+        waiter = self.waiters[token]
+        completed = waiter['event'].wait(timeout)
+        with self.lock:
+            self.pending.discard(token)
+            self.waiters.pop(token)
+        if not completed:
+            raise StatesError('States.Timeout', f'no task result within {timeout:.3f} seconds')
+        if 'error' in waiter:
+            raise StatesError(waiter['error'], waiter['cause'])
+        return waiter['output']
+
+def path_parts(path):
+    # "$", "$.a.b" and "$$.a.b", the context object is addressed with "$$"
+    return [p for p in path.lstrip('$').split('.') if p]
+
+def path_exists(data, path):
+    node = data
+    for part in path_parts(path):
+        if not isinstance(node, dict) or part not in node:
+            return False
+        node = node[part]
+    return True
+
+def get_path(data, path):
+    node = data
+    for part in path_parts(path):
+        if not isinstance(node, dict) or part not in node:
+            raise StatesError('States.Runtime', f'path {path} not found in input')
+        node = node[part]
+    return node
+
+def set_path(data, path, value):
+    # ResultPath null keeps the state input, "$" replaces it, anything else merges into a copy
+    if path is None:
+        return data
+    parts = path_parts(path)
+    if not parts:
+        return value
+    data = copy.deepcopy(data)
+    node = data
+    for part in parts[:-1]:
+        node = node.setdefault(part, {})
+    node[parts[-1]] = value
+    return data
+
+def evaluate_intrinsic(expression, data, context):
+    name, _, argument = expression.partition('(')
+    argument = argument.rstrip(')').strip()
+    if name == 'States.JsonToString':
+        return json.dumps(resolve_reference(argument, data, context), separators=(',', ':'))
+    raise StatesError('States.Runtime', f'unsupported intrinsic function {name}')
+
+def resolve_reference(reference, data, context):
+    if reference.startswith('$$'):
+        return get_path(context, reference[1:])
+    if reference.startswith('$'):
+        return get_path(data, reference)
+    return evaluate_intrinsic(reference, data, context)
+
+def resolve_parameters(template, data, context):
+    # "Key.$" fields take their value from a path or intrinsic, everything else is a literal
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith('.$'):
+                resolved[key[:-2]] = resolve_reference(value, data, context)
+            else:
+                resolved[key] = resolve_parameters(value, data, context)
+        return resolved
+    if isinstance(template, list):
+        return [resolve_parameters(v, data, context) for v in template]
+    return template
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+comparators = {
+    'BooleanEquals': lambda a, b: isinstance(a, bool) and a == b,
+    'StringEquals': lambda a, b: isinstance(a, str) and a == b,
+    'NumericEquals': lambda a, b: is_number(a) and a == b,
+    'NumericGreaterThan': lambda a, b: is_number(a) and a > b,
+    'NumericGreaterThanEquals': lambda a, b: is_number(a) and a >= b,
+    'NumericLessThan': lambda a, b: is_number(a) and a < b,
+    'NumericLessThanEquals': lambda a, b: is_number(a) and a <= b,
+}
+
+def choice_matches(rule, data):
+    if 'And' in rule:
+        return all(choice_matches(r, data) for r in rule['And'])
+    if 'Or' in rule:
+        return any(choice_matches(r, data) for r in rule['Or'])
+    if 'Not' in rule:
+        return not choice_matches(rule['Not'], data)
+    variable = rule['Variable']
+    if 'IsPresent' in rule:
+        return path_exists(data, variable) == rule['IsPresent']
+    if 'IsNull' in rule:
+        return (path_exists(data, variable) and get_path(data, variable) is None) == rule['IsNull']
+    for operator, compare in comparators.items():
+        if operator in rule:
+            return compare(get_path(data, variable), rule[operator])
+    raise StatesError('States.Runtime', f'unsupported choice rule {sorted(rule)}')
+
+def error_matches(error_equals, error):
+    # States.TaskFailed matches every error but a timeout
+    if 'States.ALL' in error_equals or error in error_equals:
+        return True
+    return 'States.TaskFailed' in error_equals and error != 'States.Timeout'
+
+def task_error(e):
+    # a Lambda function's error is named after the exception class it raised
+    if isinstance(e, StatesError):
+        return e
+    return StatesError(type(e).__name__, json.dumps({'errorMessage': str(e), 'errorType': type(e).__name__}))
+
+class Interpreter:
+    # resources maps a Task Resource ARN to a callable taking the resolved Parameters;
+    # waits (Retry intervals, task TimeoutSeconds) are multiplied by wait_scale
+
+    def __init__(self, definition, *, resources, wait_scale=1.0, max_map_concurrency=default_max_map_concurrency):
+        self.definition = definition
+        self.resources = resources
+        self.wait_scale = wait_scale
+        self.max_map_concurrency = max_map_concurrency
+        self.task_tokens = TaskTokens()
+        self.lock = threading.Lock()
+        self.state_entries = Counter()
+        self.retries = Counter()
+
+    @property
+    def transitions(self):
+        return sum(self.state_entries.values())
+
+    def start_execution(self, execution_input, *, name=None):
+        name = name or uuid.uuid4().hex
+        context = {
+            'Execution': {
+                'Id': f'local:{name}',
+                'Name': name,
+                'Input': execution_input,
+            },
+        }
+        started = time.perf_counter()
+        try:
+            output = self.run_states(self.definition, execution_input, context)
+        except StatesError as e:
+            outcome = {'status': 'FAILED', 'error': e.error, 'cause': e.cause, 'state': e.state}
+        else:
+            outcome = {'status': 'SUCCEEDED', 'output': output}
+        outcome['seconds'] = time.perf_counter() - started
+        return outcome
+
+    def run_states(self, machine, data, context):
+        name = machine['StartAt']
+        while True:
+            state = machine['States'][name]
+            with self.lock:
+                self.state_entries[name] += 1
+            state_context = dict(context, State={'Name': name})
+            try:
+                data, name = self.run_state(name, state, data, state_context)
+            except StatesError as e:
+                e.state = e.state or name
+                catcher = next((c for c in state.get('Catch', []) if error_matches(c['ErrorEquals'], e.error)), None)
+                if catcher is None:
+                    raise
+                data = set_path(data, catcher.get('ResultPath', '$'), {'Error': e.error, 'Cause': e.cause})
+                name = catcher['Next']
+            if name is None:
+                return data
+
+    def run_state(self, name, state, data, context):
+        next_name = None if state.get('End') else state.get('Next')
+        state_type = state['Type']
+
+        if state_type == 'Pass':
+            effective = resolve_parameters(state['Parameters'], data, context) if 'Parameters' in state else data
+            result = state.get('Result', effective)
+            return set_path(data, state.get('ResultPath', '$'), result), next_name
+
+        if state_type == 'Succeed':
+            return data, None
+
+        if state_type == 'Fail':
+            error = state.get('Error') or (state.get('ErrorPath') and resolve_reference(state['ErrorPath'], data, context))
+            cause = state.get('Cause') or (state.get('CausePath') and resolve_reference(state['CausePath'], data, context))
+            raise StatesError(error, cause)
+
+        if state_type == 'Choice':
+            for rule in state['Choices']:
+                if choice_matches(rule, data):
+                    return data, rule['Next']
+            if 'Default' not in state:
+                raise StatesError('States.NoChoiceMatched', f'no choice rule of {name} matched')
+            return data, state['Default']
+
+        if state_type == 'Task':
+            result = self.run_task(name, state, data, context)
+        elif state_type == 'Map':
+            result = self.run_map(state, data, context)
+        else:
+            raise StatesError('States.Runtime', f'unsupported state type {state_type}')
+
+        if 'ResultSelector' in state:
+            result = resolve_parameters(state['ResultSelector'], result, context)
+        return set_path(data, state.get('ResultPath', '$'), result), next_name
+
+    def run_task(self, name, state, data, context):
+        attempts = Counter()
+        while True:
+            try:
+                # $$.State.RetryCount, the retries of this state so far
+                return self.invoke(state, data, dict(context, State=dict(context['State'], RetryCount=sum(attempts.values()))))
+            except StatesError as e:
+                retriers = [r for r in state.get('Retry', []) if error_matches(r['ErrorEquals'], e.error)]
+                if not retriers:
+                    raise
+                retrier = retriers[0]
+                index = state['Retry'].index(retrier)
+                if attempts[index] >= retrier.get('MaxAttempts', 3):
+                    raise
+                interval = retrier.get('IntervalSeconds', 1) * retrier.get('BackoffRate', 2.0) ** attempts[index]
+                attempts[index] += 1
+                with self.lock:
+                    self.retries[name] += 1
+                time.sleep(interval * self.wait_scale)
+
+    def invoke(self, state, data, context):
+        resource = state['Resource']
+        wait_for_task_token = resource.endswith('.waitForTaskToken')
+        if wait_for_task_token:
+            resource = resource[:-len('.waitForTaskToken')]
+            context = dict(context, Task={'Token': self.task_tokens.create()})
+        if resource not in self.resources:
+            raise StatesError('States.Runtime', f'no stand-in for resource {resource}')
+
+        parameters = resolve_parameters(state['Parameters'], data, context) if 'Parameters' in state else data
+        # a task only ever sees a serialized copy of its input
+        parameters = json.loads(json.dumps(parameters))
+
+        started = time.perf_counter()
+        try:
+            result = self.resources[resource](parameters)
+        except Exception as e:
+            raise task_error(e)
+
+        if not wait_for_task_token:
+            if 'TimeoutSeconds' in state and time.perf_counter() - started > state['TimeoutSeconds'] * self.wait_scale:
+                raise StatesError('States.Timeout', f'task ran longer than {state["TimeoutSeconds"]} seconds')
+            return result
+
+        # the resource's own result is discarded, the task completes with whatever is sent for its token
+        timeout = state.get('TimeoutSeconds', 365 * 24 * 3600) * self.wait_scale
+        return self.task_tokens.wait(context['Task']['Token'], max(0, timeout - (time.perf_counter() - started)))
+
+    def run_map(self, state, data, context):
+        items = get_path(data, state.get('ItemsPath', '$'))
+        iterator = state.get('Iterator') or state['ItemProcessor']
+        max_concurrency = state.get('MaxConcurrency', 0) or self.max_map_concurrency
+        # once an iteration fails the remaining ones are never started
+        failed = threading.Event()
+
+        def iteration(index_item):
+            index, item = index_item
+            if failed.is_set():
+                return None
+            map_context = dict(context, Map={'Item': {'Index': index, 'Value': item}})
+            iteration_input = resolve_parameters(state['Parameters'], data, map_context) if 'Parameters' in state else item
+            try:
+                return self.run_states(iterator, iteration_input, map_context)
+            except StatesError:
+                failed.set()
+                raise
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(items) or 1))) as executor:
+            futures = [executor.submit(iteration, i) for i in enumerate(items)]
+        errors = [f.exception() for f in futures if f.exception()]
+        if errors:
+            raise errors[0]
+        return [f.result() for f in futures]
@@ -0,0 +1,296 @@
+import gzip
+import io
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict
+
+from botocore.exceptions import ClientError
+
+from .sfn_interpreter import InvalidToken, TaskTimedOut
+
+# in-process stand-ins for the AWS services and the Control Broker API the evaluation workflow calls,
+# each counting its calls by kind and sleeping a configurable latency per call
+
+class ApiCalls:
+    # thread-safe call counts shared by every stand-in of one run
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, kind):
+        with self.lock:
+            self.counts[kind] += 1
+
+    def as_dict(self):
+        with self.lock:
+            return dict(sorted(self.counts.items()))
+
+def client_error(*, code, status, operation):
+    return ClientError({
+        'Error': {'Code': code, 'Message': code},
+        'ResponseMetadata': {'HTTPStatusCode': status},
+    }, operation)
+
+class FakeS3:
+
+    def __init__(self, *, calls, latency=0.0):
+        self.calls = calls
+        self.latency = latency
+        self.objects = {}
+        self.bytes_read = 0
+        self.lock = threading.Lock()
+
+    def put_object(self, *, Bucket, Key, Body, **kwargs):
+        self.calls.count('s3:PutObject')
+        time.sleep(self.latency)
+        body = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        self.objects[(Bucket, Key)] = body
+        return {'ETag': f'"{len(body)}"'}
+
+    def get_object(self, *, Bucket, Key, **kwargs):
+        self.calls.count('s3:GetObject')
+        time.sleep(self.latency)
+        if (Bucket, Key) not in self.objects:
+            raise client_error(code='NoSuchKey', status=404, operation='GetObject')
+        body = self.objects[(Bucket, Key)]
+        with self.lock:
+            self.bytes_read += len(body)
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+    def head_object(self, *, Bucket, Key, **kwargs):
+        self.calls.count('s3:HeadObject')
+        time.sleep(self.latency)
+        if (Bucket, Key) not in self.objects:
+            raise client_error(code='404', status=404, operation='HeadObject')
+        return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+class FakeDynamoDB:
+    # key_schemas maps each table name to its key attribute names, partition key first
+
+    def __init__(self, *, calls, key_schemas, latency=0.0):
+        self.calls = calls
+        self.key_schemas = key_schemas
+        self.latency = latency
+        self.tables = defaultdict(dict)
+        self.lock = threading.Lock()
+
+    def item_key(self, table, item):
+        return tuple(json.dumps(item[name], sort_keys=True) for name in self.key_schemas[table])
+
+    def put_item(self, *, TableName, Item, **kwargs):
+        self.calls.count('dynamodb:PutItem')
+        time.sleep(self.latency)
+        with self.lock:
+            self.tables[TableName][self.item_key(TableName, Item)] = Item
+        return {}
+
+    def get_item(self, *, TableName, Key, **kwargs):
+        self.calls.count('dynamodb:GetItem')
+        time.sleep(self.latency)
+        with self.lock:
+            item = self.tables[TableName].get(self.item_key(TableName, Key))
+        return {'Item': item} if item else {}
+
+    def delete_item(self, *, TableName, Key, ReturnValues='NONE', **kwargs):
+        self.calls.count('dynamodb:DeleteItem')
+        time.sleep(self.latency)
+        with self.lock:
+            item = self.tables[TableName].pop(self.item_key(TableName, Key), None)
+        return {'Attributes': item} if item and ReturnValues == 'ALL_OLD' else {}
+
+    def query(self, *, TableName, KeyConditionExpression, ExpressionAttributeValues, **kwargs):
+        # only an equality condition on the partition key
+        self.calls.count('dynamodb:Query')
+        time.sleep(self.latency)
+        name, _, placeholder = (p.strip() for p in KeyConditionExpression.partition('='))
+        value = ExpressionAttributeValues[placeholder]
+        with self.lock:
+            items = [i for i in self.tables[TableName].values() if i[name] == value]
+        return {'Items': items, 'Count': len(items)}
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                yield getattr(client, operation)(**kwargs)
+
+        return Paginator()
+
+class FakeStepFunctions:
+    # SendTaskSuccess and SendTaskFailure, resuming the interpreter's waiting tasks
+
+    class exceptions:
+        TaskTimedOut = TaskTimedOut
+        InvalidToken = InvalidToken
+
+    def __init__(self, *, calls, task_tokens):
+        self.calls = calls
+        self.task_tokens = task_tokens
+
+    def send_task_success(self, *, taskToken, output):
+        self.calls.count('states:SendTaskSuccess')
+        self.task_tokens.succeed(taskToken, json.loads(output))
+        return {}
+
+    def send_task_failure(self, *, taskToken, error=None, cause=None):
+        self.calls.count('states:SendTaskFailure')
+        self.task_tokens.fail(taskToken, error=error, cause=cause)
+        return {}
+
+class FakeSQS:
+    # SendMessage from a function, delivered by the workflow's event source
+
+    def __init__(self, *, send):
+        self.send = send
+
+    def send_message(self, **parameters):
+        return self.send(parameters)
+
+class HTTPResponse:
+    # the parts of a urllib3 response sign_apigw_request reads
+
+    def __init__(self, *, status, data=b'', headers=None):
+        self.status = status
+        self.data = data
+        self.headers = headers or {}
+
+class RequestsResponse:
+    # the parts of a requests response requests_get reads
+
+    def __init__(self, *, status_code, content=b''):
+        self.status_code = status_code
+        self.content = content
+
+class ControlBroker:
+    # the Control Broker evaluation API and the presigned results report URLs it returns;
+    # a report exists evaluation_delay seconds after its POST, before that its URL is a 404
+
+    def __init__(
+        self,
+        *,
+        calls,
+        latency=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        evaluation_delay=0.0,
+        non_compliant_rate=0.0,
+        seed=0,
+        results_bucket='cb-results',
+        on_report=None,
+    ):
+        self.calls = calls
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.evaluation_delay = evaluation_delay
+        self.non_compliant_rate = non_compliant_rate
+        self.random = random.Random(seed)
+        self.results_bucket = results_bucket
+        # called with the bucket and key of each report as it lands, like an S3 Object Created notification
+        self.on_report = on_report
+        self.evaluation_ids = itertools.count(1)
+        self.reports = {}
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+
+    def evaluate(self, *, body, headers):
+        if 'Authorization' not in headers:
+            self.calls.count('ControlBroker:Evaluate:403')
+            return HTTPResponse(status=403, data=b'{"message":"Missing Authentication Token"}')
+        with self.lock:
+            self.bytes_received += len(body)
+            draw = self.random.random()
+            is_compliant = self.random.random() >= self.non_compliant_rate
+        if draw < self.throttle_rate:
+            self.calls.count('ControlBroker:Evaluate:429')
+            return HTTPResponse(status=429, data=b'{"message":"Too Many Requests"}')
+        if draw < self.throttle_rate + self.error_rate:
+            self.calls.count('ControlBroker:Evaluate:503')
+            return HTTPResponse(status=503, data=b'Service Unavailable')
+        if headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        evaluated = json.loads(body)['Input']
+
+        key = f'evaluations/{next(self.evaluation_ids)}/opa.json'
+        with self.lock:
+            self.reports[key] = {
+                'ReadyAt': time.monotonic() + self.evaluation_delay,
+                'Report': {
+                    'EvalEngineLambdalith': {
+                        'Evaluation': {
+                            'IsCompliant': is_compliant,
+                        }
+                    },
+                    'EvaluatedBytes': len(json.dumps(evaluated)),
+                },
+            }
+        if self.on_report:
+            timer = threading.Timer(self.evaluation_delay, self.on_report, kwargs={'bucket': self.results_bucket, 'key': key})
+            timer.daemon = True
+            timer.start()
+
+        self.calls.count('ControlBroker:Evaluate')
+        return HTTPResponse(status=200, data=json.dumps({
+            'Response': {
+                'ControlBrokerEvaluation': {
+                    'OutputHandlers': {
+                        'OPA': {
+                            'PresignedUrl': f'https://{self.results_bucket}.s3.amazonaws.com/{key}?X-Amz-Signature=local',
+                        }
+                    }
+                }
+            }
+        }).encode('utf-8'))
+
+    def read_report(self, *, url):
+        # the report, or False while it does not yet exist
+        key = urllib.parse.urlparse(url).path.lstrip('/')
+        with self.lock:
+            report = self.reports.get(key)
+        if not report or report['ReadyAt'] > time.monotonic():
+            self.calls.count('ResultsReport:Get:404')
+            return False
+        self.calls.count('ResultsReport:Get')
+        return report['Report']
+
+    def request(self, method, url, body=None, headers=None, **kwargs):
+        # urllib3.PoolManager.request
+        time.sleep(self.latency)
+        if method == 'POST':
+            return self.evaluate(body=body or b'', headers=headers or {})
+        report = self.read_report(url=url)
+        if report is False:
+            return HTTPResponse(status=404, data=b'<Error><Code>NoSuchKey</Code></Error>')
+        return HTTPResponse(status=200, data=json.dumps(report).encode('utf-8'))
+
+    def get(self, url, **kwargs):
+        # requests.get
+        r = self.request('GET', url)
+        return RequestsResponse(status_code=r.status, content=r.data)
+
+class FakeS3Store:
+    # the cb_input_collector S3Store interface over FakeS3, each upload reads the whole file
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def upload_file(self, *, bucket, key, file_path):
+        with open(file_path, 'rb') as f:
+            self.s3.put_object(Bucket=bucket, Key=key, Body=f.read())
+        return True
+
+    def object_exists(self, *, bucket, key):
+        return (bucket, key) in self.s3.objects
+
+    def get_json(self, *, bucket, key):
+        body = self.s3.objects.get((bucket, key))
+        return None if body is None else json.loads(body)
+
+    def shutdown(self):
+        pass
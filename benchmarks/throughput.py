@@ -0,0 +1,231 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from .stand_ins import ApiCalls, ControlBroker, FakeS3, FakeS3Store
+from .workflow import LocalFunction
+from .workloads import generate_source_dir, scales
+
+# throughput and peak memory of the collector and of sign_apigw_request's read and POST path over a
+# generated workload, written as JSON and compared against an earlier run:
+#
+#   python -m benchmarks.throughput --scale medium --output baseline.json
+#   python -m benchmarks.throughput --scale medium --baseline baseline.json
+
+sys.path.insert(0, './supplementary_files/codebuild_utils')
+
+from cb_input_collector import Collector, CollectorConfig
+# on the path set up by .workflow, with the rest of the evaluation_results layer
+from control_broker_client import PayloadTooLargeException
+
+buckets = {'CDK': 'synthed-templates', 'Terraform': 'tfplan', 'SAM': 'cb-inputs'}
+
+# collector settings per case, every IaC type is collected as is and Terraform also sharded and slimmed
+collector_cases = {
+    'CDK': {},
+    'Terraform': {},
+    'Terraform:shard-count': {'tfplan_shard_by': 'count'},
+    'Terraform:shard-module': {'tfplan_shard_by': 'module'},
+    'Terraform:slim': {'tfplan_slim': True},
+    'SAM': {},
+}
+
+def measure(run, *, memory):
+    # wall clock of one run, then the Python heap peak of a second, tracemalloc slows what it traces
+    started = time.perf_counter()
+    result = run()
+    seconds = time.perf_counter() - started
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+def case_result(*, seconds, peak, inputs, bytes_, errors=0):
+    result = {
+        'seconds': round(seconds, 4),
+        'inputs': inputs,
+        'bytes': bytes_,
+        'mb_per_second': round(bytes_ / 1024 / 1024 / seconds, 2) if seconds else None,
+        'inputs_per_second': round(inputs / seconds, 2) if seconds else None,
+        'errors': errors,
+    }
+    if peak is not None:
+        result['peak_memory_mb'] = round(peak / 1024 / 1024, 2)
+    return result
+
+def collect(*, source_dir, iac, settings, cb_inputs_encoding):
+    s3 = FakeS3(calls=ApiCalls())
+    config = CollectorConfig(
+        source_dir = source_dir,
+        buckets = buckets,
+        cb_inputs_encoding = cb_inputs_encoding,
+        **settings,
+    )
+    collector = Collector(config=config, execution_id='benchmark', store=FakeS3Store(s3))
+    return s3, collector.collect([iac])
+
+def sign_apigw_request_module(*, apigw_request_content_encoding):
+    # one container of the real handler module, its S3 and HTTP clients replaced
+    s3 = FakeS3(calls=ApiCalls())
+    broker = ControlBroker(calls=ApiCalls())
+    function = LocalFunction(
+        name = 'SignApigwRequest',
+        source = 'sign_apigw_request',
+        environment = {
+            'ApigwInvokeUrl': 'https://control-broker.execute-api.us-east-1.amazonaws.com/local',
+            'PipelineOwnershipMetadata': json.dumps({'Team': 'benchmark'}),
+            # throughput of one container, not of the client-side rate limit
+            'ApigwRequestsPerSecond': '1000000',
+            'ApigwBurst': '1000000',
+            'ApigwRequestContentEncoding': apigw_request_content_encoding,
+        },
+        inject = lambda source, module: None,
+    )
+    module = function.load(1)
+    from botocore.auth import SigV4Auth
+    from botocore.credentials import Credentials
+    module.client.clients.update({
+        's3': s3,
+        'http': broker,
+        'signer': SigV4Auth(Credentials('AKIDLOCAL', 'local-secret'), 'execute-api', 'us-east-1'),
+    })
+    return module, s3, broker
+
+def read_inputs(module, codebuild_inputs):
+    # the read path of every input in turn, as one SignApigwRequest invocation per input runs it
+    for i in codebuild_inputs:
+        module.client.get_object(bucket=i['Bucket'], key=i['Key'], content_encoding=i.get('ContentEncoding'), sha256=i['Sha256'])
+    return 0
+
+def read_post_inputs(module, codebuild_inputs):
+    # the read path, then the signed POST of the parsed object, an oversized body counts as an error
+    errors = 0
+    for i in codebuild_inputs:
+        evaluated = module.client.get_object(bucket=i['Bucket'], key=i['Key'], content_encoding=i.get('ContentEncoding'), sha256=i['Sha256'])
+        try:
+            module.client.post_to_control_broker(input_to_be_evaluated_object=evaluated)
+        except PayloadTooLargeException:
+            errors += 1
+    return errors
+
+def run_cases(*, source_dir, memory, cb_inputs_encoding, apigw_request_content_encoding, only):
+    cases = {}
+    for name, settings in collector_cases.items():
+        iac = name.split(':')[0]
+        names = [f'collector:{name}', f'sign_apigw_request:read:{name}', f'sign_apigw_request:read_post:{name}']
+        if only and not any(o in n for o in only for n in names):
+            continue
+
+        (s3, codebuild_inputs), seconds, peak = measure(
+            lambda: collect(source_dir=source_dir, iac=iac, settings=settings, cb_inputs_encoding=cb_inputs_encoding),
+            memory = memory,
+        )
+        cases[f'collector:{name}'] = case_result(
+            seconds = seconds,
+            peak = peak,
+            inputs = len(codebuild_inputs),
+            bytes_ = sum(os.path.getsize(i['Path']) for i in codebuild_inputs),
+        )
+
+        module, module_s3, broker = sign_apigw_request_module(apigw_request_content_encoding=apigw_request_content_encoding)
+        module_s3.objects = s3.objects
+        uncompressed_bytes = cases[f'collector:{name}']['bytes']
+
+        for path, run in [('read', read_inputs), ('read_post', read_post_inputs)]:
+            errors, seconds, peak = measure(lambda: run(module, codebuild_inputs), memory=memory)
+            cases[f'sign_apigw_request:{path}:{name}'] = case_result(seconds=seconds, peak=peak, inputs=len(codebuild_inputs), bytes_=uncompressed_bytes, errors=errors)
+    return cases
+
+def compare(*, cases, baseline, max_regression):
+    # seconds and peak memory against the baseline, a ratio over 1 + max_regression is a regression
+    regressions = []
+    lines = [f'{"case":<45} {"seconds":>10} {"baseline":>10} {"ratio":>7} {"peak MB":>9} {"baseline":>9}']
+    for name, result in cases.items():
+        base = baseline['cases'].get(name)
+        if not base:
+            lines.append(f'{name:<45} {result["seconds"]:>10.4f} {"-":>10}')
+            continue
+        ratio = result['seconds'] / base['seconds'] if base['seconds'] else 1.0
+        memory_ratio = (result.get('peak_memory_mb') or 0) / base['peak_memory_mb'] if base.get('peak_memory_mb') else 1.0
+        lines.append(f'{name:<45} {result["seconds"]:>10.4f} {base["seconds"]:>10.4f} {ratio:>7.2f} {result.get("peak_memory_mb") or 0:>9.2f} {base.get("peak_memory_mb") or 0:>9.2f}')
+        if ratio > 1 + max_regression or memory_ratio > 1 + max_regression:
+            regressions.append(name)
+    return lines, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.throughput', description='Collector and sign_apigw_request throughput and memory over a generated workload.')
+    parser.add_argument('--scale', default='medium', choices=sorted(scales))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workload-dir', help='reuse a directory written by python -m benchmarks.workloads rather than generating one')
+    parser.add_argument('--case', action='append', help='only the cases whose name contains this, repeatable')
+    parser.add_argument('--cb-inputs-encoding', default='', choices=['', 'gzip'])
+    parser.add_argument('--apigw-request-content-encoding', default='', choices=['', 'gzip'])
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass of each case')
+    parser.add_argument('--output', help='write the results to this JSON file, e.g. to serve as a baseline')
+    parser.add_argument('--baseline', help='compare against the results JSON of an earlier run')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='exit 1 when a case is this fraction slower or larger than the baseline')
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as stack:
+        source_dir = args.workload_dir or stack.enter_context(tempfile.TemporaryDirectory())
+        if args.workload_dir and os.path.exists(os.path.join(source_dir, 'workload.json')):
+            with open(os.path.join(source_dir, 'workload.json')) as f:
+                workload = json.load(f)
+        else:
+            workload = generate_source_dir(source_dir, scale=args.scale, seed=args.seed)
+
+        # the collector and the Lambda print per input
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            cases = run_cases(
+                source_dir = source_dir,
+                memory = not args.no_memory,
+                cb_inputs_encoding = args.cb_inputs_encoding,
+                apigw_request_content_encoding = args.apigw_request_content_encoding,
+                only = args.case,
+            )
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'workload': workload,
+        'options': {
+            'cb_inputs_encoding': args.cb_inputs_encoding,
+            'apigw_request_content_encoding': args.apigw_request_content_encoding,
+        },
+        'cases': cases,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['workload']['settings'] != workload['settings'] or baseline.get('options') != results['options']:
+            print('baseline was recorded with a different workload or options, ratios are not comparable', file=sys.stderr)
+        lines, regressions = compare(cases=cases, baseline=baseline, max_regression=args.max_regression)
+        print('\n'.join(lines), file=sys.stderr)
+        if regressions:
+            print(f'regressions over {args.max_regression:.0%}: {", ".join(regressions)}', file=sys.stderr)
+            sys.exit(1)
+
+    return results
+
+if __name__ == '__main__':
+    main()
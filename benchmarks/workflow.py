@@ -0,0 +1,475 @@
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.auth import SigV4Auth
+from botocore.credentials import Credentials
+
+from .sfn_interpreter import Interpreter
+from .stand_ins import ApiCalls, ControlBroker, FakeDynamoDB, FakeS3, FakeSQS, FakeStepFunctions
+
+# runs the synthesized evaluation state machine against the real Lambda handlers, with S3, DynamoDB,
+# SQS, Step Functions task tokens and the Control Broker API replaced by in-process stand-ins:
+#
+#   python -m benchmarks.workflow --inputs 50 --stack-kwargs '{"batch_evaluation": true}'
+
+# module level clients of the Lambdas are created on import, before the stand-ins replace them
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+lambdas_dir = './supplementary_files/lambdas'
+
+# the layers every function imports its logger, tracer and shared verdict records from
+sys.path.insert(0, './supplementary_files/lambda_layers/evaluation_results/python')
+sys.path.insert(0, './supplementary_files/lambda_layers/structured_logging/python')
+sys.path.insert(0, './supplementary_files/lambda_layers/tracing/python')
+
+import tracing
+
+# construct id of each function in the stacks, and the source it is built from
+function_sources = {
+    'SignApigwRequestVAlpha': 'sign_apigw_request',
+    'RequestsGet': 'requests_get',
+    'ParseResultsDetermineCompliance': 'parse_results_determine_compliance',
+    'StreamEvaluate': 'stream_evaluate',
+    'CollectStreamedVerdicts': 'collect_streamed_verdicts',
+    'VerdictCacheLambda': 'verdict_cache',
+    'ResultsReportCallback': 'results_report_callback',
+    'EvaluationServiceWorker': 'evaluation_service_worker',
+}
+
+pseudo_parameters = {
+    'AWS::AccountId': '123456789012',
+    'AWS::Partition': 'aws',
+    'AWS::Region': 'us-east-1',
+    'AWS::URLSuffix': 'amazonaws.com',
+}
+
+# SQS receives before a message goes to the dead letter queue
+max_receive_count = 3
+
+# Lambda sleeps between polls and retries, scaled along with the state machine's
+scaled_lambda_waits = {
+    'ResultsPollIntervalSeconds': 1,
+    'ApigwBackoffBaseSeconds': 0.5,
+}
+
+def synthesize(*, source_iac='SAM', **stack_kwargs):
+    # the templates of the pipeline stack and, when it uses one, the shared evaluation service
+    import aws_cdk as cdk
+    from aws_cdk import assertions
+
+    from stacks.evaluation_service_stack import ControlBrokerEvaluationServiceStack
+    from stacks.iac_pipeline_stack import ControlBrokerCodepipelineExampleStack
+
+    # as app.py sets them
+    stack_kwargs.setdefault('policy_fingerprint', 'local')
+    # never downloaded locally, any well-formed digest will do
+    stack_kwargs.setdefault('sam_cli_sha256', '0' * 64)
+    if stack_kwargs.get('evaluation_service_queue_arn'):
+        stack_kwargs.setdefault('evaluation_service_worker_role_arn', 'arn:aws:iam::123456789012:role/EvaluationServiceWorker')
+
+    app = cdk.App(context={'aws:cdk:bundling-stacks': [], 'aws:cdk:enable-path-metadata': True})
+    stacks = [
+        ControlBrokerCodepipelineExampleStack(app, 'CBConsumerCodepipeline',
+            pipeline_ownership_metadata={'Team': 'local'},
+            control_broker_apigw_url='https://control-broker.execute-api.us-east-1.amazonaws.com/local',
+            source_iac=source_iac,
+            **stack_kwargs,
+        )
+    ]
+    if stack_kwargs.get('evaluation_service_queue_arn'):
+        stacks.append(ControlBrokerEvaluationServiceStack(app, 'CBEvaluationService',
+            control_broker_apigw_url='https://control-broker.execute-api.us-east-1.amazonaws.com/local',
+            batch_chunk_size=stack_kwargs.get('batch_chunk_size', 10),
+        ))
+    return [assertions.Template.from_stack(s).to_json() for s in stacks]
+
+def flatten(value):
+    # CloudFormation intrinsics as plain values, resources are named by their logical ids
+    if isinstance(value, list):
+        return [flatten(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if 'Ref' in value:
+        return pseudo_parameters.get(value['Ref'], value['Ref'])
+    if 'Fn::GetAtt' in value:
+        logical_id, attribute = value['Fn::GetAtt']
+        # ARNs are split into their fields, e.g. a queue URL built from a queue ARN
+        if attribute == 'Arn':
+            return f'arn:aws:local:us-east-1:123456789012:{logical_id}'
+        return f'{logical_id}.{attribute}'
+    if 'Fn::Join' in value:
+        delimiter, parts = value['Fn::Join']
+        return delimiter.join(str(flatten(p)) for p in parts)
+    if 'Fn::Select' in value:
+        index, values = value['Fn::Select']
+        return flatten(values)[int(index)]
+    if 'Fn::Split' in value:
+        delimiter, source = value['Fn::Split']
+        return flatten(source).split(delimiter)
+    return {k: flatten(v) for k, v in value.items()}
+
+def construct_id(resource):
+    # the construct id a Lambda function's resource was created under, from its path metadata
+    path = resource.get('Metadata', {}).get('aws:cdk:path', '')
+    parts = path.split('/')
+    return parts[-2] if len(parts) >= 2 else None
+
+class FunctionOs:
+    # the os module as one function sees it, each function reads its own environment at call time
+
+    def __init__(self, environ):
+        self.environ = environ
+
+    def __getattr__(self, name):
+        return getattr(os, name)
+
+class LambdaContext:
+
+    def __init__(self, function_name, timeout_seconds=3):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+    def __repr__(self):
+        return f'LambdaContext({self.function_name}, {self.aws_request_id})'
+
+# module level code reads the process environment, so containers are loaded one at a time
+import_lock = threading.Lock()
+
+class LocalFunction:
+    # one module instance per container, so concurrent invocations never share module state and the
+    # first invocation of each container pays the import, as in Lambda
+
+    def __init__(self, *, name, source, environment, inject, timeout_seconds=3):
+        self.name = name
+        self.source = source
+        self.environment = environment
+        self.timeout_seconds = timeout_seconds
+        self.inject = inject
+        self.idle = []
+        self.containers = 0
+        self.invocations = 0
+        self.lock = threading.Lock()
+
+    def load(self, container):
+        path = os.path.join(lambdas_dir, self.source, 'lambda_function.py')
+        with import_lock:
+            saved = {k: os.environ.get(k) for k in self.environment}
+            os.environ.update(self.environment)
+            try:
+                spec = importlib.util.spec_from_file_location(f'{self.name}_{container}', path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            finally:
+                for k, v in saved.items():
+                    if v is None:
+                        os.environ.pop(k)
+                    else:
+                        os.environ[k] = v
+        module.os = FunctionOs(dict(os.environ, **self.environment))
+        self.inject(self.source, module)
+        return module
+
+    def invoke(self, event):
+        with self.lock:
+            self.invocations += 1
+            module = self.idle.pop() if self.idle else None
+            if module is None:
+                self.containers += 1
+                container = self.containers
+        if module is None:
+            module = self.load(container)
+        try:
+            # an invocation only ever sees a serialized copy of its event
+            return module.lambda_handler(json.loads(json.dumps(event)), LambdaContext(self.name, self.timeout_seconds))
+        finally:
+            with self.lock:
+                self.idle.append(module)
+
+class LocalWorkflow:
+
+    def __init__(
+        self,
+        templates,
+        *,
+        wait_scale=1.0,
+        s3_latency=0.0,
+        dynamodb_latency=0.0,
+        apigw_latency=0.0,
+        apigw_error_rate=0.0,
+        apigw_throttle_rate=0.0,
+        evaluation_delay=0.0,
+        non_compliant_rate=0.0,
+        results_bucket='cb-results',
+        seed=0,
+    ):
+        resources = {k: v for t in templates for k, v in t['Resources'].items()}
+
+        self.calls = ApiCalls()
+        self.s3 = FakeS3(calls=self.calls, latency=s3_latency)
+        self.dynamodb = FakeDynamoDB(
+            calls = self.calls,
+            latency = dynamodb_latency,
+            key_schemas = {
+                logical_id: [k['AttributeName'] for k in sorted(r['Properties']['KeySchema'], key=lambda k: k['KeyType'] != 'HASH')]
+                for logical_id, r in resources.items() if r['Type'] == 'AWS::DynamoDB::Table'
+            },
+        )
+
+        self.functions = {}
+        self.logical_ids = {}
+        for logical_id, r in resources.items():
+            name = construct_id(r)
+            if r['Type'] != 'AWS::Lambda::Function' or name not in function_sources:
+                continue
+            environment = {k: str(v) for k, v in flatten(r['Properties'].get('Environment', {}).get('Variables', {})).items()}
+            for k, default in scaled_lambda_waits.items():
+                environment[k] = str(float(environment.get(k, default)) * wait_scale)
+            # subsegments go to tracing.local_exporter rather than the X-Ray daemon
+            environment['TracingExporter'] = 'local'
+            self.functions[name] = LocalFunction(
+                name = name,
+                source = function_sources[name],
+                environment = environment,
+                inject = self.inject,
+                timeout_seconds = r['Properties'].get('Timeout', 3),
+            )
+            self.logical_ids[logical_id] = name
+
+        self.broker = ControlBroker(
+            calls = self.calls,
+            latency = apigw_latency,
+            error_rate = apigw_error_rate,
+            throttle_rate = apigw_throttle_rate,
+            evaluation_delay = evaluation_delay,
+            non_compliant_rate = non_compliant_rate,
+            seed = seed,
+            results_bucket = results_bucket,
+            # the EventBridge rule on the results bucket
+            on_report = self.report_created if 'ResultsReportCallback' in self.functions else None,
+        )
+        self.signer = SigV4Auth(Credentials('AKIDLOCAL', 'local-secret'), 'execute-api', 'us-east-1')
+
+        state_machine = next(r for r in resources.values() if r['Type'] == 'AWS::StepFunctions::StateMachine')
+        self.interpreter = Interpreter(
+            json.loads(flatten(state_machine['Properties']['DefinitionString'])),
+            wait_scale = wait_scale,
+            resources = {
+                'arn:aws:states:::lambda:invoke': self.lambda_invoke,
+                'arn:aws:states:::aws-sdk:s3:putObject': lambda p: self.s3.put_object(**p),
+                'arn:aws:states:::sqs:sendMessage': self.send_message,
+            },
+        )
+        self.sfn = FakeStepFunctions(calls=self.calls, task_tokens=self.interpreter.task_tokens)
+
+        # SQS event source deliveries and S3 notifications, outside any state
+        self.background = ThreadPoolExecutor(max_workers=64)
+        self.background_work = []
+
+    def submit(self, fn, *args, **kwargs):
+        self.background_work.append(self.background.submit(fn, *args, **kwargs))
+
+    def inject(self, source, module):
+        if source in ('sign_apigw_request', 'stream_evaluate', 'evaluation_service_worker'):
+            module.client.clients.update({
+                's3': self.s3,
+                'dynamodb': self.dynamodb,
+                'stepfunctions': self.sfn,
+                'http': self.broker,
+                'sqs': FakeSQS(send=self.send_message),
+                # signs for real, so signing time is part of the measurement
+                'signer': self.signer,
+            })
+        if source == 'requests_get':
+            module.requests = self.broker
+            module.s3 = self.s3
+        if source == 'results_report_callback':
+            module.dynamodb = self.dynamodb
+            module.sfn = self.sfn
+            module.s3 = self.s3
+            module.get_results_report = self.broker.read_report
+        if source in ('verdict_cache', 'collect_streamed_verdicts'):
+            module.dynamodb = self.dynamodb
+
+    def invoke(self, name, event):
+        self.calls.count(f'lambda:Invoke:{name}')
+        return self.functions[name].invoke(event)
+
+    def lambda_invoke(self, parameters):
+        name = self.logical_ids[parameters['FunctionName']]
+        return {'Payload': self.invoke(name, parameters['Payload']), 'StatusCode': 200}
+
+    def deliver(self, name, bodies):
+        # an SQS event source with ReportBatchItemFailures, failed messages are received again
+        records = [{'messageId': str(uuid.uuid4()), 'body': b, 'attributes': {}} for b in bodies]
+        for receive_count in range(1, max_receive_count + 1):
+            for r in records:
+                r['attributes']['ApproximateReceiveCount'] = str(receive_count)
+            failed = {f['itemIdentifier'] for f in self.invoke(name, {'Records': records})['batchItemFailures']}
+            records = [r for r in records if r['messageId'] in failed]
+            if not records:
+                return
+        self.calls.count(f'sqs:DeadLetter:{name}')
+
+    def send_message(self, parameters):
+        self.calls.count('sqs:SendMessage')
+        body = parameters['MessageBody']
+        self.submit(self.deliver, 'EvaluationServiceWorker', [body if isinstance(body, str) else json.dumps(body)])
+        return {'MessageId': str(uuid.uuid4())}
+
+    def report_created(self, *, bucket, key):
+        self.calls.count('events:ObjectCreated')
+        self.submit(self.invoke, 'ResultsReportCallback', {
+            'source': 'aws.s3',
+            'detail-type': 'Object Created',
+            'detail': {
+                'bucket': {'name': bucket},
+                'object': {'key': key},
+            },
+        })
+
+    def stream(self, *, execution_id, codebuild_inputs):
+        # what the collector queues during the build in streaming mode, in event source batches
+        batch_size = int(self.functions['StreamEvaluate'].environment.get('BatchChunkSize', 10))
+        bodies = [json.dumps({'ExecutionId': execution_id, 'CodeBuildInput': i}) for i in codebuild_inputs if not i.get('CarriedForward')]
+        for start in range(0, len(bodies), batch_size):
+            self.submit(self.deliver, 'StreamEvaluate', bodies[start:start + batch_size])
+
+    def put_inputs(self, *, execution_id, count, resources_per_input=10, carried_forward_rate=0.0, bucket='cb-inputs', seed=0):
+        # CodeBuildInputs items as the collector records them, each a template of resources_per_input queues
+        rng = random.Random(seed)
+        codebuild_inputs = []
+        for i in range(count):
+            name = f'Stack{i}.template.json'
+            body = json.dumps({
+                'Resources': {f'Queue{i}x{r}': {'Type': 'AWS::SQS::Queue', 'Properties': {'VisibilityTimeout': 300}} for r in range(resources_per_input)}
+            }).encode('utf-8')
+            item = {
+                'Bucket': bucket,
+                'Key': f'{execution_id}/{name}',
+                'Sha256': hashlib.sha256(body).hexdigest(),
+                'Name': name,
+            }
+            if rng.random() < carried_forward_rate:
+                item['CarriedForward'] = True
+            else:
+                self.s3.objects[(bucket, item['Key'])] = body
+            codebuild_inputs.append(item)
+        return codebuild_inputs
+
+    def run(self, *, execution_id, codebuild_inputs, show_logs=False):
+        artifact = {
+            'CodeBuildToSfnArtifact': {
+                'CodePipelineExecutionId': execution_id,
+                'CodeBuildInputs': codebuild_inputs,
+                'PolicyFingerprint': '',
+                'Context': {
+                    'EnvironmentEvaluation': 'Prod',
+                    'PipelineOwnershipMetadata': {'Team': 'local'},
+                },
+            }
+        }
+        logs = contextlib.nullcontext() if show_logs else contextlib.redirect_stdout(open(os.devnull, 'w'))
+        tracing.local_exporter.clear()
+        with logs:
+            started = time.perf_counter()
+            if self.interpreter.definition['StartAt'] == 'CollectStreamedVerdicts':
+                self.stream(execution_id=execution_id, codebuild_inputs=codebuild_inputs)
+            outcome = self.interpreter.start_execution(artifact, name=execution_id)
+            seconds = time.perf_counter() - started
+            # evaluations the execution no longer waits for, e.g. after a failure, still run to completion
+            for future in list(self.background_work):
+                future.result()
+        return {
+            'inputs': len(codebuild_inputs),
+            'status': outcome['status'],
+            'error': outcome.get('error'),
+            'failed_state': outcome.get('state'),
+            'seconds': round(seconds, 3),
+            'transitions': self.interpreter.transitions,
+            'state_entries': dict(sorted(self.interpreter.state_entries.items())),
+            'retries': dict(sorted(self.interpreter.retries.items())),
+            'lambda': {
+                name: {'invocations': f.invocations, 'containers': f.containers}
+                for name, f in sorted(self.functions.items()) if f.invocations
+            },
+            'api_calls': self.calls.as_dict(),
+            's3_bytes_read': self.s3.bytes_read,
+            'control_broker_bytes_received': self.broker.bytes_received,
+            'subsegments': subsegment_seconds(tracing.local_exporter.spans),
+        }
+
+def subsegment_seconds(spans):
+    # count and total seconds per function and subsegment name
+    totals = {}
+    for span in spans:
+        total = totals.setdefault(f'{span["Function"]}:{span["Name"]}', {'count': 0, 'seconds': 0.0})
+        total['count'] += 1
+        total['seconds'] += span['Seconds']
+    return {name: dict(t, seconds=round(t['seconds'], 3)) for name, t in sorted(totals.items())}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.workflow', description='Run the evaluation state machine locally against the real Lambda handlers.')
+    parser.add_argument('--source-iac', default='SAM', choices=['CDK', 'Terraform', 'SAM'])
+    parser.add_argument('--stack-kwargs', default='{}', help='JSON keyword arguments for the pipeline stack, e.g. {"batch_evaluation": true}')
+    parser.add_argument('--inputs', type=int, default=20)
+    parser.add_argument('--resources-per-input', type=int, default=10)
+    parser.add_argument('--carried-forward-rate', type=float, default=0.0)
+    parser.add_argument('--s3-latency-ms', type=float, default=10)
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=5)
+    parser.add_argument('--apigw-latency-ms', type=float, default=100)
+    parser.add_argument('--apigw-error-rate', type=float, default=0.0)
+    parser.add_argument('--apigw-throttle-rate', type=float, default=0.0)
+    parser.add_argument('--evaluation-delay-ms', type=float, default=500)
+    parser.add_argument('--non-compliant-rate', type=float, default=0.0)
+    parser.add_argument('--wait-scale', type=float, default=1.0, help='multiplies every retry interval, poll interval and timeout')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--show-logs', action='store_true', help='print the Lambda logs rather than discarding them')
+    args = parser.parse_args(argv)
+
+    stack_kwargs = json.loads(args.stack_kwargs)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        templates = synthesize(source_iac=args.source_iac, **stack_kwargs)
+
+    workflow = LocalWorkflow(
+        templates,
+        wait_scale = args.wait_scale,
+        s3_latency = args.s3_latency_ms / 1000,
+        dynamodb_latency = args.dynamodb_latency_ms / 1000,
+        apigw_latency = args.apigw_latency_ms / 1000,
+        apigw_error_rate = args.apigw_error_rate,
+        apigw_throttle_rate = args.apigw_throttle_rate,
+        evaluation_delay = args.evaluation_delay_ms / 1000,
+        non_compliant_rate = args.non_compliant_rate,
+        results_bucket = stack_kwargs.get('results_bucket') or 'cb-results',
+        seed = args.seed,
+    )
+    execution_id = f'local-{uuid.uuid4().hex[:8]}'
+    codebuild_inputs = workflow.put_inputs(
+        execution_id = execution_id,
+        count = args.inputs,
+        resources_per_input = args.resources_per_input,
+        carried_forward_rate = args.carried_forward_rate,
+        seed = args.seed,
+    )
+    report = workflow.run(execution_id=execution_id, codebuild_inputs=codebuild_inputs, show_logs=args.show_logs)
+    report['stack_kwargs'] = stack_kwargs
+    print(json.dumps(report, indent=2))
+    workflow.background.shutdown(wait=False)
+    return report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+import argparse
+import json
+import os
+import random
+
+# synthetic build outputs shaped like the real ones but at the sizes large application teams produce:
+# a cdk.out with hundreds of stacks across nested stage assemblies next to heavy asset directories,
+# a Terraform plan with tens of thousands of resource changes and a SAM template with many functions;
+# everything is derived from the seed, so the same scale always writes the same bytes
+
+scales = {
+    'small': {
+        'cdk_stacks': 20, 'cdk_stages': 2, 'cdk_stage_depth': 2, 'cdk_resources_per_stack': 20,
+        'cdk_asset_dirs': 4, 'cdk_asset_files_per_dir': 20, 'cdk_asset_file_bytes': 4 * 1024,
+        'tf_resource_changes': 2000, 'tf_modules': 20,
+        'sam_functions': 50,
+    },
+    'medium': {
+        'cdk_stacks': 200, 'cdk_stages': 4, 'cdk_stage_depth': 2, 'cdk_resources_per_stack': 40,
+        'cdk_asset_dirs': 20, 'cdk_asset_files_per_dir': 200, 'cdk_asset_file_bytes': 8 * 1024,
+        'tf_resource_changes': 20000, 'tf_modules': 100,
+        'sam_functions': 300,
+    },
+    'large': {
+        'cdk_stacks': 600, 'cdk_stages': 8, 'cdk_stage_depth': 3, 'cdk_resources_per_stack': 60,
+        'cdk_asset_dirs': 60, 'cdk_asset_files_per_dir': 400, 'cdk_asset_file_bytes': 16 * 1024,
+        'tf_resource_changes': 60000, 'tf_modules': 300,
+        'sam_functions': 1000,
+    },
+}
+
+def write_json(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(content, f, indent=1)
+
+def fake_hash(rng):
+    return '%064x' % rng.getrandbits(256)
+
+def role_resource(rng, name):
+    return {
+        'Type': 'AWS::IAM::Role',
+        'Properties': {
+            'AssumeRolePolicyDocument': {
+                'Statement': [{'Action': 'sts:AssumeRole', 'Effect': 'Allow', 'Principal': {'Service': 'lambda.amazonaws.com'}}],
+                'Version': '2012-10-17',
+            },
+            'ManagedPolicyArns': [{'Fn::Join': ['', ['arn:', {'Ref': 'AWS::Partition'}, ':iam::aws:policy/service-role/AWSLambdaBasicExecutionRole']]}],
+            'Policies': [{
+                'PolicyName': f'{name}Policy',
+                'PolicyDocument': {
+                    'Statement': [
+                        {'Action': rng.sample(['s3:GetObject', 's3:PutObject', 'sqs:SendMessage', 'dynamodb:PutItem', 'dynamodb:Query', 'kms:Decrypt'], 3), 'Effect': 'Allow', 'Resource': '*'}
+                        for _ in range(rng.randint(1, 4))
+                    ],
+                    'Version': '2012-10-17',
+                },
+            }],
+        },
+    }
+
+def cdk_stack_template(rng, *, stack_name, resources, asset_hashes):
+    # CDK-shaped: construct path metadata on every resource, the bootstrap version rule, assets by hash
+    template = {'Resources': {}, 'Outputs': {}}
+    for i in range(resources):
+        kind = rng.choice(['function', 'bucket', 'queue', 'table', 'topic'])
+        name = f'{kind.title()}{i}'
+        if kind == 'function':
+            template['Resources'][f'{name}Role'] = role_resource(rng, name)
+            resource = {
+                'Type': 'AWS::Lambda::Function',
+                'Properties': {
+                    'Code': {'S3Bucket': {'Fn::Sub': 'cdk-hnb659fds-assets-${AWS::AccountId}-${AWS::Region}'}, 'S3Key': f'{rng.choice(asset_hashes)}.zip'},
+                    'Role': {'Fn::GetAtt': [f'{name}Role', 'Arn']},
+                    'Handler': 'index.handler',
+                    'Runtime': rng.choice(['python3.9', 'nodejs18.x']),
+                    'MemorySize': rng.choice([128, 256, 512, 1024]),
+                    'Timeout': rng.choice([3, 30, 60, 300]),
+                    'Environment': {'Variables': {f'VAR_{v}': fake_hash(rng)[:16] for v in range(rng.randint(0, 8))}},
+                },
+                'DependsOn': [f'{name}Role'],
+            }
+        elif kind == 'bucket':
+            resource = {
+                'Type': 'AWS::S3::Bucket',
+                'Properties': {
+                    'BucketEncryption': {'ServerSideEncryptionConfiguration': [{'ServerSideEncryptionByDefault': {'SSEAlgorithm': rng.choice(['AES256', 'aws:kms'])}}]},
+                    'PublicAccessBlockConfiguration': {k: rng.random() > 0.1 for k in ['BlockPublicAcls', 'BlockPublicPolicy', 'IgnorePublicAcls', 'RestrictPublicBuckets']},
+                    'VersioningConfiguration': {'Status': rng.choice(['Enabled', 'Suspended'])},
+                },
+                'UpdateReplacePolicy': 'Retain',
+                'DeletionPolicy': 'Retain',
+            }
+        elif kind == 'queue':
+            resource = {
+                'Type': 'AWS::SQS::Queue',
+                'Properties': {'VisibilityTimeout': rng.choice([30, 300, 900]), 'ContentBasedDeduplication': rng.random() > 0.5, 'FifoQueue': True},
+            }
+        elif kind == 'table':
+            resource = {
+                'Type': 'AWS::DynamoDB::Table',
+                'Properties': {
+                    'KeySchema': [{'AttributeName': 'pk', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+                    'AttributeDefinitions': [{'AttributeName': 'pk', 'AttributeType': 'S'}, {'AttributeName': 'sk', 'AttributeType': 'S'}],
+                    'BillingMode': 'PAY_PER_REQUEST',
+                    'PointInTimeRecoverySpecification': {'PointInTimeRecoveryEnabled': rng.random() > 0.3},
+                },
+            }
+        else:
+            resource = {'Type': 'AWS::SNS::Topic', 'Properties': {'KmsMasterKeyId': 'alias/aws/sns'}}
+            template['Outputs'][f'{name}Arn'] = {'Value': {'Ref': name}, 'Export': {'Name': f'{stack_name}:{name}Arn'}}
+        resource['Metadata'] = {'aws:cdk:path': f'{stack_name}/{name}/Resource'}
+        template['Resources'][name] = resource
+    template['Parameters'] = {
+        'BootstrapVersion': {'Type': 'AWS::SSM::Parameter::Value<String>', 'Default': '/cdk-bootstrap/hnb659fds/version'},
+    }
+    template['Rules'] = {
+        'CheckBootstrapVersion': {
+            'Assertions': [{'Assert': {'Fn::Not': [{'Fn::Contains': [['1', '2', '3', '4', '5'], {'Ref': 'BootstrapVersion'}]}]}}],
+        },
+    }
+    return template
+
+def write_asset_dir(rng, *, asset_dir, files, file_bytes):
+    # a bundled Lambda asset, incompressible bytes with some decoy templates and manifests that
+    # the cdk.out discovery must never read
+    for i in range(files):
+        package = f'node_modules/pkg{i % 25}'
+        if i % 50 == 0:
+            write_json(os.path.join(asset_dir, package, 'package.template.json'), {'Resources': {}})
+            write_json(os.path.join(asset_dir, package, 'manifest.json'), {'artifacts': {}})
+        path = os.path.join(asset_dir, package, f'file{i}.js')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(rng.randbytes(file_bytes))
+
+def write_assembly(rng, *, assembly_dir, prefix, stacks, stages, depth, resources_per_stack, asset_hashes):
+    # this assembly's own stacks plus a nested stage assembly per stage, each with a manifest
+    artifacts = {}
+    per_assembly = stacks // (stages + 1) if depth > 0 and stages else stacks
+    for i in range(per_assembly):
+        stack_name = f'{prefix}Stack{i}'
+        resources = max(1, int(resources_per_stack * rng.uniform(0.5, 1.5)))
+        write_json(os.path.join(assembly_dir, f'{stack_name}.template.json'), cdk_stack_template(rng, stack_name=stack_name, resources=resources, asset_hashes=asset_hashes))
+        artifacts[stack_name] = {
+            'type': 'aws:cloudformation:stack',
+            'environment': 'aws://unknown-account/unknown-region',
+            'properties': {
+                'templateFile': f'{stack_name}.template.json',
+                'validateOnSynth': False,
+                'assumeRoleArn': 'arn:${AWS::Partition}:iam::${AWS::AccountId}:role/cdk-hnb659fds-deploy-role-${AWS::AccountId}-${AWS::Region}',
+            },
+            'dependencies': [f'{stack_name}.assets'],
+            'displayName': stack_name,
+        }
+    written = per_assembly
+    if depth > 0 and stages:
+        remaining = stacks - per_assembly
+        for s in range(stages):
+            stage = f'{prefix}Stage{s}'
+            stage_stacks = remaining // stages + (1 if s < remaining % stages else 0)
+            written += write_assembly(
+                rng,
+                assembly_dir = os.path.join(assembly_dir, f'assembly-{stage}'),
+                prefix = stage,
+                stacks = stage_stacks,
+                stages = max(1, stages // 2),
+                depth = depth - 1,
+                resources_per_stack = resources_per_stack,
+                asset_hashes = asset_hashes,
+            )
+            artifacts[f'assembly-{stage}'] = {
+                'type': 'cdk:cloud-assembly',
+                'properties': {'directoryName': f'assembly-{stage}', 'displayName': stage},
+            }
+    artifacts['Tree'] = {'type': 'cdk:tree', 'properties': {'file': 'tree.json'}}
+    write_json(os.path.join(assembly_dir, 'manifest.json'), {'version': '21.0.0', 'artifacts': artifacts})
+    return written
+
+def generate_cdk_out(source_dir, *, stacks, stages, stage_depth, resources_per_stack, asset_dirs, asset_files_per_dir, asset_file_bytes, seed=0):
+    rng = random.Random(seed)
+    cdk_out = os.path.join(source_dir, 'cdk.out')
+    asset_hashes = [fake_hash(rng) for _ in range(asset_dirs)]
+    for asset_hash in asset_hashes:
+        write_asset_dir(rng, asset_dir=os.path.join(cdk_out, f'asset.{asset_hash}'), files=asset_files_per_dir, file_bytes=asset_file_bytes)
+    return write_assembly(
+        rng,
+        assembly_dir = cdk_out,
+        prefix = '',
+        stacks = stacks,
+        stages = stages,
+        depth = stage_depth,
+        resources_per_stack = resources_per_stack,
+        asset_hashes = asset_hashes or ['0' * 64],
+    )
+
+# resource change actions in roughly the proportions of a mature workspace's plan
+tf_actions = [
+    (['no-op'], 0.55),
+    (['create'], 0.2),
+    (['update'], 0.15),
+    (['delete'], 0.04),
+    (['read'], 0.03),
+    (['delete', 'create'], 0.03),
+]
+
+tf_resource_types = ['aws_s3_bucket', 'aws_iam_role', 'aws_iam_role_policy', 'aws_lambda_function', 'aws_sqs_queue', 'aws_security_group', 'aws_instance']
+
+def tf_values(rng, resource_type, index):
+    values = {
+        'arn': f'arn:aws:{resource_type.split("_")[1]}:us-east-1:123456789012:{resource_type}/{index}',
+        'id': fake_hash(rng)[:20],
+        'tags': {'Team': rng.choice(['a', 'b', 'c']), 'CostCenter': str(rng.randint(1000, 9999))},
+        'tags_all': {'Team': rng.choice(['a', 'b', 'c'])},
+    }
+    if resource_type == 'aws_security_group':
+        values['ingress'] = [{'from_port': p, 'to_port': p, 'protocol': 'tcp', 'cidr_blocks': [rng.choice(['10.0.0.0/8', '0.0.0.0/0'])]} for p in rng.sample([22, 80, 443, 5432, 6379], 2)]
+    if resource_type in ('aws_iam_role', 'aws_iam_role_policy'):
+        values['policy'] = json.dumps({'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': ['s3:*'], 'Resource': '*'}]})
+    if resource_type == 'aws_instance':
+        values.update({'ami': f'ami-{fake_hash(rng)[:17]}', 'instance_type': rng.choice(['t3.micro', 'm5.large']), 'user_data': fake_hash(rng) * 8})
+    return values
+
+def tf_resource_change(rng, index, modules):
+    resource_type = rng.choice(tf_resource_types)
+    actions = rng.choices([a for a, _ in tf_actions], weights=[w for _, w in tf_actions])[0]
+    module = rng.randrange(modules + 1)
+    # every tenth module is a for_each instance, whose key can hold any character
+    module_address = None if module == 0 else (f'module.m{module}["key/{module}"]' if module % 10 == 0 else f'module.m{module}')
+    name = f'r{index % 97}'
+    address = f'{resource_type}.{name}[{index}]'
+    before = None if actions == ['create'] else tf_values(rng, resource_type, index)
+    after = None if actions == ['delete'] else tf_values(rng, resource_type, index)
+    change = {
+        'address': f'{module_address}.{address}' if module_address else address,
+        'mode': 'data' if actions == ['read'] else 'managed',
+        'type': resource_type,
+        'name': name,
+        'index': index,
+        'provider_name': 'registry.terraform.io/hashicorp/aws',
+        'change': {
+            'actions': actions,
+            'before': before,
+            'after': after,
+            'after_unknown': {'arn': True, 'id': True} if after and actions != ['no-op'] else {},
+            'before_sensitive': {} if before else False,
+            'after_sensitive': {} if after else False,
+        },
+    }
+    if module_address:
+        change['module_address'] = module_address
+    return change
+
+def generate_tfplan(path, *, resource_changes, modules, seed=0):
+    # written one resource change at a time, so a plan larger than memory can be generated;
+    # planned_values, prior_state and configuration carry the weight a real plan has outside resource_changes
+    rng = random.Random(seed)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.write('{"format_version": "1.1", "terraform_version": "1.2.0", "resource_changes": [')
+        planned = []
+        for i in range(resource_changes):
+            change = tf_resource_change(rng, i, modules)
+            f.write((', ' if i else '') + json.dumps(change))
+            if change['change']['after'] is not None and i % 4 == 0:
+                planned.append({'address': change['address'], 'type': change['type'], 'values': change['change']['after']})
+        f.write('], "planned_values": {"root_module": {"resources": ')
+        f.write(json.dumps(planned))
+        f.write('}}, "prior_state": {"format_version": "1.0", "values": {"root_module": {"resources": ')
+        f.write(json.dumps(planned[: len(planned) // 2]))
+        f.write('}}}, "configuration": {"provider_config": {"aws": {"name": "aws", "expressions": {"region": {"constant_value": "us-east-1"}}}}, "root_module": {"module_calls": ')
+        f.write(json.dumps({f'm{m}': {'source': f'./modules/m{m}', 'module': {'resources': [{'address': f'{t}.r', 'type': t} for t in tf_resource_types]}} for m in range(1, modules + 1)}))
+        f.write('}}}')
+    return resource_changes
+
+def generate_sam_template(path, *, functions, seed=0):
+    # a packaged template, CodeUri already rewritten to the uploaded artifact
+    rng = random.Random(seed)
+    resources = {}
+    for i in range(functions):
+        name = f'Function{i}'
+        resources[name] = {
+            'Type': 'AWS::Serverless::Function',
+            'Properties': {
+                'CodeUri': f's3://sam-artifacts-123456789012/{fake_hash(rng)[:32]}',
+                'Handler': 'app.lambda_handler',
+                'Runtime': rng.choice(['python3.9', 'nodejs18.x']),
+                'MemorySize': rng.choice([128, 512, 1024]),
+                'Environment': {'Variables': {f'VAR_{v}': fake_hash(rng)[:16] for v in range(rng.randint(0, 6))}},
+                'Policies': [rng.choice(['AWSLambdaBasicExecutionRole', {'S3ReadPolicy': {'BucketName': f'bucket-{i}'}}, {'DynamoDBCrudPolicy': {'TableName': {'Ref': 'Table'}}}])],
+                'Events': {
+                    f'Api{e}': {'Type': 'Api', 'Properties': {'Path': f'/{name.lower()}/{e}', 'Method': rng.choice(['get', 'post'])}}
+                    for e in range(rng.randint(1, 3))
+                },
+            },
+            'Metadata': {'SamResourceId': name},
+        }
+    resources['Table'] = {'Type': 'AWS::Serverless::SimpleTable', 'Properties': {'PrimaryKey': {'Name': 'id', 'Type': 'String'}}}
+    write_json(path, {
+        'AWSTemplateFormatVersion': '2010-09-09',
+        'Transform': 'AWS::Serverless-2016-10-31',
+        'Globals': {'Function': {'Timeout': 30, 'Tracing': 'Active'}},
+        'Resources': resources,
+        'Outputs': {f'{n}Arn': {'Value': {'Fn::GetAtt': [n, 'Arn']}} for n in list(resources)[:50] if n != 'Table'},
+    })
+    return functions
+
+def generate_source_dir(source_dir, *, scale='medium', seed=0, **overrides):
+    # a CodeBuild source directory holding every IaC type, as the collector finds them
+    settings = dict(scales[scale], **overrides)
+    generated = {
+        'CDK': generate_cdk_out(
+            source_dir,
+            stacks = settings['cdk_stacks'],
+            stages = settings['cdk_stages'],
+            stage_depth = settings['cdk_stage_depth'],
+            resources_per_stack = settings['cdk_resources_per_stack'],
+            asset_dirs = settings['cdk_asset_dirs'],
+            asset_files_per_dir = settings['cdk_asset_files_per_dir'],
+            asset_file_bytes = settings['cdk_asset_file_bytes'],
+            seed = seed,
+        ),
+        'Terraform': generate_tfplan(
+            os.path.join(source_dir, 'tfplan.json'),
+            resource_changes = settings['tf_resource_changes'],
+            modules = settings['tf_modules'],
+            seed = seed,
+        ),
+        'SAM': generate_sam_template(
+            os.path.join(source_dir, 'sam_packaged_template.json'),
+            functions = settings['sam_functions'],
+            seed = seed,
+        ),
+    }
+    workload = {'scale': scale, 'seed': seed, 'settings': settings, 'generated': generated}
+    write_json(os.path.join(source_dir, 'workload.json'), workload)
+    return workload
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.workloads', description='Generate a synthetic CodeBuild source directory with CDK, Terraform and SAM inputs.')
+    parser.add_argument('source_dir')
+    parser.add_argument('--scale', default='medium', choices=sorted(scales))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    print(json.dumps(generate_source_dir(args.source_dir, scale=args.scale, seed=args.seed), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import json
+from aws_cdk import (
+    CfnOutput,
+    Duration,
+    Stack,
+    aws_iam,
+    aws_lambda,
+    aws_lambda_event_sources,
+    aws_sqs,
+    aws_lambda_python_alpha, #experimental
+)
+from constructs import Construct
+
+
+class ControlBrokerEvaluationServiceStack(Stack):
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        control_broker_apigw_url:str,
+        max_workers:int = 5,
+        batch_chunk_size:int = 10,
+        apigw_requests_per_second:float = 10,
+        apigw_burst:int = 10,
+        apigw_max_retries:int = 5,
+        log_level:str = "INFO",
+        log_sample_rate:float = 0,
+        tracing:bool = False,
+        **kwargs,
+    ) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        self.control_broker_apigw_url = control_broker_apigw_url
+        self.max_workers = max_workers
+        self.batch_chunk_size = batch_chunk_size
+        self.apigw_requests_per_second = apigw_requests_per_second
+        self.apigw_burst = apigw_burst
+        self.apigw_max_retries = apigw_max_retries
+        self.log_level = log_level
+        self.log_sample_rate = log_sample_rate
+        self.tracing = tracing
+
+        # each invocation stops short of its timeout and queues the rest of its request, so a request
+        # is never cut off mid-evaluation
+        self.worker_timeout = Duration.minutes(15)
+        self.max_receive_count = 2
+
+        self.evaluation_queue()
+        self.evaluation_workers()
+
+    def evaluation_queue(self):
+
+        # one message per pipeline execution, grouped by pipeline so a burst from one pipeline
+        # is interleaved with the others rather than queued ahead of them
+
+        self.queue_evaluation_dead_letter = aws_sqs.Queue(
+            self,
+            "EvaluationServiceDeadLetterQueue",
+            fifo=True,
+            retention_period=Duration.days(4),
+        )
+
+        self.queue_evaluation = aws_sqs.Queue(
+            self,
+            "EvaluationServiceQueue",
+            fifo=True,
+            # just over the worker timeout, so both receives of a failed invocation's message fit well within
+            # the hour consumers wait by default
+            visibility_timeout=self.worker_timeout.plus(Duration.minutes(1)),
+            dead_letter_queue=aws_sqs.DeadLetterQueue(
+                max_receive_count=self.max_receive_count,
+                queue=self.queue_evaluation_dead_letter,
+            ),
+        )
+
+        CfnOutput(
+            self,
+            "EvaluationServiceQueueArn",
+            value=self.queue_evaluation.queue_arn,
+        )
+
+    def evaluation_workers(self):
+
+        # evaluates like SignApigwRequest, through the same client in the evaluation_results layer,
+        # each invocation evaluates one pipeline execution's inputs
+
+        environment = {
+            "ApigwInvokeUrl" : self.control_broker_apigw_url,
+            # overridden by the Context each pipeline sends
+            "PipelineOwnershipMetadata": json.dumps({}),
+            "BatchChunkSize": str(self.batch_chunk_size),
+            # per worker, the service-wide rate is at most max_workers times this
+            "ApigwRequestsPerSecond": str(self.apigw_requests_per_second),
+            "ApigwBurst": str(self.apigw_burst),
+            "ApigwMaxRetries": str(self.apigw_max_retries),
+            "EvaluationQueueUrl": self.queue_evaluation.queue_url,
+            "MaxReceiveCount": str(self.max_receive_count),
+            "LogLevel": self.log_level,
+            "LogSampleRate": str(self.log_sample_rate),
+        }
+        layers = [
+            aws_lambda.LayerVersion(self,
+                "EvaluationResults",
+                code=aws_lambda.Code.from_asset("./supplementary_files/lambda_layers/evaluation_results"),
+                compatible_runtimes=[
+                    aws_lambda.Runtime.PYTHON_3_9
+                ]
+            ),
+            aws_lambda.LayerVersion(self,
+                "StructuredLogging",
+                code=aws_lambda.Code.from_asset("./supplementary_files/lambda_layers/structured_logging"),
+                compatible_runtimes=[
+                    aws_lambda.Runtime.PYTHON_3_9
+                ]
+            ),
+            aws_lambda.LayerVersion(self,
+                "Tracing",
+                code=aws_lambda.Code.from_asset("./supplementary_files/lambda_layers/tracing"),
+                compatible_runtimes=[
+                    aws_lambda.Runtime.PYTHON_3_9
+                ]
+            ),
+        ]
+        if self.tracing:
+            layers.append(
+                aws_lambda_python_alpha.PythonLayerVersion(self,
+                    "XRaySdk",
+                    entry="./supplementary_files/lambda_layers/xray",
+                    compatible_runtimes=[
+                        aws_lambda.Runtime.PYTHON_3_9
+                    ]
+                )
+            )
+            environment["TracingExporter"] = "xray"
+
+        self.lambda_evaluation_worker = aws_lambda_python_alpha.PythonFunction(
+            self,
+            "EvaluationServiceWorker",
+            entry="./supplementary_files/lambdas/evaluation_service_worker",
+            runtime= aws_lambda.Runtime.PYTHON_3_9,
+            index="lambda_function.py",
+            handler="lambda_handler",
+            timeout=self.worker_timeout,
+            memory_size=1024,
+            environment = environment,
+            layers = layers,
+            tracing=aws_lambda.Tracing.ACTIVE if self.tracing else None,
+        )
+
+        self.lambda_evaluation_worker.add_event_source(
+            aws_lambda_event_sources.SqsEventSource(
+                self.queue_evaluation,
+                # one pipeline execution per invocation, so a long one doesn't hold up the rest of a batch
+                batch_size=1,
+                max_concurrency=self.max_workers,
+                report_batch_item_failures=True,
+            )
+        )
+
+        self.lambda_evaluation_worker.role.add_to_policy(
+            aws_iam.PolicyStatement(
+                actions=[
+                    "states:SendTaskSuccess",
+                    "states:SendTaskFailure",
+                ],
+                # consumer state machines are deployed separately
+                resources=["*"],
+            )
+        )
+
+        # what is left of a request that would not finish in one invocation is sent back to the queue
+        self.queue_evaluation.grant_send_messages(self.lambda_evaluation_worker)
+
+        CfnOutput(
+            self,
+            "EvaluationServiceWorkerRoleArn",
+            value=self.lambda_evaluation_worker.role.role_arn,
+        )
@@ -1,7 +1,9 @@
 import os
 import json
+import re
 from typing import List
 from aws_cdk import (
+    Annotations,
     CfnOutput,
     Duration,
     RemovalPolicy,
@@ -12,12 +14,14 @@ from aws_cdk import (
     aws_codepipeline_actions,
     aws_iam,
     aws_lambda,
+    aws_lambda_event_sources,
     aws_dynamodb,
     aws_s3,
     aws_s3_deployment,
     aws_stepfunctions,
     aws_logs,
     aws_events,
+    aws_events_targets,
     aws_sqs,
     aws_lambda_python_alpha, #experimental
 )
@@ -32,6 +36,44 @@ class ControlBrokerCodepipelineExampleStack(Stack):
         pipeline_ownership_metadata:dict,
         control_broker_apigw_url:str,
         source_iac:str,
+        upload_max_workers:int = 8,
+        upload_part_size_mb:int = 8,
+        upload_max_concurrency:int = 10,
+        content_addressed_uploads:bool = False,
+        verdict_cache:bool = False,
+        verdict_cache_ttl_days:int = 7,
+        policy_fingerprint:str = None,
+        batch_evaluation:bool = False,
+        batch_chunk_size:int = 10,
+        max_concurrency:int = 0,
+        apigw_requests_per_second:float = 10,
+        apigw_burst:int = 10,
+        apigw_max_retries:int = 5,
+        results_callback:bool = False,
+        results_bucket:str = None,
+        results_callback_timeout_seconds:int = 300,
+        compact_results:bool = False,
+        fail_fast:bool = False,
+        tfplan_shard_by:str = None,
+        tfplan_shard_size:int = 500,
+        slim_tfplan:bool = False,
+        cb_inputs_encoding:str = None,
+        apigw_request_content_encoding:str = None,
+        toolchain_cache:str = None,
+        terraform_version:str = "1.2.0",
+        sam_cli_version:str = "1.53.0",
+        sam_cli_sha256:str = None,
+        lean_artifacts:bool = False,
+        artifact_extra_files:List[str] = None,
+        streaming_evaluation:bool = False,
+        streaming_collect_timeout_seconds:int = 1200,
+        evaluation_service_queue_arn:str = None,
+        evaluation_service_worker_role_arn:str = None,
+        evaluation_service_timeout_seconds:int = 3600,
+        incremental_evaluation:bool = False,
+        log_level:str = "INFO",
+        log_sample_rate:float = 0,
+        tracing:bool = False,
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -39,26 +81,107 @@ class ControlBrokerCodepipelineExampleStack(Stack):
         self.pipeline_ownership_metadata = pipeline_ownership_metadata
         self.control_broker_apigw_url = control_broker_apigw_url
         self.source_iac = source_iac
-        
+        self.upload_max_workers = upload_max_workers
+        self.upload_part_size_mb = upload_part_size_mb
+        self.upload_max_concurrency = upload_max_concurrency
+        self.content_addressed_uploads = content_addressed_uploads
+        self.verdict_cache = verdict_cache
+        self.verdict_cache_ttl_days = verdict_cache_ttl_days
+        self.policy_fingerprint = policy_fingerprint
+        self.batch_evaluation = batch_evaluation
+        self.batch_chunk_size = batch_chunk_size
+        self.max_concurrency = max_concurrency
+        self.apigw_requests_per_second = apigw_requests_per_second
+        self.apigw_burst = apigw_burst
+        self.apigw_max_retries = apigw_max_retries
+        self.results_callback = results_callback
+        self.results_bucket = results_bucket
+        self.results_callback_timeout_seconds = results_callback_timeout_seconds
+        self.compact_results = compact_results
+        self.fail_fast = fail_fast
+        self.tfplan_shard_by = tfplan_shard_by
+        self.tfplan_shard_size = tfplan_shard_size
+        self.slim_tfplan = slim_tfplan
+        self.cb_inputs_encoding = cb_inputs_encoding
+        self.apigw_request_content_encoding = apigw_request_content_encoding
+        self.toolchain_cache = toolchain_cache
+        self.terraform_version = terraform_version
+        self.sam_cli_version = sam_cli_version
+        self.sam_cli_sha256 = sam_cli_sha256
+        self.lean_artifacts = lean_artifacts
+        self.artifact_extra_files = artifact_extra_files or []
+        self.streaming_evaluation = streaming_evaluation
+        self.streaming_collect_timeout_seconds = streaming_collect_timeout_seconds
+        self.evaluation_service_queue_arn = evaluation_service_queue_arn
+        self.evaluation_service_worker_role_arn = evaluation_service_worker_role_arn
+        self.evaluation_service_timeout_seconds = evaluation_service_timeout_seconds
+        self.incremental_evaluation = incremental_evaluation
+        self.log_level = log_level
+        self.log_sample_rate = log_sample_rate
+        self.tracing = tracing
+
+        # SAM publishes no checksum file to verify against, so the digest is pinned with the version;
+        # until one is configured the build warns and installs the zip unverified
+        if self.sam_cli_sha256 and not re.fullmatch(r"[0-9a-f]{64}", self.sam_cli_sha256):
+            raise ValueError(f"sam_cli_sha256 needs the SHA-256 of aws-sam-cli-linux-x86_64.zip for SAM CLI {self.sam_cli_version}")
+        if self.source_iac == "SAM" and not self.sam_cli_sha256:
+            Annotations.of(self).add_warning(f"sam_cli_sha256 is not set, SAM CLI {self.sam_cli_version} is installed without verifying its download")
+
+        # the notification rule matches on the bucket name, without one it would match nothing
+        if self.results_callback and not self.results_bucket:
+            raise ValueError("results_callback needs results_bucket, the Control Broker results bucket")
+
+        # the shared evaluation service replaces every in-stack evaluation mode
+        if self.evaluation_service_queue_arn:
+            self.streaming_evaluation = False
+
+        # a streamed input is received at most this many times, each receive hidden for a little longer
+        # than the StreamEvaluate timeout
+        self.evaluation_queue_max_receive_count = 3
+        self.evaluation_queue_visibility_timeout = Duration.minutes(6)
+
+        # the collector has to outlast every receive of an input, the last one records its error
+        collect_seconds_needed = self.evaluation_queue_max_receive_count * self.evaluation_queue_visibility_timeout.to_seconds()
+        if self.streaming_evaluation and self.streaming_collect_timeout_seconds <= collect_seconds_needed:
+            raise ValueError(f"streaming_collect_timeout_seconds has to be over {collect_seconds_needed}, every receive of a streamed input")
+
         self.layers = {
-            "aws_requests_auth": aws_lambda_python_alpha.PythonLayerVersion(
-                self,
-                "aws_requests_auth",
-                entry="./supplementary_files/lambda_layers/aws_requests_auth",
+            "requests": aws_lambda_python_alpha.PythonLayerVersion(self,
+                "requests",
+                entry="./supplementary_files/lambda_layers/requests",
                 compatible_runtimes=[
                     aws_lambda.Runtime.PYTHON_3_9
                 ]
             ),
-            "requests": aws_lambda_python_alpha.PythonLayerVersion(self,
-                "requests",
-                entry="./supplementary_files/lambda_layers/requests",
+            # plain source, nothing to install
+            "structured_logging": aws_lambda.LayerVersion(self,
+                "StructuredLogging",
+                code=aws_lambda.Code.from_asset("./supplementary_files/lambda_layers/structured_logging"),
                 compatible_runtimes=[
                     aws_lambda.Runtime.PYTHON_3_9
                 ]
-            )
+            ),
+            # verdict records, results reports and embedded metrics, shared by every function that builds or reads them
+            "evaluation_results": aws_lambda.LayerVersion(self,
+                "EvaluationResults",
+                code=aws_lambda.Code.from_asset("./supplementary_files/lambda_layers/evaluation_results"),
+                compatible_runtimes=[
+                    aws_lambda.Runtime.PYTHON_3_9
+                ]
+            ),
+            # imported whether or not tracing is on, a no-op without the XRaySdk layer's exporter
+            "tracing": aws_lambda.LayerVersion(self,
+                "Tracing",
+                code=aws_lambda.Code.from_asset("./supplementary_files/lambda_layers/tracing"),
+                compatible_runtimes=[
+                    aws_lambda.Runtime.PYTHON_3_9
+                ]
+            ),
         }
         
         self.source()
+        if self.streaming_evaluation:
+            self.evaluation_queue()
         if self.source_iac == "CDK":
             self.cdk_synth()
         if self.source_iac == "Terraform":
@@ -68,6 +191,19 @@ class ControlBrokerCodepipelineExampleStack(Stack):
         
         
         self.evaluate_wrapper_sfn_lambdas()
+        if self.streaming_evaluation:
+            self.evaluate_streaming()
+        if self.evaluation_service_queue_arn:
+            self.evaluate_with_service()
+        if self.verdict_cache:
+            self.evaluate_verdict_cache()
+        if self.results_callback:
+            self.evaluate_results_callback()
+        if self.compact_results:
+            self.evaluate_compact_results()
+        self.evaluation_metrics()
+        self.evaluation_logging()
+        self.evaluation_tracing()
         self.evaluate_wrapper_sfn()
         self.pipeline()
     
@@ -94,6 +230,63 @@ class ControlBrokerCodepipelineExampleStack(Stack):
             output=self.artifact_source,
         )
         
+    def build_cache(self):
+        
+        # toolchain downloads, pip wheels and terraform providers, listed in each buildspec's cache paths
+        
+        if self.toolchain_cache == "s3":
+            
+            self.bucket_build_cache = aws_s3.Bucket(
+                self,
+                "BuildCache",
+                block_public_access=aws_s3.BlockPublicAccess.BLOCK_ALL,
+                removal_policy=RemovalPolicy.DESTROY,
+                auto_delete_objects=True,
+            )
+            
+            return aws_codebuild.Cache.bucket(self.bucket_build_cache, prefix=self.source_iac)
+        
+        # best effort, only reused while the build host is warm
+        if self.toolchain_cache == "local":
+            return aws_codebuild.Cache.local(aws_codebuild.LocalCacheMode.CUSTOM)
+        
+        return aws_codebuild.Cache.none()
+    
+    def build_artifacts(self):
+        
+        # the StepFunctionInvokeAction only reads the inputs file, the rest of the workspace is zip and upload time
+        
+        if not self.lean_artifacts:
+            return {
+                "files": ["**/*"],
+                "discard-paths": "no",
+                "enable-symlinks": "yes",
+            }
+        
+        return {
+            "files": [self.codebuild_to_sfn_artifact_file] + self.artifact_extra_files,
+            "discard-paths": "no",
+        }
+    
+    def artifact_size_commands(self):
+        
+        files = " ".join(self.build_artifacts()["files"]) if self.lean_artifacts else "."
+        
+        return [
+            "echo \"workspace bytes: $(du -sb . | cut -f1)\"",
+            f"echo \"artifact bytes: $(du -cb {files} | tail -1 | cut -f1)\"",
+        ]
+    
+    def codebuild_utils_source(self):
+        
+        # the cb_input_collector package, synced into the build's source directory and run with python3 -m
+        
+        # will fail if empty file/dir exists, e.g. __init__.py. See: https://github.com/aws/aws-cdk/issues/19012
+        return aws_s3_deployment.Source.asset(
+            "./supplementary_files/codebuild_utils",
+            exclude=["**/__pycache__"],
+        )
+        
     def cdk_synth(self):
         
         # synthed templates
@@ -126,7 +319,7 @@ class ControlBrokerCodepipelineExampleStack(Stack):
             self,
             "ParseCdkOutToCBInput",
             sources=[
-                aws_s3_deployment.Source.asset(f"./supplementary_files/codebuild_utils/synth_utils")
+                self.codebuild_utils_source()
             ],
             destination_bucket=self.bucket_synth_utils,
             retain_on_delete=False,
@@ -182,6 +375,7 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                 build_image = aws_codebuild.LinuxBuildImage.STANDARD_3_0
             ),
             role = role_synth,
+            cache = self.build_cache(),
             build_spec=aws_codebuild.BuildSpec.from_object(
                 {
                     "version": "0.2",
@@ -208,24 +402,38 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                                 "ls cdk.out",
                                 f"aws s3 sync s3://{self.bucket_synth_utils.bucket_name} .",
                                 "pip install -r requirements.txt",
-                                f"python3 parse_cdk_out_to_cb_input.py {self.codebuild_to_sfn_artifact_file} $CODEPIPELINE_EXECUTION_ID",
+                                f"python3 -m cb_input_collector {self.codebuild_to_sfn_artifact_file} $CODEPIPELINE_EXECUTION_ID --iac {self.source_iac}",
+                                *self.artifact_size_commands(),
                             ],
                         },
                     },
-                    "artifacts": {
-                        "files": ["**/*"],
-                        "discard-paths": "no",
-                        "enable-symlinks": "yes",
+                    "cache": {
+                        "paths": [
+                            "/root/.npm/**/*",
+                            "/root/.cache/pip/**/*",
+                        ]
                     },
+                    "artifacts": self.build_artifacts(),
                 }
             ),
             environment_variables={
                 "SynthedTemplatesBucket": aws_codebuild.BuildEnvironmentVariable(value=self.bucket_synthed_templates.bucket_name),
                 "PipelineOwnershipMetadata": aws_codebuild.BuildEnvironmentVariable(value=json.dumps(self.pipeline_ownership_metadata)),
+                "UploadMaxWorkers": aws_codebuild.BuildEnvironmentVariable(value=str(self.upload_max_workers)),
+                "UploadPartSizeMB": aws_codebuild.BuildEnvironmentVariable(value=str(self.upload_part_size_mb)),
+                "UploadMaxConcurrency": aws_codebuild.BuildEnvironmentVariable(value=str(self.upload_max_concurrency)),
+                "ContentAddressedUploads": aws_codebuild.BuildEnvironmentVariable(value=str(self.content_addressed_uploads).lower()),
+                "CBInputsEncoding": aws_codebuild.BuildEnvironmentVariable(value=self.cb_inputs_encoding or ""),
+                "EvaluationQueueUrl": aws_codebuild.BuildEnvironmentVariable(value=self.queue_evaluation.queue_url if self.streaming_evaluation else ""),
+                "IncrementalEvaluation": aws_codebuild.BuildEnvironmentVariable(value=str(self.incremental_evaluation).lower()),
+                "PolicyFingerprint": aws_codebuild.BuildEnvironmentVariable(value=self.policy_fingerprint or ""),
             }
             
         )
 
+        if self.streaming_evaluation:
+            self.queue_evaluation.grant_send_messages(role_synth)
+
         self.artifact_built = aws_codepipeline.Artifact()
 
         self.action_build = aws_codepipeline_actions.CodeBuildAction(
@@ -275,7 +483,7 @@ class ControlBrokerCodepipelineExampleStack(Stack):
             self,
             "ParseTFPlanOutputToCBInput",
             sources=[
-                aws_s3_deployment.Source.asset(f"./supplementary_files/codebuild_utils/tfplan_utils")
+                self.codebuild_utils_source()
             ],
             destination_bucket=self.bucket_tfplan_utils,
             retain_on_delete=False,
@@ -354,6 +562,7 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                 build_image = aws_codebuild.LinuxBuildImage.STANDARD_3_0
             ),
             role = role_tfplan,
+            cache = self.build_cache(),
             build_spec=aws_codebuild.BuildSpec.from_object(
                 {
                     "version": "0.2",
@@ -361,8 +570,14 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                         "install": {
                             "on-failure": "ABORT",
                             "commands": [
-                                "curl -s -qL -o terraform_install.zip https://releases.hashicorp.com/terraform/1.2.0/terraform_1.2.0_linux_386.zip",
-                                "unzip terraform_install.zip -d /usr/bin/",
+                                "mkdir -p ${ToolchainDir} ${TF_PLUGIN_CACHE_DIR}",
+                                "TF_ZIP=terraform_${TerraformVersion}_linux_386.zip",
+                                "[ -f ${ToolchainDir}/terraform_${TerraformVersion}_SHA256SUMS ] || curl -s -qL -o ${ToolchainDir}/terraform_${TerraformVersion}_SHA256SUMS https://releases.hashicorp.com/terraform/${TerraformVersion}/terraform_${TerraformVersion}_SHA256SUMS",
+                                "grep \" ${TF_ZIP}$\" ${ToolchainDir}/terraform_${TerraformVersion}_SHA256SUMS > ${ToolchainDir}/${TF_ZIP}.sha256",
+                                # a cached zip that still matches is not downloaded again
+                                "(cd ${ToolchainDir} && sha256sum -c --status ${TF_ZIP}.sha256 2>/dev/null) || curl -s -qL -o ${ToolchainDir}/${TF_ZIP} https://releases.hashicorp.com/terraform/${TerraformVersion}/${TF_ZIP}",
+                                "(cd ${ToolchainDir} && sha256sum -c ${TF_ZIP}.sha256)",
+                                "unzip -o ${ToolchainDir}/${TF_ZIP} -d /usr/bin/",
                                 "chmod +x /usr/bin/terraform",
                                 "terraform -version",
                             ],
@@ -379,25 +594,46 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                                 "ls",
                                 f"aws s3 sync s3://{self.bucket_tfplan_utils.bucket_name} .",
                                 "pip install -r requirements.txt",
-                                f"python3 parse_tfplan_to_cb_input.py {self.codebuild_to_sfn_artifact_file} $CODEPIPELINE_EXECUTION_ID",
+                                f"python3 -m cb_input_collector {self.codebuild_to_sfn_artifact_file} $CODEPIPELINE_EXECUTION_ID --iac {self.source_iac}",
+                                *self.artifact_size_commands(),
                             ],
                         },
                     },
-                    "artifacts": {
-                        "files": ["**/*"],
-                        "discard-paths": "no",
-                        "enable-symlinks": "yes",
+                    "cache": {
+                        "paths": [
+                            "/root/.toolchain/**/*",
+                            "/root/.terraform.d/plugin-cache/**/*",
+                            "/root/.cache/pip/**/*",
+                        ]
                     },
+                    "artifacts": self.build_artifacts(),
                 }
             ),
             environment_variables={
                 "TFPlanBucket": aws_codebuild.BuildEnvironmentVariable(value=self.bucket_tfplan.bucket_name),
                 "PipelineOwnershipMetadata": aws_codebuild.BuildEnvironmentVariable(value=json.dumps(self.pipeline_ownership_metadata)),
                 "CodeBuildTerraformBackendBucket": aws_codebuild.BuildEnvironmentVariable(value=self.bucket_codebuild_terraform_backend.bucket_name),
+                "UploadMaxWorkers": aws_codebuild.BuildEnvironmentVariable(value=str(self.upload_max_workers)),
+                "UploadPartSizeMB": aws_codebuild.BuildEnvironmentVariable(value=str(self.upload_part_size_mb)),
+                "UploadMaxConcurrency": aws_codebuild.BuildEnvironmentVariable(value=str(self.upload_max_concurrency)),
+                "ContentAddressedUploads": aws_codebuild.BuildEnvironmentVariable(value=str(self.content_addressed_uploads).lower()),
+                "CBInputsEncoding": aws_codebuild.BuildEnvironmentVariable(value=self.cb_inputs_encoding or ""),
+                "EvaluationQueueUrl": aws_codebuild.BuildEnvironmentVariable(value=self.queue_evaluation.queue_url if self.streaming_evaluation else ""),
+                "IncrementalEvaluation": aws_codebuild.BuildEnvironmentVariable(value=str(self.incremental_evaluation).lower()),
+                "PolicyFingerprint": aws_codebuild.BuildEnvironmentVariable(value=self.policy_fingerprint or ""),
+                "TFPlanShardBy": aws_codebuild.BuildEnvironmentVariable(value=self.tfplan_shard_by or ""),
+                "TFPlanShardSize": aws_codebuild.BuildEnvironmentVariable(value=str(self.tfplan_shard_size)),
+                "SlimTFPlan": aws_codebuild.BuildEnvironmentVariable(value=str(self.slim_tfplan).lower()),
+                "ToolchainDir": aws_codebuild.BuildEnvironmentVariable(value="/root/.toolchain"),
+                "TerraformVersion": aws_codebuild.BuildEnvironmentVariable(value=self.terraform_version),
+                "TF_PLUGIN_CACHE_DIR": aws_codebuild.BuildEnvironmentVariable(value="/root/.terraform.d/plugin-cache"),
             }
             
         )
 
+        if self.streaming_evaluation:
+            self.queue_evaluation.grant_send_messages(role_tfplan)
+
         self.artifact_built = aws_codepipeline.Artifact()
 
         self.action_build = aws_codepipeline_actions.CodeBuildAction(
@@ -431,8 +667,7 @@ class ControlBrokerCodepipelineExampleStack(Stack):
             self,
             "ParseSAMPackageOutputToCBInput",
             sources=[
-                # will fail if empty file/dir exists, e.g. __init__.py. See: https://github.com/aws/aws-cdk/issues/19012
-                aws_s3_deployment.Source.asset(f"./supplementary_files/codebuild_utils/sam_package_utils") 
+                self.codebuild_utils_source()
             ],
             destination_bucket=self.bucket_sam_package_utils,
             retain_on_delete=False,
@@ -492,18 +727,25 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                 build_image = aws_codebuild.LinuxBuildImage.STANDARD_3_0
             ),
             role = role_sam_package,
+            cache = self.build_cache(),
             build_spec=aws_codebuild.BuildSpec.from_object({
                 "version": "0.2",
                 "phases": {
                     "install": {
                         "on-failure": "ABORT",
                         "commands": [
-                            "wget https://github.com/aws/aws-sam-cli/releases/latest/download/aws-sam-cli-linux-x86_64.zip",
-                            "sha256sum aws-sam-cli-linux-x86_64.zip",
-                            "unzip aws-sam-cli-linux-x86_64.zip -d sam-installation",
-                            "sudo ./sam-installation/install",
+                            "mkdir -p ${ToolchainDir}",
+                            "SAM_ZIP=${ToolchainDir}/aws-sam-cli-${SamCliVersion}-linux-x86_64.zip",
+                            "SAM_INSTALL_DIR=${ToolchainDir}/aws-sam-cli-${SamCliVersion}",
+                            "if [ -n \"${SamCliSha256}\" ]; then echo \"${SamCliSha256}  ${SAM_ZIP}\" > ${SAM_ZIP}.sha256; else echo \"WARNING: SamCliSha256 is not set, SAM CLI ${SamCliVersion} is installed unverified\"; rm -f ${SAM_ZIP}.sha256; fi",
+                            # the zip is cached next to the install and checked against the pinned digest on every build,
+                            # without one it is downloaded again
+                            "sha256sum -c --status ${SAM_ZIP}.sha256 2>/dev/null || wget -q -O ${SAM_ZIP} https://github.com/aws/aws-sam-cli/releases/download/v${SamCliVersion}/aws-sam-cli-linux-x86_64.zip",
+                            "if [ -n \"${SamCliSha256}\" ]; then sha256sum -c ${SAM_ZIP}.sha256; else sha256sum ${SAM_ZIP} > ${SAM_ZIP}.sha256; fi",
+                            # a cached install is only reused if it was installed from a zip with this digest
+                            "cmp -s ${SAM_ZIP}.sha256 ${SAM_INSTALL_DIR}/installed-from.sha256 || (sudo rm -rf ${SAM_INSTALL_DIR} sam-installation && unzip -q ${SAM_ZIP} -d sam-installation && sudo ./sam-installation/install --install-dir ${SAM_INSTALL_DIR} --bin-dir /usr/local/bin && sudo cp ${SAM_ZIP}.sha256 ${SAM_INSTALL_DIR}/installed-from.sha256)",
+                            "sudo ln -sf ${SAM_INSTALL_DIR}/current/dist/sam /usr/local/bin/sam",
                             "sam --version",
-                            "rm -f aws-sam-cli-linux-x86_64.zip",
                             "rm -rf sam-installation",
                         ],
                     },
@@ -517,23 +759,40 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                             "ls",
                             f"aws s3 sync s3://{self.bucket_sam_package_utils.bucket_name} .",
                             "pip install -r requirements.txt",
-                            f"python3 parse_sam_package_to_cb_input.py {self.codebuild_to_sfn_artifact_file} $CODEPIPELINE_EXECUTION_ID",
+                            f"python3 -m cb_input_collector {self.codebuild_to_sfn_artifact_file} $CODEPIPELINE_EXECUTION_ID --iac {self.source_iac}",
+                            *self.artifact_size_commands(),
                         ],
                     },
                 },
-                "artifacts": {
-                    "files": ["**/*"],
-                    "discard-paths": "no",
-                    "enable-symlinks": "yes",
+                "cache": {
+                    "paths": [
+                        "/root/.toolchain/**/*",
+                        "/root/.cache/pip/**/*",
+                    ]
                 },
+                "artifacts": self.build_artifacts(),
             }),
             environment_variables={
                 "PipelineOwnershipMetadata": aws_codebuild.BuildEnvironmentVariable(value=json.dumps(self.pipeline_ownership_metadata)),
                 "CBInputsBucket": aws_codebuild.BuildEnvironmentVariable(value=self.bucket_sam_packaged_templates.bucket_name),
+                "UploadMaxWorkers": aws_codebuild.BuildEnvironmentVariable(value=str(self.upload_max_workers)),
+                "UploadPartSizeMB": aws_codebuild.BuildEnvironmentVariable(value=str(self.upload_part_size_mb)),
+                "UploadMaxConcurrency": aws_codebuild.BuildEnvironmentVariable(value=str(self.upload_max_concurrency)),
+                "ContentAddressedUploads": aws_codebuild.BuildEnvironmentVariable(value=str(self.content_addressed_uploads).lower()),
+                "CBInputsEncoding": aws_codebuild.BuildEnvironmentVariable(value=self.cb_inputs_encoding or ""),
+                "EvaluationQueueUrl": aws_codebuild.BuildEnvironmentVariable(value=self.queue_evaluation.queue_url if self.streaming_evaluation else ""),
+                "IncrementalEvaluation": aws_codebuild.BuildEnvironmentVariable(value=str(self.incremental_evaluation).lower()),
+                "PolicyFingerprint": aws_codebuild.BuildEnvironmentVariable(value=self.policy_fingerprint or ""),
+                "ToolchainDir": aws_codebuild.BuildEnvironmentVariable(value="/root/.toolchain"),
+                "SamCliVersion": aws_codebuild.BuildEnvironmentVariable(value=self.sam_cli_version),
+                "SamCliSha256": aws_codebuild.BuildEnvironmentVariable(value=self.sam_cli_sha256 or ""),
             }
             
         )
 
+        if self.streaming_evaluation:
+            self.queue_evaluation.grant_send_messages(role_sam_package)
+
         self.artifact_built = aws_codepipeline.Artifact()
 
         self.action_build = aws_codepipeline_actions.CodeBuildAction(
@@ -554,16 +813,24 @@ class ControlBrokerCodepipelineExampleStack(Stack):
             runtime= aws_lambda.Runtime.PYTHON_3_9,
             index="lambda_function.py",
             handler="lambda_handler",
-            timeout=Duration.seconds(60),
+            # a batch invocation also polls for every results report
+            timeout=Duration.minutes(15) if self.batch_evaluation else Duration.seconds(60),
             memory_size=1024,
+            tracing=aws_lambda.Tracing.ACTIVE if self.tracing else None,
             environment = {
                 "ApigwInvokeUrl" : self.control_broker_apigw_url,
                 "PipelineOwnershipMetadata": json.dumps(self.pipeline_ownership_metadata),
+                "BatchChunkSize": str(self.batch_chunk_size),
+                "ApigwRequestsPerSecond": str(self.apigw_requests_per_second),
+                "ApigwBurst": str(self.apigw_burst),
+                "ApigwMaxRetries": str(self.apigw_max_retries),
+                "FailFast": str(self.fail_fast).lower(),
+                "ApigwRequestContentEncoding": self.apigw_request_content_encoding or "",
             },
+            # signs with botocore and sends with urllib3, both in the runtime
             layers=[
-                self.layers['requests'],
-                self.layers['aws_requests_auth'],
-            ]
+                self.layers['evaluation_results'],
+            ],
         )
 
         if self.source_iac == "CDK":
@@ -625,8 +892,10 @@ class ControlBrokerCodepipelineExampleStack(Stack):
             code=aws_lambda.Code.from_asset(
                 "./supplementary_files/lambdas/requests_get"
             ),
+            tracing=aws_lambda.Tracing.ACTIVE if self.tracing else None,
             layers=[
                 self.layers['requests'],
+                self.layers['evaluation_results'],
             ]
         )
         
@@ -642,8 +911,347 @@ class ControlBrokerCodepipelineExampleStack(Stack):
             code=aws_lambda.Code.from_asset(
                 "./supplementary_files/lambdas/parse_results_determine_compliance"
             ),
+            tracing=aws_lambda.Tracing.ACTIVE if self.tracing else None,
+            layers=[
+                self.layers['evaluation_results'],
+            ],
+        )
+        
+    def evaluation_queue(self):
+
+        # CodeBuild inputs queued as they are uploaded, so evaluation overlaps the rest of the build
+
+        self.queue_evaluation_dead_letter = aws_sqs.Queue(
+            self,
+            "EvaluationDeadLetterQueue",
+            retention_period=Duration.days(4),
+        )
+
+        self.queue_evaluation = aws_sqs.Queue(
+            self,
+            "EvaluationQueue",
+            # a failed input is received again soon enough for the collector to still be waiting
+            visibility_timeout=self.evaluation_queue_visibility_timeout,
+            dead_letter_queue=aws_sqs.DeadLetterQueue(
+                max_receive_count=self.evaluation_queue_max_receive_count,
+                queue=self.queue_evaluation_dead_letter,
+            ),
+        )
+
+        self.table_streamed_verdicts = aws_dynamodb.Table(
+            self,
+            "StreamedVerdicts",
+            partition_key=aws_dynamodb.Attribute(name="ExecutionId", type=aws_dynamodb.AttributeType.STRING),
+            sort_key=aws_dynamodb.Attribute(name="InputKey", type=aws_dynamodb.AttributeType.STRING),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ExpiresAt",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+    def evaluate_streaming(self):
+
+        # evaluates like SignApigwRequest, through the same client in the evaluation_results layer,
+        # driven by SQS records instead of a Map iteration
+
+        self.lambda_stream_evaluate = aws_lambda_python_alpha.PythonFunction(
+            self,
+            "StreamEvaluate",
+            entry="./supplementary_files/lambdas/stream_evaluate",
+            runtime= aws_lambda.Runtime.PYTHON_3_9,
+            index="lambda_function.py",
+            handler="lambda_handler",
+            timeout=Duration.minutes(5),
+            memory_size=1024,
+            tracing=aws_lambda.Tracing.ACTIVE if self.tracing else None,
+            environment = {
+                "ApigwInvokeUrl" : self.control_broker_apigw_url,
+                "PipelineOwnershipMetadata": json.dumps(self.pipeline_ownership_metadata),
+                "BatchChunkSize": str(self.batch_chunk_size),
+                "ApigwRequestsPerSecond": str(self.apigw_requests_per_second),
+                "ApigwBurst": str(self.apigw_burst),
+                "ApigwMaxRetries": str(self.apigw_max_retries),
+                "ApigwRequestContentEncoding": self.apigw_request_content_encoding or "",
+                "StreamedVerdictsTable": self.table_streamed_verdicts.table_name,
+                "MaxReceiveCount": str(self.evaluation_queue_max_receive_count),
+            },
+            layers=[
+                self.layers['evaluation_results'],
+            ],
+        )
+
+        self.lambda_stream_evaluate.add_event_source(
+            aws_lambda_event_sources.SqsEventSource(
+                self.queue_evaluation,
+                batch_size=self.batch_chunk_size,
+                report_batch_item_failures=True,
+            )
+        )
+
+        self.table_streamed_verdicts.grant_write_data(self.lambda_stream_evaluate)
+
+        if self.source_iac == "CDK":
+            self.bucket_synthed_templates.grant_read(self.lambda_stream_evaluate)
+        if self.source_iac == "Terraform":
+            self.bucket_tfplan.grant_read(self.lambda_stream_evaluate)
+        if self.source_iac == "SAM":
+            self.bucket_sam_packaged_templates.grant_read(self.lambda_stream_evaluate)
+
+        # collect streamed verdicts
+
+        self.lambda_collect_streamed_verdicts = aws_lambda.Function(
+            self,
+            "CollectStreamedVerdicts",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            handler="lambda_function.lambda_handler",
+            timeout=Duration.seconds(60),
+            memory_size=1024,
+            code=aws_lambda.Code.from_asset(
+                "./supplementary_files/lambdas/collect_streamed_verdicts"
+            ),
+            environment = {
+                "StreamedVerdictsTable": self.table_streamed_verdicts.table_name,
+                "FailFast": str(self.fail_fast).lower(),
+            },
+            layers=[
+                self.layers['evaluation_results'],
+            ],
+        )
+
+        self.table_streamed_verdicts.grant_read_data(self.lambda_collect_streamed_verdicts)
+
+    def evaluate_with_service(self):
+
+        # inputs are evaluated by a ControlBrokerEvaluationServiceStack shared with other pipelines
+
+        self.queue_evaluation_service = aws_sqs.Queue.from_queue_arn(
+            self,
+            "EvaluationServiceQueue",
+            self.evaluation_service_queue_arn,
+        )
+
+        if self.source_iac == "CDK":
+            bucket_cb_inputs = self.bucket_synthed_templates
+        if self.source_iac == "Terraform":
+            bucket_cb_inputs = self.bucket_tfplan
+        if self.source_iac == "SAM":
+            bucket_cb_inputs = self.bucket_sam_packaged_templates
+
+        # a bucket policy, so the service stack needs no reference back to each consumer
+        bucket_cb_inputs.add_to_resource_policy(
+            aws_iam.PolicyStatement(
+                actions=["s3:GetObject"],
+                principals=[aws_iam.ArnPrincipal(self.evaluation_service_worker_role_arn)],
+                resources=[bucket_cb_inputs.arn_for_objects("*")],
+            )
+        )
+
+    def evaluate_verdict_cache(self):
+        
+        # verdicts keyed by input content hash and the policy set they were evaluated against
+        
+        self.table_verdict_cache = aws_dynamodb.Table(
+            self,
+            "VerdictCache",
+            partition_key=aws_dynamodb.Attribute(name="InputHash", type=aws_dynamodb.AttributeType.STRING),
+            sort_key=aws_dynamodb.Attribute(name="PolicyFingerprint", type=aws_dynamodb.AttributeType.STRING),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ExpiresAt",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        
+        self.lambda_verdict_cache = aws_lambda.Function(
+            self,
+            "VerdictCacheLambda",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            handler="lambda_function.lambda_handler",
+            timeout=Duration.seconds(60),
+            memory_size=256,
+            code=aws_lambda.Code.from_asset(
+                "./supplementary_files/lambdas/verdict_cache"
+            ),
+            environment = {
+                "VerdictCacheTable": self.table_verdict_cache.table_name,
+                "PolicyFingerprint": self.policy_fingerprint,
+                "VerdictCacheTtlSeconds": str(int(Duration.days(self.verdict_cache_ttl_days).to_seconds())),
+            },
+            layers=[
+                self.layers['evaluation_results'],
+            ]
+        )
+        
+        self.table_verdict_cache.grant_read_write_data(self.lambda_verdict_cache)
+    
+    def evaluate_results_callback(self):
+        
+        # task tokens waiting on a results report, resumed when the report object is created
+        
+        self.table_result_callbacks = aws_dynamodb.Table(
+            self,
+            "ResultCallbacks",
+            partition_key=aws_dynamodb.Attribute(name="ResultKey", type=aws_dynamodb.AttributeType.STRING),
+            billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="ExpiresAt",
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        
+        self.lambda_results_report_callback = aws_lambda.Function(
+            self,
+            "ResultsReportCallback",
+            runtime=aws_lambda.Runtime.PYTHON_3_9,
+            handler="lambda_function.lambda_handler",
+            timeout=Duration.seconds(60),
+            memory_size=1024,
+            code=aws_lambda.Code.from_asset(
+                "./supplementary_files/lambdas/results_report_callback"
+            ),
+            environment = {
+                "ResultCallbacksTable": self.table_result_callbacks.table_name,
+                "CallbackTimeoutSeconds": str(self.results_callback_timeout_seconds),
+            },
+            layers=[
+                self.layers['evaluation_results'],
+            ],
+        )
+        
+        self.table_result_callbacks.grant_read_write_data(self.lambda_results_report_callback)
+        
+        self.lambda_results_report_callback.role.add_to_policy(
+            aws_iam.PolicyStatement(
+                actions=[
+                    "states:SendTaskSuccess",
+                    "states:SendTaskFailure",
+                ],
+                # the state machine ARN would be a circular reference
+                resources=["*"],
+            )
+        )
+        
+        # the Control Broker results bucket needs EventBridge notifications turned on,
+        # and events from another account have to be forwarded to this account's default bus
+        
+        aws_events.Rule(
+            self,
+            "ResultsReportCreated",
+            event_pattern=aws_events.EventPattern(
+                source=["aws.s3"],
+                detail_type=["Object Created"],
+                detail={
+                    "bucket": {
+                        "name": [self.results_bucket]
+                    }
+                },
+            ),
+            targets=[
+                aws_events_targets.LambdaFunction(self.lambda_results_report_callback)
+            ],
         )
+    
+    def evaluate_compact_results(self):
+        
+        # full results reports, referenced from compact verdict records by ReportS3Uri
         
+        self.bucket_results_reports = aws_s3.Bucket(
+            self,
+            "ResultsReports",
+            block_public_access=aws_s3.BlockPublicAccess.BLOCK_ALL,
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+            lifecycle_rules=[
+                aws_s3.LifecycleRule(expiration=Duration.days(30))
+            ],
+        )
+        
+        CfnOutput(
+            self,
+            "ResultsReportsBucket",
+            value=self.bucket_results_reports.bucket_name,
+        )
+        
+        report_writers = [
+            self.lambda_sign_apigw_request,
+            self.lambda_requests_get,
+        ]
+        if self.results_callback:
+            report_writers.append(self.lambda_results_report_callback)
+        if self.streaming_evaluation:
+            report_writers.append(self.lambda_stream_evaluate)
+        
+        for function in report_writers:
+            function.add_environment("CompactResults", "true")
+            function.add_environment("ResultsReportsBucket", self.bucket_results_reports.bucket_name)
+            self.bucket_results_reports.grant_put(function)
+        
+        # only builds compact records, for the inputs carried forward from the last compliant execution
+        if self.streaming_evaluation:
+            self.lambda_collect_streamed_verdicts.add_environment("CompactResults", "true")
+    
+    def evaluation_metrics(self):
+        
+        # dimensions of the embedded metric format timings each evaluation function logs
+        
+        metered = [
+            self.lambda_sign_apigw_request,
+            self.lambda_requests_get,
+            self.lambda_parse_results_detemine_compliance,
+        ]
+        if self.streaming_evaluation:
+            metered.append(self.lambda_stream_evaluate)
+        if self.verdict_cache:
+            metered.append(self.lambda_verdict_cache)
+        
+        for function in metered:
+            function.add_environment("Pipeline", self.stack_name)
+            function.add_environment("SourceIac", self.source_iac)
+    
+    def evaluation_logging(self):
+        
+        # payloads are logged in full only at DEBUG or in a sampled invocation, otherwise summarized
+        
+        logging = [
+            self.lambda_sign_apigw_request,
+            self.lambda_requests_get,
+            self.lambda_parse_results_detemine_compliance,
+        ]
+        if self.streaming_evaluation:
+            logging.extend([self.lambda_stream_evaluate, self.lambda_collect_streamed_verdicts])
+        if self.verdict_cache:
+            logging.append(self.lambda_verdict_cache)
+        if self.results_callback:
+            logging.append(self.lambda_results_report_callback)
+        
+        for function in logging:
+            function.add_layers(self.layers['structured_logging'])
+            function.add_environment("LogLevel", self.log_level)
+            function.add_environment("LogSampleRate", str(self.log_sample_rate))
+    
+    def evaluation_tracing(self):
+        
+        # subsegments around the S3 read, the signed POST and the results report GETs,
+        # annotated with the CodePipeline execution, in the state machine's trace
+        
+        traced = [
+            self.lambda_sign_apigw_request,
+            self.lambda_requests_get,
+            self.lambda_parse_results_detemine_compliance,
+        ]
+        if self.streaming_evaluation:
+            traced.append(self.lambda_stream_evaluate)
+        
+        if self.tracing:
+            self.layers["xray"] = aws_lambda_python_alpha.PythonLayerVersion(self,
+                "XRaySdk",
+                entry="./supplementary_files/lambda_layers/xray",
+                compatible_runtimes=[
+                    aws_lambda.Runtime.PYTHON_3_9
+                ]
+            )
+        
+        for function in traced:
+            function.add_layers(self.layers['tracing'])
+            if self.tracing:
+                function.add_layers(self.layers['xray'])
+                function.add_environment("TracingExporter", "xray")
+    
     def evaluate_wrapper_sfn(self):
 
         role_eval_engine_wrapper = aws_iam.Role(
@@ -662,6 +1270,51 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                 ],
             )
         )
+        if self.verdict_cache:
+            role_eval_engine_wrapper.add_to_policy(
+                aws_iam.PolicyStatement(
+                    actions=["lambda:InvokeFunction"],
+                    resources=[
+                        self.lambda_verdict_cache.function_arn,
+                    ],
+                )
+            )
+        if self.evaluation_service_queue_arn:
+            self.queue_evaluation_service.grant_send_messages(role_eval_engine_wrapper)
+        if self.streaming_evaluation:
+            role_eval_engine_wrapper.add_to_policy(
+                aws_iam.PolicyStatement(
+                    actions=["lambda:InvokeFunction"],
+                    resources=[
+                        self.lambda_collect_streamed_verdicts.function_arn,
+                    ],
+                )
+            )
+        if self.results_callback:
+            role_eval_engine_wrapper.add_to_policy(
+                aws_iam.PolicyStatement(
+                    actions=["lambda:InvokeFunction"],
+                    resources=[
+                        self.lambda_results_report_callback.function_arn,
+                    ],
+                )
+            )
+        if self.incremental_evaluation:
+            if self.source_iac == "CDK":
+                bucket_cb_inputs = self.bucket_synthed_templates
+            if self.source_iac == "Terraform":
+                bucket_cb_inputs = self.bucket_tfplan
+            if self.source_iac == "SAM":
+                bucket_cb_inputs = self.bucket_sam_packaged_templates
+            last_green_manifest_key = "manifests/last-green.json"
+            role_eval_engine_wrapper.add_to_policy(
+                aws_iam.PolicyStatement(
+                    actions=["s3:PutObject"],
+                    resources=[
+                        bucket_cb_inputs.arn_for_objects(last_green_manifest_key),
+                    ],
+                )
+            )
 
         states_json ={
             "StartAt": "ForEachCodeBuildInput",
@@ -671,6 +1324,8 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                     "Next": "ParseResultsDetermineCompliance",
                     "ResultPath": "$.ForEachCodeBuildInput",
                     "ItemsPath": "$.CodeBuildToSfnArtifact.CodeBuildInputs",
+                    # 0 is unbounded
+                    "MaxConcurrency": self.max_concurrency,
                     "Parameters": {
                         "CodeBuildInput.$":"$$.Map.Item.Value",
                         "Context.$":"$.CodeBuildToSfnArtifact.Context"
@@ -686,10 +1341,8 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                                 "Parameters": {
                                     "FunctionName": self.lambda_sign_apigw_request.function_name,
                                     "Payload": {
-                                        "Input": {
-                                            "Bucket.$":"$.CodeBuildInput.Bucket",
-                                            "Key.$":"$.CodeBuildInput.Key",
-                                        },
+                                        # Bucket, Key and optional ContentEncoding
+                                        "Input.$":"$.CodeBuildInput",
                                         "Context.$":"$.Context" 
                                     }
                                 },
@@ -717,6 +1370,7 @@ class ControlBrokerCodepipelineExampleStack(Stack):
                                     "FunctionName": self.lambda_requests_get.function_name,
                                     "Payload":{
                                         "Url.$":"$.SignApigwRequest.Payload.Response.ControlBrokerEvaluation.OutputHandlers.OPA.PresignedUrl",
+                                        "RetryCount.$":"$$.State.RetryCount",
                                     }
                                 },
                                 "ResultSelector": {
@@ -799,13 +1453,499 @@ class ControlBrokerCodepipelineExampleStack(Stack):
             }
         }
         
+        # a Map iteration per input unless batch, streaming or service evaluation replaces it
+        map_evaluation = not self.batch_evaluation and not self.streaming_evaluation and not self.evaluation_service_queue_arn
+
+        if self.batch_evaluation and not self.streaming_evaluation and not self.evaluation_service_queue_arn:
+            
+            # one invocation signs, submits and polls every input instead of a Map iteration per input
+            
+            del states_json["States"]["ForEachCodeBuildInput"]
+            states_json["StartAt"] = "EvaluateCodeBuildInputsBatch"
+            states_json["States"].update({
+                "EvaluateCodeBuildInputsBatch": {
+                    "Type": "Task",
+                    "Next": "ParseResultsDetermineCompliance",
+                    "ResultPath": "$.EvaluateCodeBuildInputsBatch",
+                    "Resource": "arn:aws:states:::lambda:invoke",
+                    "Parameters": {
+                        "FunctionName": self.lambda_sign_apigw_request.function_name,
+                        "Payload": {
+                            "Inputs.$": "$.CodeBuildToSfnArtifact.CodeBuildInputs",
+                            "Context.$": "$.CodeBuildToSfnArtifact.Context"
+                        }
+                    },
+                    "ResultSelector": {
+                        "Payload.$": "$.Payload"
+                    },
+                    "Retry": [
+                        {
+                            # stopped short of the Lambda timeout, e.g. while Control Broker was throttling
+                            "ErrorEquals":[
+                                "DeadlineApproachingException"
+                            ],
+                            "IntervalSeconds": 30,
+                            "MaxAttempts": 1
+                        }
+                    ],
+                    "Catch": [
+                        {
+                            "ErrorEquals":[
+                                "APIGWNot200Exception",
+                                "PayloadTooLargeException"
+                            ],
+                            "Next": "APIGWNot200"
+                        },
+                        {
+                            "ErrorEquals":[
+                                "StatusCodeNot200Exception"
+                            ],
+                            "Next": "ResultsReportDoesNotYetExist"
+                        },
+                        {
+                            "ErrorEquals":[
+                                "DeadlineApproachingException"
+                            ],
+                            "Next": "DeadlineApproaching"
+                        }
+                    ]
+                },
+                "APIGWNot200": {
+                    "Type":"Fail"
+                },
+                "ResultsReportDoesNotYetExist": {
+                    "Type":"Fail"
+                },
+                "DeadlineApproaching": {
+                    "Type":"Fail"
+                },
+            })
+            # the batch result list has the same items as the Map output
+            states_json["States"]["ParseResultsDetermineCompliance"]["Parameters"]["Payload"] = {
+                "ForEachCodeBuildInput.$": "$.EvaluateCodeBuildInputsBatch.Payload"
+            }
+            del states_json["States"]["ParseResultsDetermineCompliance"]["Parameters"]["Payload.$"]
+        
+        if map_evaluation:
+            
+            # the results poll is reported once, by the last attempt of the GetIsCompliant Retry
+            
+            get_is_compliant = states_json["States"]["ForEachCodeBuildInput"]["Iterator"]["States"]["GetIsCompliant"]
+            self.lambda_requests_get.add_environment("ResultsPollMaxAttempts", str(get_is_compliant["Retry"][0]["MaxAttempts"]))
+        
+        if map_evaluation and self.verdict_cache:
+            
+            # short-circuit the iterator when this input was already evaluated against this policy set
+            
+            iterator = states_json["States"]["ForEachCodeBuildInput"]["Iterator"]
+            iterator["StartAt"] = "LookupCachedVerdict"
+            iterator["States"]["GetIsCompliant"]["Next"] = "StoreVerdict"
+            iterator["States"].update({
+                "LookupCachedVerdict": {
+                    "Type": "Task",
+                    "Next": "ChoiceCachedVerdictFound",
+                    "ResultPath": "$.LookupCachedVerdict",
+                    "Resource": "arn:aws:states:::lambda:invoke",
+                    "Parameters": {
+                        "FunctionName": self.lambda_verdict_cache.function_name,
+                        "Payload": {
+                            "Action": "Get",
+                            "CodeBuildInput.$": "$.CodeBuildInput",
+                        }
+                    },
+                    "ResultSelector": {
+                        "Payload.$": "$.Payload"
+                    },
+                    "Catch": [
+                        {
+                            # a cache outage falls back to a normal evaluation
+                            "ErrorEquals":[
+                                "States.ALL"
+                            ],
+                            "ResultPath": "$.VerdictCacheError",
+                            "Next": "SignApigwRequest"
+                        }
+                    ]
+                },
+                "ChoiceCachedVerdictFound": {
+                    "Type":"Choice",
+                    "Default":"SignApigwRequest",
+                    "Choices":[
+                        {
+                            "Variable":"$.LookupCachedVerdict.Payload.Hit",
+                            "BooleanEquals":True,
+                            "Next":"CachedVerdict"
+                        },
+                    ]
+                },
+                "CachedVerdict": {
+                    "Type": "Pass",
+                    "Next": "ChoiceIsCompliant",
+                    "ResultPath": "$.GetIsCompliant",
+                    "Parameters": {
+                        "Payload.$": "$.LookupCachedVerdict.Payload.Verdict"
+                    }
+                },
+                "StoreVerdict": {
+                    "Type": "Task",
+                    "Next": "ChoiceIsCompliant",
+                    "ResultPath": "$.StoreVerdict",
+                    "Resource": "arn:aws:states:::lambda:invoke",
+                    "Parameters": {
+                        "FunctionName": self.lambda_verdict_cache.function_name,
+                        "Payload": {
+                            "Action": "Put",
+                            "CodeBuildInput.$": "$.CodeBuildInput",
+                            "IsCompliant.$": "$.GetIsCompliant.Payload.EvalEngineLambdalith.Evaluation.IsCompliant",
+                        }
+                    },
+                    "ResultSelector": {
+                        "Payload.$": "$.Payload"
+                    },
+                    "Catch": [
+                        {
+                            "ErrorEquals":[
+                                "States.ALL"
+                            ],
+                            "ResultPath": "$.VerdictCacheError",
+                            "Next": "ChoiceIsCompliant"
+                        }
+                    ]
+                },
+            })
+        
+        if map_evaluation and self.results_callback:
+            
+            # wait for the results report notification, falling back to GetIsCompliant polling on timeout
+            
+            iterator = states_json["States"]["ForEachCodeBuildInput"]["Iterator"]
+            iterator["States"]["SignApigwRequest"]["Next"] = "AwaitResultsReport"
+            iterator["States"]["AwaitResultsReport"] = {
+                "Type": "Task",
+                "Next": iterator["States"]["GetIsCompliant"]["Next"],
+                "ResultPath": "$.GetIsCompliant",
+                "Resource": "arn:aws:states:::lambda:invoke.waitForTaskToken",
+                "TimeoutSeconds": self.results_callback_timeout_seconds,
+                "Parameters": {
+                    "FunctionName": self.lambda_results_report_callback.function_name,
+                    "Payload":{
+                        "TaskToken.$":"$$.Task.Token",
+                        "Url.$":"$.SignApigwRequest.Payload.Response.ControlBrokerEvaluation.OutputHandlers.OPA.PresignedUrl",
+                    }
+                },
+                # the task output is the results report sent with SendTaskSuccess
+                "ResultSelector": {
+                    "Payload.$": "$"
+                },
+                "Catch": [
+                    {
+                        "ErrorEquals":[
+                            "States.ALL"
+                        ],
+                        "ResultPath": "$.AwaitResultsReportError",
+                        "Next": "GetIsCompliant"
+                    }
+                ]
+            }
+        
+        if map_evaluation and self.compact_results:
+            
+            # keep only a verdict record per iteration, the full report is offloaded to S3 by the Lambdas,
+            # a batch invocation returns the same records itself
+            
+            iterator = states_json["States"]["ForEachCodeBuildInput"]["Iterator"]
+            iterator["States"]["SignApigwRequest"]["ResultSelector"] = {
+                "Payload": {
+                    "Response": {
+                        "ControlBrokerEvaluation": {
+                            "OutputHandlers": {
+                                "OPA": {
+                                    "PresignedUrl.$": "$.Payload.Response.ControlBrokerEvaluation.OutputHandlers.OPA.PresignedUrl"
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+            for state in ["IsCompliantTrue", "IsCompliantFalse"]:
+                iterator["States"][state]["Parameters"] = {
+                    "Key.$": "$.CodeBuildInput.Key",
+                    "IsCompliant.$": "$.GetIsCompliant.Payload.EvalEngineLambdalith.Evaluation.IsCompliant",
+                    "ResultUrl.$": "$.GetIsCompliant.Payload.ResultUrl",
+                    "ReportS3Uri.$": "$.GetIsCompliant.Payload.ReportS3Uri",
+                }
+            states_json["States"]["ParseResultsDetermineCompliance"]["Parameters"].pop("Payload.$", None)
+            states_json["States"]["ParseResultsDetermineCompliance"]["Parameters"]["Payload"] = {
+                "ForEachCodeBuildInput.$": "$.ForEachCodeBuildInput"
+            }
+        
+        if map_evaluation and self.incremental_evaluation:
+            
+            # inputs unchanged since the last green execution skip evaluation, compliant as of that execution
+            
+            iterator = states_json["States"]["ForEachCodeBuildInput"]["Iterator"]
+            if self.compact_results:
+                carried_forward = {
+                    "Key.$": "$.CodeBuildInput.Key",
+                    "IsCompliant": True,
+                    "ResultUrl": None,
+                    "ReportS3Uri": None,
+                    "CarriedForward": True,
+                }
+            else:
+                carried_forward = {
+                    "CodeBuildInput.$": "$.CodeBuildInput",
+                    "GetIsCompliant": {
+                        "Payload": {
+                            "EvalEngineLambdalith": {
+                                "Evaluation": {
+                                    "IsCompliant": True
+                                }
+                            },
+                            "ResultUrl": None,
+                            "ReportS3Uri": None,
+                        }
+                    }
+                }
+            iterator["States"]["ChoiceCarriedForward"] = {
+                "Type": "Choice",
+                "Default": iterator["StartAt"],
+                "Choices": [
+                    {
+                        "And": [
+                            {
+                                "Variable": "$.CodeBuildInput.CarriedForward",
+                                "IsPresent": True
+                            },
+                            {
+                                "Variable": "$.CodeBuildInput.CarriedForward",
+                                "BooleanEquals": True
+                            },
+                        ],
+                        "Next": "CarriedForward"
+                    },
+                ]
+            }
+            iterator["States"]["CarriedForward"] = {
+                "Type": "Pass",
+                "Parameters": carried_forward,
+                "End": True
+            }
+            iterator["StartAt"] = "ChoiceCarriedForward"
+        
+        if self.streaming_evaluation:
+
+            # inputs were queued for evaluation as the build uploaded them, this only waits for their verdicts
+
+            del states_json["States"]["ForEachCodeBuildInput"]
+            states_json["StartAt"] = "CollectStreamedVerdicts"
+            states_json["States"].update({
+                "CollectStreamedVerdicts": {
+                    "Type": "Task",
+                    "Next": "ParseResultsDetermineCompliance",
+                    "ResultPath": "$.CollectStreamedVerdicts",
+                    "Resource": "arn:aws:states:::lambda:invoke",
+                    "Parameters": {
+                        "FunctionName": self.lambda_collect_streamed_verdicts.function_name,
+                        "Payload": {
+                            "ExecutionId.$": "$.CodeBuildToSfnArtifact.CodePipelineExecutionId",
+                            "Inputs.$": "$.CodeBuildToSfnArtifact.CodeBuildInputs"
+                        }
+                    },
+                    "ResultSelector": {
+                        "Payload.$": "$.Payload"
+                    },
+                    "Retry": [
+                        {
+                            "ErrorEquals": [
+                                "VerdictsNotYetStreamed"
+                            ],
+                            "IntervalSeconds": 5,
+                            "MaxAttempts": max(1, self.streaming_collect_timeout_seconds // 5),
+                            "BackoffRate": 1.0
+                        }
+                    ],
+                    "Catch": [
+                        {
+                            "ErrorEquals":[
+                                "StreamedEvaluationFailed"
+                            ],
+                            "Next": "APIGWNot200"
+                        },
+                        {
+                            "ErrorEquals":[
+                                "VerdictsNotYetStreamed"
+                            ],
+                            "Next": "ResultsReportDoesNotYetExist"
+                        }
+                    ]
+                },
+                "APIGWNot200": {
+                    "Type":"Fail"
+                },
+                "ResultsReportDoesNotYetExist": {
+                    "Type":"Fail"
+                },
+            })
+            # the collected list has the same items as the Map output
+            states_json["States"]["ParseResultsDetermineCompliance"]["Parameters"]["Payload"] = {
+                "ForEachCodeBuildInput.$": "$.CollectStreamedVerdicts.Payload"
+            }
+            states_json["States"]["ParseResultsDetermineCompliance"]["Parameters"].pop("Payload.$", None)
+
+        if self.evaluation_service_queue_arn:
+
+            # one message per execution, the service worker resumes this task with the Map-shaped results
+
+            del states_json["States"]["ForEachCodeBuildInput"]
+            states_json["StartAt"] = "EvaluateWithService"
+            states_json["States"].update({
+                "EvaluateWithService": {
+                    "Type": "Task",
+                    "Next": "ParseResultsDetermineCompliance",
+                    "ResultPath": "$.EvaluateWithService",
+                    "Resource": "arn:aws:states:::sqs:sendMessage.waitForTaskToken",
+                    "TimeoutSeconds": self.evaluation_service_timeout_seconds,
+                    "Parameters": {
+                        "QueueUrl": self.queue_evaluation_service.queue_url,
+                        # fair scheduling is per message group
+                        "MessageGroupId": self.stack_name,
+                        "MessageDeduplicationId.$": "$$.Execution.Name",
+                        "MessageBody": {
+                            "TaskToken.$": "$$.Task.Token",
+                            "Pipeline": self.stack_name,
+                            "SourceIac": self.source_iac,
+                            "Inputs.$": "$.CodeBuildToSfnArtifact.CodeBuildInputs",
+                            "Context.$": "$.CodeBuildToSfnArtifact.Context",
+                            "FailFast": self.fail_fast,
+                        }
+                    },
+                    "Catch": [
+                        {
+                            "ErrorEquals":[
+                                "APIGWNot200Exception",
+                                "PayloadTooLargeException"
+                            ],
+                            "Next": "APIGWNot200"
+                        },
+                        {
+                            "ErrorEquals":[
+                                "StatusCodeNot200Exception",
+                                "States.Timeout"
+                            ],
+                            "Next": "ResultsReportDoesNotYetExist"
+                        },
+                        {
+                            # a worker ran out of time without evaluating anything, or its continuation was too large
+                            "ErrorEquals":[
+                                "DeadlineApproachingException"
+                            ],
+                            "Next": "DeadlineApproaching"
+                        }
+                    ]
+                },
+                "APIGWNot200": {
+                    "Type":"Fail"
+                },
+                "ResultsReportDoesNotYetExist": {
+                    "Type":"Fail"
+                },
+                "DeadlineApproaching": {
+                    "Type":"Fail"
+                },
+            })
+            states_json["States"]["ParseResultsDetermineCompliance"]["Parameters"]["Payload"] = {
+                "ForEachCodeBuildInput.$": "$.EvaluateWithService"
+            }
+            states_json["States"]["ParseResultsDetermineCompliance"]["Parameters"].pop("Payload.$", None)
+
+        if self.incremental_evaluation:
+
+            # the inputs of a compliant execution, with their digests, are what the next build compares against
+
+            states_json["States"]["ChoiceAllCodeBuildInputsCompliant"]["Choices"][0]["Next"] = "RecordLastGreenManifest"
+            states_json["States"]["RecordLastGreenManifest"] = {
+                "Type": "Task",
+                "Next": "AllCodeBuildInputsCompliantTrue",
+                "ResultPath": None,
+                "Resource": "arn:aws:states:::aws-sdk:s3:putObject",
+                "Parameters": {
+                    "Bucket": bucket_cb_inputs.bucket_name,
+                    "Key": last_green_manifest_key,
+                    "Body.$": "States.JsonToString($.CodeBuildToSfnArtifact)"
+                },
+                # the execution is compliant either way, the next one just evaluates every input
+                "Catch": [
+                    {
+                        "ErrorEquals":[
+                            "States.ALL"
+                        ],
+                        "ResultPath": "$.RecordLastGreenManifestError",
+                        "Next": "AllCodeBuildInputsCompliantTrue"
+                    }
+                ]
+            }
+
+        if self.fail_fast:
+
+            # the first non-compliant input fails the Map, which stops the iterations still running
+            # and never starts the rest, and is reported as the cause of the execution failure
+            
+            if self.evaluation_service_queue_arn:
+                evaluate_state = states_json["States"]["EvaluateWithService"]
+            elif self.streaming_evaluation:
+                evaluate_state = states_json["States"]["CollectStreamedVerdicts"]
+            elif self.batch_evaluation:
+                evaluate_state = states_json["States"]["EvaluateCodeBuildInputsBatch"]
+            else:
+                evaluate_state = states_json["States"]["ForEachCodeBuildInput"]
+                evaluate_state["Iterator"]["States"]["IsCompliantFalse"] = {
+                    "Type": "Fail",
+                    "Error": "InputNotCompliant",
+                    "CausePath": "States.JsonToString($.CodeBuildInput)",
+                }
+            evaluate_state["Catch"] = [
+                {
+                    "ErrorEquals":[
+                        "InputNotCompliant"
+                    ],
+                    "ResultPath": "$.FirstNonCompliantInput",
+                    "Next": "FirstNonCompliantInput"
+                }
+            ] + evaluate_state.get("Catch", [])
+            states_json["States"]["FirstNonCompliantInput"] = {
+                "Type": "Fail",
+                "Error": "InputNotCompliant",
+                "CausePath": "$.FirstNonCompliantInput.Cause",
+            }
+        
+        if self.tracing:
+
+            # the CodePipeline execution id reaches every traced function, to annotate its subsegments with
+
+            execution_id = "$.CodeBuildToSfnArtifact.CodePipelineExecutionId"
+            if "ForEachCodeBuildInput" in states_json["States"]:
+                map_state = states_json["States"]["ForEachCodeBuildInput"]
+                map_state["Parameters"]["CodePipelineExecutionId.$"] = execution_id
+                for state in ["SignApigwRequest", "GetIsCompliant"]:
+                    map_state["Iterator"]["States"][state]["Parameters"]["Payload"]["CodePipelineExecutionId.$"] = "$.CodePipelineExecutionId"
+            if "EvaluateCodeBuildInputsBatch" in states_json["States"]:
+                states_json["States"]["EvaluateCodeBuildInputsBatch"]["Parameters"]["Payload"]["CodePipelineExecutionId.$"] = execution_id
+            if "EvaluateWithService" in states_json["States"]:
+                states_json["States"]["EvaluateWithService"]["Parameters"]["MessageBody"]["CodePipelineExecutionId.$"] = execution_id
+            # otherwise it is passed the whole state, artifact included
+            parse_parameters = states_json["States"]["ParseResultsDetermineCompliance"]["Parameters"]
+            if "Payload" in parse_parameters:
+                parse_parameters["Payload"]["CodePipelineExecutionId.$"] = execution_id
+        
         placeholder = aws_stepfunctions.Succeed(self, "Placeholder")
 
         chain = aws_stepfunctions.Chain.start(placeholder)
         
         sfn_l2_control_broker_client = aws_stepfunctions.StateMachine(self, "CB-Consumer-IaCPipeline",
             definition=chain,
-            role = role_eval_engine_wrapper
+            role = role_eval_engine_wrapper,
+            tracing_enabled=self.tracing,
         )
         
         sfn_l1_control_broker_client = sfn_l2_control_broker_client.node.default_child
@@ -0,0 +1,11 @@
+from .collector import Collector
+from .config import CollectorConfig
+from .discoverers import (
+    CdkDiscoverer,
+    Discoverer,
+    SamDiscoverer,
+    TerraformDiscoverer,
+    discoverers,
+    register_discoverer,
+)
+from .storage import EvaluationQueue, S3Store
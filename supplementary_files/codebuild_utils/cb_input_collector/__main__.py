@@ -0,0 +1,33 @@
+import argparse
+import json
+
+from .collector import Collector
+from .config import CollectorConfig
+from .discoverers import discoverers
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cb_input_collector',
+        description='Upload the CodeBuild inputs of a build and write the artifact the evaluation state machine is invoked with',
+    )
+    parser.add_argument('codebuild_to_sfn_artifact_file')
+    parser.add_argument('codepipeline_execution_id')
+    parser.add_argument('--iac', action='append', required=True, choices=sorted(discoverers),
+        help='repeat to collect several IaC types from the same source in one run')
+    args = parser.parse_args(argv)
+    print(f'args:\n{args}')
+
+    config = CollectorConfig.from_environ()
+    print(f'config:\n{vars(config)}')
+
+    collector = Collector(config=config, execution_id=args.codepipeline_execution_id)
+    try:
+        codebuild_inputs = collector.collect(args.iac)
+    finally:
+        collector.store.shutdown()
+
+    with open(args.codebuild_to_sfn_artifact_file,'w') as f:
+        json.dump(collector.codebuild_to_sfn_artifact(codebuild_inputs),f,indent=2)
+
+if __name__ == '__main__':
+    main()
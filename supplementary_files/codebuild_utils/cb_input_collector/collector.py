@@ -0,0 +1,160 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .discoverers import discoverers
+from .storage import EvaluationQueue, S3Store
+
+# written by the state machine when an execution is compliant
+last_green_manifest_key = 'manifests/last-green.json'
+
+def sha256_file(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def content_addressed_key(sha256):
+    return f'sha256/{sha256}'
+
+def gzip_file(file_path):
+    # mtime=0 so the same input always compresses to the same bytes
+    gzip_path = f'{file_path}.gz'
+    with open(file_path, 'rb') as src, gzip.GzipFile(filename=gzip_path, mode='wb', mtime=0) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    print(f'gzip_file:\nfile_path:\n{file_path}\nbytes:\n{os.path.getsize(file_path)}\ngzip bytes:\n{os.path.getsize(gzip_path)}\n')
+    return gzip_path
+
+class Collector:
+    # discovers, uploads and lists the CodeBuild inputs of one or more IaC types for one pipeline execution
+
+    def __init__(self, *, config, execution_id, store=None, queue=None):
+        self.config = config
+        self.execution_id = execution_id
+        self.store = store or S3Store(
+            max_concurrency = config.upload_max_concurrency,
+            part_size_mb = config.upload_part_size_mb,
+        )
+        if queue is None and config.evaluation_queue_url:
+            queue = EvaluationQueue(url=config.evaluation_queue_url)
+        self.queue = queue
+
+    def last_green(self, bucket):
+        # Name -> Sha256 of every input of the last execution found compliant under the same policies
+        manifest = self.store.get_json(bucket=bucket, key=last_green_manifest_key)
+        if manifest is None:
+            print(f'no last green manifest\nbucket:\n{bucket}\nkey:\n{last_green_manifest_key}\n')
+            return {}
+        if manifest.get('PolicyFingerprint') != self.config.policy_fingerprint:
+            print(f'policies changed since the last green manifest, evaluating every input\nmanifest:\n{manifest.get("PolicyFingerprint")}\ncurrent:\n{self.config.policy_fingerprint}\n')
+            return {}
+        return {i['Name']: i['Sha256'] for i in manifest['CodeBuildInputs'] if 'Name' in i and 'Sha256' in i}
+
+    def build_item(self, *, bucket, name, path, last_green):
+
+        item = {
+            'Bucket':bucket,
+            'Key':f'{self.execution_id}/{name}',
+            'Path':path,
+        }
+
+        # of the uncompressed bytes, verified by the evaluating Lambda as it reads the object
+        item['Sha256'] = sha256_file(path)
+        item['Name'] = name
+
+        if self.config.content_addressed_uploads:
+            item['Key'] = content_addressed_key(item['Sha256'])
+
+        if self.config.cb_inputs_encoding == 'gzip':
+            # Sha256 stays the digest of the uncompressed bytes, the suffix keeps encodings apart
+            item['ContentEncoding'] = self.config.cb_inputs_encoding
+            item['Key'] = f"{item['Key']}.gz"
+
+        # unchanged since the last compliant execution, carried forward rather than uploaded and evaluated
+        if self.config.incremental_evaluation and last_green.get(item['Name']) == item['Sha256']:
+            item['CarriedForward'] = True
+
+        return item
+
+    def discover_items(self, *, iac, last_green):
+        discoverer = discoverers[iac]
+        bucket = self.config.buckets[iac]
+        return [
+            self.build_item(bucket=bucket, name=name, path=path, last_green=last_green)
+            for name, path in discoverer.discover(source_dir=self.config.source_dir, config=self.config)
+        ]
+
+    def upload_item(self, item):
+        if item.get('CarriedForward'):
+            print(f'skip upload_file, carried forward\nname:\n{item["Name"]}\n')
+            return False
+        # content-addressed keys only change with the bytes, so an existing object is the same upload
+        if self.config.content_addressed_uploads and self.store.object_exists(bucket = item['Bucket'], key = item['Key']):
+            print(f'skip upload_file, object exists\nbucket:\n{item["Bucket"]}\nkey:\n{item["Key"]}\n')
+            uploaded = False
+        else:
+            uploaded = self.store.upload_file(
+                bucket = item['Bucket'],
+                key = item['Key'],
+                file_path = gzip_file(item['Path']) if item.get('ContentEncoding') == 'gzip' else item['Path']
+            )
+        if self.queue:
+            self.queue.send(execution_id=self.execution_id, item=item)
+        return uploaded
+
+    def timed_upload_item(self, item):
+        start = time.perf_counter()
+        self.upload_item(item)
+        elapsed = time.perf_counter() - start
+        print(f'upload_file seconds:\n{elapsed:.3f}\nkey:\n{item["Key"]}\n')
+        return elapsed
+
+    def upload_items(self, items):
+        # identical inputs share a content-addressed key, upload each key once, and a carried forward
+        # input can share its key with one that is evaluated
+        unique = list({(i['Bucket'], i['Key']): i for i in items if not i.get('CarriedForward')}.values())
+        # executor.map yields in submission order and re-raises the first upload error
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.config.upload_max_workers) as executor:
+            timings = list(executor.map(self.timed_upload_item, unique))
+        total = time.perf_counter() - start
+        print(f'upload_files:\nfiles:\n{len(unique)}\nmax_workers:\n{self.config.upload_max_workers}\nsum of per-file seconds:\n{sum(timings):.3f}\ntotal seconds:\n{total:.3f}\n')
+        return timings
+
+    def collect(self, iacs):
+        # the state machine records the last green manifest in the first IaC type's bucket
+        last_green = self.last_green(self.config.buckets[iacs[0]]) if self.config.incremental_evaluation else {}
+
+        # discovery and hashing of each IaC type run side by side, then every upload shares one pool
+        with ThreadPoolExecutor(max_workers=len(iacs)) as executor:
+            discovered = list(executor.map(lambda iac: self.discover_items(iac=iac, last_green=last_green), iacs))
+        codebuild_inputs = [item for items in discovered for item in items]
+
+        self.upload_items(codebuild_inputs)
+
+        print(f'codebuild_inputs:\n{codebuild_inputs}\n{type(codebuild_inputs)}')
+
+        if self.config.incremental_evaluation:
+            carried_forward = [i['Name'] for i in codebuild_inputs if i.get('CarriedForward')]
+            print(f'inputs:\n{len(codebuild_inputs)}\nevaluated:\n{len(codebuild_inputs) - len(carried_forward)}\ncarried forward:\n{carried_forward}\n')
+
+        return codebuild_inputs
+
+    def codebuild_to_sfn_artifact(self, codebuild_inputs):
+        return {
+            "CodeBuildToSfnArtifact": {
+                "CodePipelineExecutionId":self.execution_id,
+                "CodeBuildInputs":codebuild_inputs,
+                # a last green manifest is only compared against executions under the same policies
+                "PolicyFingerprint": self.config.policy_fingerprint,
+                "Context": {
+                    "EnvironmentEvaluation":"Prod",
+                    "PipelineOwnershipMetadata": self.config.pipeline_ownership_metadata,
+                }
+            }
+        }
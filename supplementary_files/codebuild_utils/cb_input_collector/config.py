@@ -0,0 +1,77 @@
+import json
+import os
+
+# each IaC type's inputs bucket, under the environment variable its CodeBuild project sets
+bucket_envs = {
+    'CDK': 'SynthedTemplatesBucket',
+    'Terraform': 'TFPlanBucket',
+    'SAM': 'CBInputsBucket',
+}
+
+def env_flag(environ, name):
+    return environ.get(name, 'false').lower() == 'true'
+
+class CollectorConfig:
+    # every setting the CodeBuild projects pass as environment variables, so a collector
+    # can also be built directly when testing or benchmarking locally
+
+    def __init__(
+        self,
+        *,
+        source_dir,
+        buckets,
+        pipeline_ownership_metadata=None,
+        upload_max_workers=8,
+        upload_part_size_mb=8,
+        upload_max_concurrency=10,
+        content_addressed_uploads=False,
+        cb_inputs_encoding='',
+        evaluation_queue_url='',
+        incremental_evaluation=False,
+        policy_fingerprint='',
+        tfplan_shard_by='',
+        tfplan_shard_size=500,
+        tfplan_slim=False,
+    ):
+        self.source_dir = source_dir
+        self.buckets = buckets
+        self.pipeline_ownership_metadata = pipeline_ownership_metadata or {}
+        # 1 restores serial uploads
+        self.upload_max_workers = upload_max_workers
+        # files larger than one part upload as a multipart upload, parts in parallel
+        self.upload_part_size_mb = upload_part_size_mb
+        # S3 requests in flight across every upload, parts of one large file or many small files
+        self.upload_max_concurrency = upload_max_concurrency
+        self.content_addressed_uploads = content_addressed_uploads
+        # "gzip" compresses each input before upload and records it as the item's ContentEncoding
+        self.cb_inputs_encoding = cb_inputs_encoding
+        # set in streaming mode, each input is queued for evaluation as soon as it is uploaded
+        self.evaluation_queue_url = evaluation_queue_url
+        # compare each input against the last green manifest, unchanged inputs are carried forward unevaluated
+        self.incremental_evaluation = incremental_evaluation
+        self.policy_fingerprint = policy_fingerprint
+        # unset uploads the plan as a single input, "count" or "module" shards resource_changes
+        self.tfplan_shard_by = tfplan_shard_by
+        self.tfplan_shard_size = tfplan_shard_size
+        # drop no-op/read changes, before values and every section other than resource_changes
+        self.tfplan_slim = tfplan_slim
+
+    @classmethod
+    def from_environ(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        return cls(
+            source_dir = environ['CODEBUILD_SRC_DIR'],
+            buckets = {iac: environ[name] for iac, name in bucket_envs.items() if environ.get(name)},
+            pipeline_ownership_metadata = json.loads(environ.get('PipelineOwnershipMetadata') or '{}'),
+            upload_max_workers = int(environ.get('UploadMaxWorkers', 8)),
+            upload_part_size_mb = int(environ.get('UploadPartSizeMB', 8)),
+            upload_max_concurrency = int(environ.get('UploadMaxConcurrency', 10)),
+            content_addressed_uploads = env_flag(environ, 'ContentAddressedUploads'),
+            cb_inputs_encoding = environ.get('CBInputsEncoding', ''),
+            evaluation_queue_url = environ.get('EvaluationQueueUrl', ''),
+            incremental_evaluation = env_flag(environ, 'IncrementalEvaluation'),
+            policy_fingerprint = environ.get('PolicyFingerprint', ''),
+            tfplan_shard_by = environ.get('TFPlanShardBy', ''),
+            tfplan_shard_size = int(environ.get('TFPlanShardSize', 500)),
+            tfplan_slim = env_flag(environ, 'SlimTFPlan'),
+        )
@@ -0,0 +1,80 @@
+import abc
+import json
+import os
+
+from .tfplan import shard_tfplan
+
+class Discoverer(abc.ABC):
+    # finds one IaC type's inputs in a build's source directory as (Name, Path) pairs,
+    # Name is stable across builds and unique within the IaC type
+    iac = None
+
+    @abc.abstractmethod
+    def discover(self, *, source_dir, config):
+        pass
+
+class CdkDiscoverer(Discoverer):
+    iac = 'CDK'
+
+    def discover(self, *, source_dir, config):
+        cdk_dir = os.path.realpath(os.path.join(source_dir, 'cdk.out'))
+        # manifest order follows construct order, sort so CodeBuildInputs is stable across builds
+        # relative to cdk.out so same-named templates in different stages don't collide
+        return [(os.path.relpath(path, cdk_dir), path) for path in sorted(discover_templates(cdk_dir))]
+
+def discover_templates(assembly_dir, seen=None):
+    # follow the cloud assembly manifest rather than walking cdk.out, whose asset.* dirs
+    # can hold bundled dependencies; nested stage assemblies have manifests of their own
+    seen = set() if seen is None else seen
+    assembly_dir = os.path.realpath(assembly_dir)
+    if assembly_dir in seen:
+        return []
+    seen.add(assembly_dir)
+
+    with open(os.path.join(assembly_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+
+    template_paths = []
+    for artifact_id, artifact in manifest.get('artifacts', {}).items():
+        properties = artifact.get('properties', {})
+        if artifact.get('type') == 'aws:cloudformation:stack':
+            template_paths.append(os.path.join(assembly_dir, properties['templateFile']))
+        if artifact.get('type') == 'cdk:cloud-assembly':
+            template_paths.extend(discover_templates(os.path.join(assembly_dir, properties['directoryName']), seen))
+    return template_paths
+
+class TerraformDiscoverer(Discoverer):
+    iac = 'Terraform'
+
+    def discover(self, *, source_dir, config):
+        tfplan_path = os.path.join(source_dir, 'tfplan.json')
+
+        if not (config.tfplan_shard_by or config.tfplan_slim):
+            return [('tfplan.json', tfplan_path)]
+
+        plan_parts = [
+            (f'tfplan/{shard_id}.json' if config.tfplan_shard_by else 'tfplan.json', path) for shard_id, path in shard_tfplan(
+                tfplan_path = tfplan_path,
+                shard_dir = os.path.join(source_dir, 'tfplan_shards'),
+                shard_by = config.tfplan_shard_by,
+                shard_size = config.tfplan_shard_size,
+                slim = config.tfplan_slim,
+            )
+        ]
+        tfplan_bytes = os.path.getsize(tfplan_path)
+        parts_bytes = sum(os.path.getsize(path) for name, path in plan_parts)
+        print(f'tfplan bytes:\n{tfplan_bytes}\nuploaded bytes:\n{parts_bytes}\nbytes saved:\n{tfplan_bytes - parts_bytes}')
+        return plan_parts
+
+class SamDiscoverer(Discoverer):
+    iac = 'SAM'
+
+    def discover(self, *, source_dir, config):
+        return [('sam_packaged_template.json', os.path.join(source_dir, 'sam_packaged_template.json'))]
+
+# source_iac -> discoverer, a new IaC type only needs a Discoverer registered here
+discoverers = {d.iac: d for d in [CdkDiscoverer(), TerraformDiscoverer(), SamDiscoverer()]}
+
+def register_discoverer(discoverer):
+    discoverers[discoverer.iac] = discoverer
+    return discoverer
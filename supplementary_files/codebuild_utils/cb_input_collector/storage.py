@@ -0,0 +1,89 @@
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+from s3transfer.manager import TransferConfig, TransferManager
+
+class S3Store:
+    # one client and transfer manager shared by every upload of every discoverer,
+    # clients are thread safe
+
+    def __init__(self, *, client=None, max_concurrency=10, part_size_mb=8):
+        self.client = client or boto3.client('s3')
+        # S3 rejects parts under 5 MiB other than the last
+        part_size = max(5, part_size_mb) * 1024 * 1024
+        self.transfer_manager = TransferManager(
+            self.client,
+            TransferConfig(
+                multipart_threshold=part_size,
+                multipart_chunksize=part_size,
+                max_request_concurrency=max_concurrency,
+                # enough parts read ahead to keep every request slot busy on a single large file
+                max_in_memory_upload_chunks=max_concurrency,
+            ),
+        )
+
+    def upload_file(self, *, bucket, key, file_path):
+        try:
+            # S3 checks each part against its checksum as it arrives
+            self.transfer_manager.upload(file_path, bucket, key, extra_args={'ChecksumAlgorithm': 'SHA256'}).result()
+        except ClientError as e:
+            print(f'ClientError:\n{e}')
+            raise
+        else:
+            print(f'no ClientError upload_file\nbucket:\n{bucket}\nkey:\n{key}\nfile_path\n{file_path}\n')
+            return True
+
+    def object_exists(self, *, bucket, key):
+        try:
+            self.client.head_object(
+                Bucket = bucket,
+                Key = key
+            )
+        except ClientError as e:
+            if e.response['ResponseMetadata']['HTTPStatusCode'] == 404:
+                return False
+            print(f'ClientError:\n{e}')
+            raise
+        else:
+            return True
+
+    def get_json(self, *, bucket, key):
+        # None if there is no such object
+        try:
+            r = self.client.get_object(
+                Bucket = bucket,
+                Key = key
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            print(f'ClientError:\n{e}')
+            raise
+        return json.load(r['Body'])
+
+    def shutdown(self):
+        self.transfer_manager.shutdown()
+
+class EvaluationQueue:
+
+    def __init__(self, *, url, client=None):
+        self.url = url
+        self.client = client or boto3.client('sqs')
+
+    def send(self, *, execution_id, item):
+        # picked up by the streaming worker while the remaining inputs are still uploading
+        try:
+            self.client.send_message(
+                QueueUrl = self.url,
+                MessageBody = json.dumps({
+                    "ExecutionId": execution_id,
+                    "CodeBuildInput": item,
+                })
+            )
+        except ClientError as e:
+            print(f'ClientError:\n{e}')
+            raise
+        else:
+            print(f'no ClientError send_message\nkey:\n{item["Key"]}\n')
+            return True
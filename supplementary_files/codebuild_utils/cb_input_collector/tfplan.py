@@ -0,0 +1,125 @@
+import json
+import os
+import re
+from collections import OrderedDict
+
+# top-level objects every shard carries besides the scalars, small enough to repeat per shard;
+# prior_state, configuration and planned_values are not carried, policies that read them need
+# the plan unsharded
+carried_objects = ('variables',)
+
+# shards with an open file at once, module mode can have a shard per module and thousands of modules
+max_open_shards = 64
+
+def plan_metadata(tfplan_path):
+    # top-level scalars (format_version, terraform_version, ...) and carried_objects, shared by every
+    # shard, read as a stream so prior_state/configuration are never held in memory
+    import ijson
+    metadata = {}
+    builders = {}
+    with open(tfplan_path, 'rb') as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            name = prefix.split('.', 1)[0]
+            if name in carried_objects:
+                builders.setdefault(name, ijson.ObjectBuilder()).event(event, value)
+            elif prefix and '.' not in prefix and event in ('string', 'number', 'boolean', 'null'):
+                metadata[prefix] = value
+    for name, builder in builders.items():
+        metadata[name] = builder.value
+    return metadata
+
+class ShardWriter:
+    # writes one shard incrementally, so only the current resource change is in memory
+
+    def __init__(self, *, path, metadata):
+        self.path = path
+        self.count = 0
+        self.closed = False
+        self.f = open(path, 'w')
+        self.f.write(json.dumps(metadata)[:-1] + (', ' if metadata else '') + '"resource_changes": [')
+
+    def suspend(self):
+        # frees the file descriptor, the next write reopens the shard where it left off
+        self.f.close()
+
+    def write(self, resource_change):
+        if self.f.closed:
+            self.f = open(self.path, 'a')
+        self.f.write((', ' if self.count else '') + json.dumps(resource_change))
+        self.count += 1
+
+    def close(self):
+        if self.f.closed:
+            self.f = open(self.path, 'a')
+        self.f.write(']}')
+        self.f.close()
+        self.closed = True
+
+# the actions policies evaluate, a replace is ["delete", "create"] or ["create", "delete"]
+evaluated_actions = {'create', 'update', 'delete'}
+
+def slim_resource_change(resource_change):
+    # only the planned values, prior state and before values are never evaluated
+    change = resource_change['change']
+    slimmed = {k: v for k, v in resource_change.items() if k != 'change'}
+    slimmed['change'] = {
+        'actions': change['actions'],
+        'after': change.get('after'),
+        'after_unknown': change.get('after_unknown'),
+    }
+    return slimmed
+
+def shard_tfplan(*, tfplan_path, shard_dir, shard_by, shard_size, slim):
+    # split resource_changes by module address, or every shard_size resources, streaming the plan once;
+    # without shard_by every resource change goes to a single part
+    import ijson
+    
+    metadata = plan_metadata(tfplan_path)
+    os.makedirs(shard_dir, exist_ok=True)
+    
+    writers = {}
+    shards = []
+    # least recently written last, suspended once more than max_open_shards are open
+    open_writers = OrderedDict()
+    
+    def open_shard(shard_id):
+        # for_each module keys can hold any character
+        file_name = re.sub(r'[^A-Za-z0-9._-]', '_', shard_id)
+        writer = ShardWriter(path=os.path.join(shard_dir, f'{len(shards):04d}-{file_name}.json'), metadata=metadata)
+        shards.append((shard_id, writer))
+        return writer
+    
+    with open(tfplan_path, 'rb') as f:
+        for resource_change in ijson.items(f, 'resource_changes.item', use_float=True):
+            if slim:
+                if not evaluated_actions.intersection(resource_change['change']['actions']):
+                    continue
+                resource_change = slim_resource_change(resource_change)
+            if not shard_by:
+                writer = writers.get('tfplan') or writers.setdefault('tfplan', open_shard('tfplan'))
+            elif shard_by == 'module':
+                shard_id = resource_change.get('module_address') or 'root'
+                writer = writers.get(shard_id) or writers.setdefault(shard_id, open_shard(shard_id))
+            else:
+                writer = writers.get('current')
+                if writer is None or writer.count >= shard_size:
+                    if writer is not None:
+                        writer.close()
+                        open_writers.pop(id(writer), None)
+                    writer = writers['current'] = open_shard(f'shard-{len(shards):04d}')
+            writer.write(resource_change)
+            open_writers[id(writer)] = writer
+            open_writers.move_to_end(id(writer))
+            if len(open_writers) > max_open_shards:
+                open_writers.popitem(last=False)[1].suspend()
+    
+    for shard_id, writer in shards:
+        if not writer.closed:
+            writer.close()
+        print(f'shard:\n{shard_id}\nresource_changes:\n{writer.count}')
+    
+    # a plan without resource changes still gets evaluated once
+    if not shards:
+        open_shard('shard-0000' if shard_by else 'tfplan').close()
+    
+    return [(shard_id, writer.path) for shard_id, writer in shards]
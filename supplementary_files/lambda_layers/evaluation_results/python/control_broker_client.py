@@ -0,0 +1,437 @@
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.exceptions import ClientError
+
+# urllib3 ships with botocore in the Lambda runtime, so no requests or aws_requests_auth layers
+import urllib3
+
+from evaluation_metrics import emit_metrics, metric_dimensions
+from evaluation_results import carried_forward_record, is_compliant, put_results_report
+
+# reading, signing, POSTing and results polling shared by the functions that evaluate CodeBuild inputs
+# (SignApigwRequest, StreamEvaluate and the evaluation service workers), shipped with the evaluation_results
+# layer; each function module builds one ControlBrokerClient, which reads that function's environment once
+
+# API Gateway rejects request bodies over 10 MB
+apigw_max_payload_bytes = 10 * 1024 * 1024
+
+# time left over after the last chunk a batch starts, to report the outcome before the Lambda timeout
+deadline_margin_millis = 10 * 1000
+
+# API Gateway throttling and transient server errors, retried with backoff
+retryable_status_codes = {429, 500, 502, 503, 504}
+
+class APIGWNot200Exception(Exception):
+    # caught by invoking SFN
+    pass
+
+class PayloadTooLargeException(Exception):
+    # caught by invoking SFN
+    pass
+
+class InputNotCompliant(Exception):
+    # caught by invoking SFN in fail-fast mode
+    pass
+
+class StatusCodeNot200Exception(Exception):
+    # caught by invoking SFN, same name as requests_get raises while polling
+    pass
+
+class ChecksumMismatchException(Exception):
+    # the object read is not the input the build uploaded, fails the execution
+    pass
+
+class DeadlineApproachingException(Exception):
+    # a batch stopped between chunks before the Lambda timeout, retried by invoking SFN;
+    # the evaluation service continues from the results of the chunks that finished
+
+    def __init__(self, message, results=None):
+        super().__init__(message)
+        self.results = results or []
+
+# raised for one input, so retrying it won't help; recorded or reported rather than redelivered
+input_exceptions = (APIGWNot200Exception, PayloadTooLargeException, StatusCodeNot200Exception, ChecksumMismatchException)
+
+class TokenBucket:
+    # client-side rate limit shared by every request this container makes, including batch threads
+
+    def __init__(self,*,rate,capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ControlBrokerClient:
+    # one per function module; clients, signer and connection pool are built on first use and reused
+    # across warm invocations, nothing here makes a network call at import
+
+    def __init__(self,*,logger,tracer,environ=None):
+        environ = os.environ if environ is None else environ
+        self.logger = logger
+        self.tracer = tracer
+        self.invoke_url = environ.get('ApigwInvokeUrl')
+        self.pipeline_ownership_metadata = json.loads(environ.get('PipelineOwnershipMetadata') or 'null')
+        self.request_content_encoding = environ.get('ApigwRequestContentEncoding')
+        self.max_retries = int(environ.get('ApigwMaxRetries', 5))
+        self.backoff_base_seconds = float(environ.get('ApigwBackoffBaseSeconds', 0.5))
+        self.backoff_max_seconds = float(environ.get('ApigwBackoffMaxSeconds', 20))
+        self.chunk_size = int(environ.get('BatchChunkSize', 10))
+        self.fail_fast = environ.get('FailFast') == 'true'
+        self.http_connect_timeout_seconds = float(environ.get('HttpConnectTimeoutSeconds', 5))
+        self.http_read_timeout_seconds = float(environ.get('HttpReadTimeoutSeconds', 30))
+        # same schedule as the GetIsCompliant Retry in the Map iterator
+        self.results_poll_max_attempts = int(environ.get('ResultsPollMaxAttempts', 8))
+        self.results_poll_interval_seconds = float(environ.get('ResultsPollIntervalSeconds', 1))
+        self.results_poll_backoff_rate = float(environ.get('ResultsPollBackoffRate', 2.0))
+        self.compact_results = environ.get('CompactResults') == 'true'
+        self.results_reports_bucket = environ.get('ResultsReportsBucket')
+        # a pipeline's own functions have both in their environment, the shared service gets them per message
+        self.dimensions = metric_dimensions(pipeline=environ.get('Pipeline'),source_iac=environ.get('SourceIac'))
+        self.token_bucket = TokenBucket(
+            rate = float(environ.get('ApigwRequestsPerSecond', 10)),
+            capacity = float(environ.get('ApigwBurst', 10)),
+        )
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+
+    def get_client(self, name, factory):
+        if name not in self.clients:
+            with self.clients_lock:
+                if name not in self.clients:
+                    self.clients[name] = factory()
+        return self.clients[name]
+
+    def get_s3(self):
+        return self.get_client('s3', lambda: boto3.client('s3'))
+
+    def get_dynamodb(self):
+        return self.get_client('dynamodb', lambda: boto3.client('dynamodb'))
+
+    def get_sfn(self):
+        return self.get_client('stepfunctions', lambda: boto3.client('stepfunctions'))
+
+    def get_sqs(self):
+        return self.get_client('sqs', lambda: boto3.client('sqs'))
+
+    def get_http(self):
+        # a stalled connection fails the request instead of running into the Lambda timeout
+        return self.get_client('http', lambda: urllib3.PoolManager(
+            maxsize = self.chunk_size,
+            timeout = urllib3.Timeout(
+                connect = self.http_connect_timeout_seconds,
+                read = self.http_read_timeout_seconds,
+            ),
+        ))
+
+    def get_signer(self):
+        def factory():
+            session = boto3.session.Session()
+            # credentials refresh themselves, so the signer can be cached
+            return SigV4Auth(session.get_credentials(), 'execute-api', session.region_name)
+        return self.get_client('signer', factory)
+
+    def backoff_seconds(self,*,attempt,retry_after=None):
+        # full jitter, so throttled concurrent callers don't retry in lockstep;
+        # the gateway's Retry-After is honored up to the same cap
+        if retry_after and retry_after.isdigit():
+            return min(self.backoff_max_seconds, float(retry_after))
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+
+    def get_object(self,*,bucket,key,content_encoding=None,sha256=None,dimensions=None):
+
+        with self.tracer.subsegment('S3Read', Bucket=bucket, Key=key) as span:
+            started = time.perf_counter()
+            try:
+                r = self.get_s3().get_object(
+                    Bucket = bucket,
+                    Key = key
+                )
+            except ClientError as e:
+                self.logger.error('get_object ClientError', Bucket=bucket, Key=key, Error=str(e))
+                raise
+            else:
+                span.set('Bytes', r['ContentLength'])
+                body = r['Body']
+                # decompressed as it is read, so only the uncompressed document is held in memory
+                if content_encoding == 'gzip':
+                    body = gzip.GzipFile(fileobj=body)
+                data = body.read()
+                # Sha256 is the digest of the uncompressed bytes, checked before the document is parsed
+                digest = hashlib.sha256(data).hexdigest()
+                if sha256 and digest != sha256:
+                    raise ChecksumMismatchException(f'bucket: {bucket} key: {key} expected: {sha256} actual: {digest}')
+                content = json.loads(data)
+                emit_metrics(
+                    dimensions = dimensions or self.dimensions,
+                    metrics = {
+                        'S3ReadSeconds': (time.perf_counter() - started, 'Seconds'),
+                        'S3ReadBytes': (r['ContentLength'], 'Bytes'),
+                    }
+                )
+                self.logger.payload('input read', content, Bucket=bucket, Key=key, Bytes=r['ContentLength'], Sha256=digest)
+                return content
+
+    def sign_request(self,*,method,url,data=None,headers=None):
+
+        request = AWSRequest(method=method, url=url, data=data, headers=headers or {})
+        self.get_signer().add_auth(request)
+        return dict(request.headers)
+
+    def post_to_control_broker(self,*,input_to_be_evaluated_object,context=None,dimensions=None,remaining_millis=None):
+
+        dimensions = dimensions or self.dimensions
+
+        cb_input_object = {
+            # the shared evaluation service passes each pipeline's own context
+            "Context": context or {
+                "EnvironmentEvaluation":"Prod",
+                "PipelineOwnershipMetadata" : self.pipeline_ownership_metadata,
+            },
+            "Input": input_to_be_evaluated_object
+        }
+
+        data = json.dumps(cb_input_object).encode('utf-8')
+
+        headers = {'Content-Type': 'application/json'}
+
+        # only for an API with a minimum compression size set, otherwise API Gateway won't decode it
+        if self.request_content_encoding == 'gzip':
+            data = gzip.compress(data, mtime=0)
+            headers['Content-Encoding'] = 'gzip'
+
+        if len(data) > apigw_max_payload_bytes:
+            self.logger.error('request body too large', Bytes=len(data), MaxBytes=apigw_max_payload_bytes)
+            raise PayloadTooLargeException
+
+        rate_limit_seconds = 0.0
+        signing_seconds = 0.0
+
+        for attempt in range(self.max_retries + 1):
+
+            started = time.perf_counter()
+            self.token_bucket.acquire()
+            rate_limit_seconds += time.perf_counter() - started
+
+            with self.tracer.subsegment('ControlBrokerPost', Attempt=attempt + 1, Bytes=len(data)) as span:
+
+                started = time.perf_counter()
+                # re-signed per attempt, SigV4 signatures carry a timestamp
+                signed_headers = self.sign_request(
+                    method = 'POST',
+                    url = self.invoke_url,
+                    data = data,
+                    headers = headers
+                )
+                signing_seconds += time.perf_counter() - started
+
+                started = time.perf_counter()
+                r = self.get_http().request(
+                    'POST',
+                    self.invoke_url,
+                    body = data,
+                    headers = signed_headers
+                )
+
+                status_code = r.status
+                span.set('StatusCode', status_code)
+
+            emit_metrics(
+                dimensions = dict(dimensions, StatusCode=str(status_code)),
+                metrics = {
+                    'ControlBrokerPostSeconds': (time.perf_counter() - started, 'Seconds'),
+                }
+            )
+
+            self.logger.debug('signed request', Headers=list(signed_headers), Attempt=attempt + 1)
+
+            if status_code not in retryable_status_codes or attempt == self.max_retries:
+                break
+
+            sleep_seconds = self.backoff_seconds(attempt=attempt,retry_after=r.headers.get('Retry-After'))
+            # a Lambda timeout is not caught as APIGWNot200Exception, so give up while there is still time to raise
+            remaining = remaining_millis() if remaining_millis else None
+            if remaining is not None and remaining < sleep_seconds * 1000 + deadline_margin_millis:
+                self.logger.error('retry would outlast the Lambda timeout', StatusCode=status_code, Attempt=attempt + 1, SleepSeconds=round(sleep_seconds, 3), RemainingMillis=remaining)
+                break
+            self.logger.warning('retryable status code', StatusCode=status_code, Attempt=attempt + 1, SleepSeconds=round(sleep_seconds, 3))
+            time.sleep(sleep_seconds)
+
+        emit_metrics(
+            dimensions = dimensions,
+            metrics = {
+                'ControlBrokerPostAttempts': (attempt + 1, 'Count'),
+                'ControlBrokerRequestBytes': (len(data), 'Bytes'),
+                'SigV4SigningSeconds': (signing_seconds, 'Seconds'),
+                'RateLimitWaitSeconds': (rate_limit_seconds, 'Seconds'),
+            }
+        )
+
+        if status_code != 200:
+            # gateway errors are not always JSON
+            self.logger.payload('apigw_response', r.data, level='ERROR', StatusCode=status_code)
+            raise APIGWNot200Exception
+
+        content = json.loads(r.data)
+
+        self.logger.payload('apigw_response', content, StatusCode=status_code, Bytes=len(r.data))
+
+        return content
+
+    def get_results_report(self,*,url,dimensions=None):
+
+        started = time.perf_counter()
+        max_attempts = self.results_poll_max_attempts
+
+        def emit_poll_metrics(*,attempts,found):
+            emit_metrics(
+                dimensions = dimensions or self.dimensions,
+                metrics = {
+                    'ResultsPollAttempts': (attempts, 'Count'),
+                    'ResultsPollSeconds': (time.perf_counter() - started, 'Seconds'),
+                    'ResultsReportMissing': (0 if found else 1, 'Count'),
+                }
+            )
+
+        for attempt in range(max_attempts + 1):
+            # without the presigned query string
+            with self.tracer.subsegment('ResultsReportGet', Url=url.split('?')[0], Attempt=attempt + 1) as span:
+                r = self.get_http().request('GET', url)
+                span.set('StatusCode', r.status)
+            if r.status == 200:
+                emit_poll_metrics(attempts=attempt + 1,found=True)
+                return json.loads(r.data)
+            if attempt < max_attempts:
+                time.sleep(self.results_poll_interval_seconds * self.results_poll_backoff_rate ** attempt)
+
+        emit_poll_metrics(attempts=max_attempts + 1,found=False)
+        # without the presigned query string
+        self.logger.error('results report does not yet exist', Url=url.split('?')[0], Attempts=max_attempts + 1)
+        raise StatusCodeNot200Exception
+
+    def evaluate_codebuild_input(self,*,codebuild_input,context=None,dimensions=None,remaining_millis=None):
+
+        if codebuild_input.get('CarriedForward'):
+            return carried_forward_record(codebuild_input,compact=self.compact_results)
+
+        input_to_be_evaluated_object = self.get_object(
+            bucket = codebuild_input['Bucket'],
+            key = codebuild_input['Key'],
+            content_encoding = codebuild_input.get('ContentEncoding'),
+            sha256 = codebuild_input.get('Sha256'),
+            dimensions = dimensions,
+        )
+
+        content = self.post_to_control_broker(
+            input_to_be_evaluated_object = input_to_be_evaluated_object,
+            context = context,
+            dimensions = dimensions,
+            remaining_millis = remaining_millis,
+        )
+
+        url = content['Response']['ControlBrokerEvaluation']['OutputHandlers']['OPA']['PresignedUrl']
+
+        results_report = self.get_results_report(
+            url = url,
+            dimensions = dimensions,
+        )
+
+        # same record as a compact ForEachCodeBuildInput iteration
+        if self.compact_results:
+            return {
+                "Key": codebuild_input['Key'],
+                "IsCompliant": results_report['EvalEngineLambdalith']['Evaluation']['IsCompliant'],
+                "ResultUrl": url,
+                "ReportS3Uri": put_results_report(s3=self.get_s3(),bucket=self.results_reports_bucket,url=url,results_report=results_report),
+            }
+
+        # same shape as a ForEachCodeBuildInput iteration, so ParseResultsDetermineCompliance reads either
+        return {
+            "CodeBuildInput": codebuild_input,
+            "GetIsCompliant": {
+                "Payload": results_report
+            }
+        }
+
+    def evaluate_batch(self,*,codebuild_inputs,context=None,fail_fast=None,dimensions=None,remaining_millis=None):
+
+        if fail_fast is None:
+            fail_fast = self.fail_fast
+
+        results = []
+
+        # the slowest chunk so far, the estimate for the next one
+        chunk_millis = 0
+
+        # one chunk of objects in memory and in flight to API Gateway at a time
+        for i in range(0, len(codebuild_inputs), self.chunk_size):
+            # a Lambda timeout reports nothing, so stop while there is still time to raise
+            remaining = remaining_millis() if remaining_millis else None
+            if remaining is not None and remaining < chunk_millis + deadline_margin_millis:
+                self.logger.error('deadline approaching', Evaluated=i, Inputs=len(codebuild_inputs), RemainingMillis=remaining)
+                raise DeadlineApproachingException(f'{i} of {len(codebuild_inputs)} inputs evaluated', results=results)
+            started = time.perf_counter()
+            chunk = codebuild_inputs[i:i + self.chunk_size]
+            self.logger.info('evaluate_batch chunk', Chunk=i // self.chunk_size + 1, Inputs=len(chunk))
+            with ThreadPoolExecutor(max_workers=len(chunk)) as executor:
+                results.extend(executor.map(
+                    self.tracer.propagate(lambda codebuild_input: self.evaluate_codebuild_input(
+                        codebuild_input = codebuild_input,
+                        context = context,
+                        dimensions = dimensions,
+                        remaining_millis = remaining_millis,
+                    )),
+                    chunk
+                ))
+            chunk_millis = max(chunk_millis, (time.perf_counter() - started) * 1000)
+            # in-flight evaluations of a chunk finish, later chunks are never submitted
+            non_compliant = [r for r in results if not is_compliant(r)]
+            if fail_fast and non_compliant:
+                first = non_compliant[0]
+                raise InputNotCompliant(json.dumps(first.get('CodeBuildInput') or first))
+
+        return results
+
+    def evaluate_records(self,*,records,evaluate_message):
+
+        # SQS event source with ReportBatchItemFailures, only the failed messages are redelivered
+        def evaluate(record):
+            try:
+                message = json.loads(record['body'])
+                receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+                self.logger.info('record', MessageId=record['messageId'], Pipeline=message.get('Pipeline'))
+                # a streamed input's ExecutionId is the CodePipeline execution it was collected in
+                self.tracer.annotate(CodePipelineExecutionId=message.get('CodePipelineExecutionId') or message.get('ExecutionId'))
+                evaluate_message(message=message,receive_count=receive_count)
+            except Exception as e:
+                self.logger.error('evaluation failed', MessageId=record['messageId'], Error=type(e).__name__, Cause=str(e))
+                return {"itemIdentifier": record['messageId']}
+
+        with ThreadPoolExecutor(max_workers=len(records)) as executor:
+            failures = [f for f in executor.map(self.tracer.propagate(evaluate), records) if f]
+
+        return {
+            "batchItemFailures": failures
+        }
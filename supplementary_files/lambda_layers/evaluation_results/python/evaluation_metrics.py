@@ -0,0 +1,39 @@
+import json
+import sys
+import threading
+import time
+
+# CloudWatch embedded metric format for the evaluation functions, shipped with the evaluation_results layer;
+# extracted from the log line without a PutMetricData call, each function passes its own dimensions
+
+namespace = 'ControlBrokerConsumer'
+
+# batch threads emit concurrently, a line split by another thread's output is dropped by CloudWatch
+lock = threading.Lock()
+
+def metric_dimensions(*,pipeline=None,source_iac=None,**dimensions):
+    # a pipeline's own functions have both in their environment, the shared service gets them per message
+    return {
+        'Pipeline': pipeline or 'Unknown',
+        'SourceIac': source_iac or 'Unknown',
+        **dimensions,
+    }
+
+def emit_metrics(*,dimensions,metrics):
+    # metrics maps each name to its value and unit
+    line = json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (value, unit) in metrics.items()]
+                }
+            ]
+        },
+        **dimensions,
+        **{name: value for name, (value, unit) in metrics.items()}
+    })
+    with lock:
+        sys.stdout.write(line + '\n')
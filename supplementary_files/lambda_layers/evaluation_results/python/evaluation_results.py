@@ -0,0 +1,76 @@
+import json
+import urllib.parse
+
+# verdict records shared by the functions that build or read them, shipped to each of them as a layer;
+# callers pass their own client and settings, each function reads its own environment
+
+def is_compliant(result):
+    # compact verdict records carry IsCompliant at the top level, the others are Map iteration outputs
+    if 'IsCompliant' in result:
+        return result['IsCompliant']
+    return result['GetIsCompliant']['Payload']['EvalEngineLambdalith']['Evaluation']['IsCompliant']
+
+def carried_forward_record(codebuild_input,compact=False):
+    # unchanged since the last compliant execution, so compliant without another evaluation
+    if compact:
+        return {
+            "Key": codebuild_input['Key'],
+            "IsCompliant": True,
+            "ResultUrl": None,
+            "ReportS3Uri": None,
+            "CarriedForward": True,
+        }
+    return {
+        "CodeBuildInput": codebuild_input,
+        "GetIsCompliant": {
+            "Payload": {
+                "EvalEngineLambdalith": {
+                    "Evaluation": {
+                        "IsCompliant": True
+                    }
+                },
+                "ResultUrl": None,
+                "ReportS3Uri": None,
+            }
+        }
+    }
+
+def put_results_report(*,s3,bucket,url,results_report):
+    # the full report is kept out of the state machine payload and referenced by this URI
+    key = urllib.parse.urlparse(url).path.lstrip('/')
+    s3.put_object(
+        Bucket = bucket,
+        Key = key,
+        Body = json.dumps(results_report),
+        ContentType = 'application/json'
+    )
+    return f's3://{bucket}/{key}'
+
+def compact_verdict(*,s3,bucket,url,results_report):
+    # a GetIsCompliant payload with only the verdict, the report itself is stored by put_results_report
+    return {
+        "EvalEngineLambdalith": {
+            "Evaluation": {
+                "IsCompliant": results_report['EvalEngineLambdalith']['Evaluation']['IsCompliant']
+            }
+        },
+        "ResultUrl": url,
+        "ReportS3Uri": put_results_report(s3=s3,bucket=bucket,url=url,results_report=results_report),
+    }
+
+def verdict_record(result):
+    # a full-shape result without its report, compact records are already this small
+    if 'GetIsCompliant' not in result:
+        return result
+    return {
+        "CodeBuildInput": result['CodeBuildInput'],
+        "GetIsCompliant": {
+            "Payload": {
+                "EvalEngineLambdalith": {
+                    "Evaluation": {
+                        "IsCompliant": is_compliant(result)
+                    }
+                }
+            }
+        }
+    }
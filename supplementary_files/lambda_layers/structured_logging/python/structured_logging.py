@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+
+# leveled JSON logging for the evaluation Lambdas, shipped to each of them as a layer;
+# payloads (events, objects, reports) are logged as their size, keys and digest unless the level is
+# DEBUG or the invocation was sampled, so a multi-MB template is never serialized just to be logged
+
+levels = {
+    'DEBUG': 10,
+    'INFO': 20,
+    'WARNING': 30,
+    'ERROR': 40,
+}
+
+# the names other logging libraries use for the same levels
+level_aliases = {
+    'WARN': 'WARNING',
+    'CRITICAL': 'ERROR',
+    'FATAL': 'ERROR',
+}
+
+def level_number(name):
+    # a misspelled LogLevel would otherwise take down every function using the layer with a bare KeyError
+    name = name.upper()
+    name = level_aliases.get(name, name)
+    if name not in levels:
+        raise ValueError(f"LogLevel {name} is not one of {', '.join(levels)}")
+    return levels[name]
+
+# top-level keys listed in a payload summary
+max_summary_keys = 20
+
+def summarize(value):
+    # only what is cheap to compute: the keys of a mapping, the length of a sequence,
+    # and the size and digest of raw bytes
+    if isinstance(value, dict):
+        keys = list(value)
+        summary = {'Keys': keys[:max_summary_keys], 'KeyCount': len(keys)}
+    elif isinstance(value, (list, tuple)):
+        summary = {'Items': len(value)}
+    elif isinstance(value, (bytes, bytearray, str)):
+        data = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+        summary = {'Bytes': len(data), 'Sha256': hashlib.sha256(data).hexdigest()}
+    else:
+        summary = {'Type': type(value).__name__}
+    return summary
+
+class Logger:
+    # one per function module; level and sample rate come from LogLevel and LogSampleRate
+
+    def __init__(self,*,name,level=None,sample_rate=None):
+        self.name = name
+        self.level = level_number(level or os.environ.get('LogLevel') or 'INFO')
+        self.sample_rate = float(os.environ.get('LogSampleRate') or 0) if sample_rate is None else sample_rate
+        self.sampled = False
+        self.fields = {}
+        self.lock = threading.Lock()
+
+    def start_invocation(self,context=None,**fields):
+        # sampled per invocation, so a sampled invocation logs everything it does at DEBUG
+        self.sampled = random.random() < self.sample_rate
+        self.fields = dict(fields)
+        if context is not None:
+            self.fields['RequestId'] = getattr(context, 'aws_request_id', None)
+        if self.sampled:
+            self.fields['Sampled'] = True
+
+    def is_enabled(self,level):
+        return self.sampled or levels[level] >= self.level
+
+    def log(self,level,message,**fields):
+        if not self.is_enabled(level):
+            return
+        record = {
+            'Level': level,
+            'Logger': self.name,
+            'Message': message,
+            **self.fields,
+            **fields,
+        }
+        line = json.dumps(record, default=str)
+        # batch threads log concurrently, one line at a time; a single write, so the line and its newline
+        # are not split by metric lines written from other threads
+        with self.lock:
+            sys.stdout.write(line + '\n')
+
+    def debug(self,message,**fields):
+        self.log('DEBUG', message, **fields)
+
+    def info(self,message,**fields):
+        self.log('INFO', message, **fields)
+
+    def warning(self,message,**fields):
+        self.log('WARNING', message, **fields)
+
+    def error(self,message,**fields):
+        self.log('ERROR', message, **fields)
+
+    def payload(self,message,value,level='INFO',**fields):
+        # the full payload at DEBUG or when sampled, otherwise its summary and what the caller already knows,
+        # e.g. the byte count and digest computed while the object was read
+        if not self.is_enabled(level):
+            return
+        if self.is_enabled('DEBUG'):
+            fields['Payload'] = value
+        else:
+            fields = dict(summarize(value), **fields)
+        self.log(level, message, **fields)
@@ -0,0 +1,135 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+
+# subsegments around the calls an evaluation spends its time in, annotated with the CodePipeline
+# execution they belong to; TracingExporter picks where they go:
+#
+#   xray   X-Ray, through aws_xray_sdk from the XRaySdk layer the stack adds when tracing is on
+#   local  in memory, and as JSON lines to TracingLocalFile when that is set, for local runs and tests
+#   unset  nowhere, a subsegment is a no-op
+
+try:
+    from aws_xray_sdk.core import xray_recorder
+except ImportError:
+    xray_recorder = None
+
+def execution_id(event):
+    # passed by the state machine to each function, or within the whole CodeBuild artifact
+    if not isinstance(event, dict):
+        return None
+    return event.get('CodePipelineExecutionId') or event.get('CodeBuildToSfnArtifact', {}).get('CodePipelineExecutionId')
+
+class LocalExporter:
+    # finished spans, shared by every function loaded in the process
+
+    def __init__(self,*,path=None):
+        self.path = path
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def export(self,span):
+        with self.lock:
+            self.spans.append(span)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(span, default=str) + '\n')
+
+    def clear(self):
+        with self.lock:
+            self.spans = []
+
+local_exporter = LocalExporter(path=os.environ.get('TracingLocalFile') or None)
+
+class Span:
+    # what a subsegment's body can add to it once it knows, e.g. the response status
+
+    def __init__(self,*,namespace,subsegment=None,record=None):
+        self.namespace = namespace
+        self.subsegment = subsegment
+        self.record = record
+
+    def set(self,key,value):
+        if self.subsegment is not None:
+            self.subsegment.put_metadata(key, value, self.namespace)
+        if self.record is not None:
+            self.record['Metadata'][key] = value
+
+class Tracer:
+    # one per function module; annotations are per thread, so concurrent records keep their own
+
+    def __init__(self,*,name,exporter=None):
+        self.name = name
+        self.exporter = os.environ.get('TracingExporter', '') if exporter is None else exporter
+        if self.exporter == 'xray' and xray_recorder is None:
+            print(json.dumps({'Level': 'WARNING', 'Logger': name, 'Message': 'aws_xray_sdk not found, tracing is off'}))
+            self.exporter = ''
+        self.local = threading.local()
+
+    @property
+    def annotations(self):
+        return getattr(self.local, 'annotations', {})
+
+    def annotate(self,**annotations):
+        self.local.annotations = dict(self.annotations, **{k: v for k, v in annotations.items() if v is not None})
+
+    def start_invocation(self,event):
+        self.local.annotations = {}
+        self.local.parent = None
+        self.annotate(CodePipelineExecutionId=execution_id(event))
+
+    @contextlib.contextmanager
+    def subsegment(self,name,**metadata):
+        if self.exporter == 'xray':
+            with xray_recorder.in_subsegment(name) as subsegment:
+                for key, value in self.annotations.items():
+                    subsegment.put_annotation(key, value)
+                for key, value in metadata.items():
+                    subsegment.put_metadata(key, value, self.name)
+                yield Span(namespace=self.name, subsegment=subsegment)
+            return
+        if self.exporter != 'local':
+            yield Span(namespace=self.name)
+            return
+        record = {
+            'Name': name,
+            'Function': self.name,
+            'Id': uuid.uuid4().hex[:16],
+            'ParentId': getattr(self.local, 'parent', None),
+            'Annotations': dict(self.annotations),
+            'Metadata': dict(metadata),
+            'StartTime': time.time(),
+        }
+        self.local.parent = record['Id']
+        started = time.perf_counter()
+        try:
+            yield Span(namespace=self.name, record=record)
+        except Exception as e:
+            record['Error'] = type(e).__name__
+            raise
+        finally:
+            record['Seconds'] = time.perf_counter() - started
+            self.local.parent = record['ParentId']
+            local_exporter.export(record)
+
+    def propagate(self,fn):
+        # worker threads start without the invocation's trace entity, annotations and parent span
+        annotations = self.annotations
+        parent = getattr(self.local, 'parent', None)
+        entity = xray_recorder.get_trace_entity() if self.exporter == 'xray' else None
+
+        def run(*args, **kwargs):
+            self.local.annotations = annotations
+            self.local.parent = parent
+            if entity is not None:
+                xray_recorder.set_trace_entity(entity)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if entity is not None:
+                    xray_recorder.clear_trace_entities()
+
+        return run
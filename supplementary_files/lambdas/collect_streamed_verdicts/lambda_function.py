@@ -0,0 +1,78 @@
+import json
+import os
+
+import boto3
+from botocore.exceptions import ClientError
+
+from evaluation_results import carried_forward_record, is_compliant
+from structured_logging import Logger
+
+logger = Logger(name='collect_streamed_verdicts')
+
+dynamodb = boto3.client('dynamodb')
+
+class VerdictsNotYetStreamed(Exception):
+    # retried by invoking SFN
+    pass
+
+class StreamedEvaluationFailed(Exception):
+    # caught by invoking SFN
+    pass
+
+class InputNotCompliant(Exception):
+    # caught by invoking SFN in fail-fast mode
+    pass
+
+def get_streamed_verdicts(*,execution_id):
+
+    records = {}
+
+    try:
+        # consistent, so a verdict written just before this read is not missed
+        for page in dynamodb.get_paginator('query').paginate(
+            TableName = os.environ['StreamedVerdictsTable'],
+            KeyConditionExpression = 'ExecutionId = :execution_id',
+            ExpressionAttributeValues = {
+                ':execution_id': {'S': execution_id},
+            },
+            ConsistentRead = True,
+        ):
+            for item in page['Items']:
+                records[item['InputKey']['S']] = json.loads(item['Record']['S'])
+    except ClientError as e:
+        logger.error('get_streamed_verdicts ClientError', ExecutionId=execution_id, Error=str(e))
+        raise
+
+    return records
+
+def lambda_handler(event,context):
+
+    logger.start_invocation(context)
+
+    execution_id = event['ExecutionId']
+    codebuild_inputs = event['Inputs']
+
+    records = get_streamed_verdicts(execution_id=execution_id)
+
+    failed = [r for r in records.values() if 'Error' in r]
+    if failed:
+        raise StreamedEvaluationFailed(json.dumps(failed[0]))
+
+    # no need to wait for the rest once one input is known to be non-compliant
+    if os.environ.get('FailFast') == 'true':
+        non_compliant = [r for r in records.values() if not is_compliant(r)]
+        if non_compliant:
+            first = non_compliant[0]
+            raise InputNotCompliant(json.dumps(first.get('CodeBuildInput') or first))
+
+    missing = [i['Key'] for i in codebuild_inputs if not i.get('CarriedForward') and i['Key'] not in records]
+
+    logger.info('streamed verdicts', ExecutionId=execution_id, Inputs=len(codebuild_inputs), StreamedVerdicts=len(records), Missing=len(missing))
+    logger.debug('missing verdicts', Keys=missing)
+
+    if missing:
+        raise VerdictsNotYetStreamed(f'{len(missing)} of {len(codebuild_inputs)} verdicts not yet streamed')
+
+    # same items as the Map output, in CodeBuildInputs order
+    compact = os.environ.get('CompactResults') == 'true'
+    return [carried_forward_record(i,compact=compact) if i.get('CarriedForward') else records[i['Key']] for i in codebuild_inputs]
@@ -0,0 +1,144 @@
+import time
+
+import_started = time.perf_counter()
+
+import hashlib
+import json
+import os
+
+from control_broker_client import ControlBrokerClient, DeadlineApproachingException, InputNotCompliant, input_exceptions
+from evaluation_metrics import metric_dimensions
+from evaluation_results import verdict_record
+from structured_logging import Logger
+from tracing import Tracer
+
+logger = Logger(name='evaluation_service_worker')
+tracer = Tracer(name='evaluation_service_worker')
+
+# reads, signs, POSTs and polls, shared with SignApigwRequest
+client = ControlBrokerClient(logger=logger,tracer=tracer)
+
+# SendTaskSuccess output is capped at 256 KB, larger evaluation service results keep only the verdicts
+task_output_max_bytes = 256 * 1024
+
+# SQS message bodies are capped at 256 KB, an evaluation service request continued in a new message has to fit
+message_max_bytes = 256 * 1024
+
+def task_output(results):
+    output = json.dumps(results)
+    if len(output) <= task_output_max_bytes:
+        return output
+    return json.dumps([verdict_record(r) for r in results])
+
+def send_task_result(*,task_token,results=None,error=None,cause=None):
+
+    sfn = client.get_sfn()
+    try:
+        if error:
+            sfn.send_task_failure(
+                taskToken = task_token,
+                error = error,
+                cause = cause[:32768]
+            )
+        else:
+            sfn.send_task_success(
+                taskToken = task_token,
+                output = task_output(results)
+            )
+    except (sfn.exceptions.TaskTimedOut, sfn.exceptions.InvalidToken) as e:
+        # a redelivered message for an execution that already moved on
+        logger.warning(type(e).__name__, TaskToken=task_token[:32])
+
+def continue_service_request(*,message,results):
+
+    # the rest of the inputs in a new message, so no single invocation runs into the Lambda timeout
+    continuation = dict(
+        message,
+        Inputs = message['Inputs'][len(results):],
+        Results = message.get('Results', []) + [verdict_record(r) for r in results],
+    )
+    body = json.dumps(continuation)
+
+    if len(body) > message_max_bytes:
+        logger.error('continuation too large', Bytes=len(body), MaxBytes=message_max_bytes)
+        return False
+
+    client.get_sqs().send_message(
+        QueueUrl = os.environ['EvaluationQueueUrl'],
+        MessageBody = body,
+        MessageGroupId = message.get('Pipeline') or 'Unknown',
+        # unique per continuation of one request
+        MessageDeduplicationId = hashlib.sha256(f"{message['TaskToken']}:{len(continuation['Results'])}".encode('utf-8')).hexdigest(),
+    )
+    logger.info('continued', Evaluated=len(continuation['Results']), Remaining=len(continuation['Inputs']))
+    return True
+
+def evaluate_service_request(*,message,receive_count=1,remaining_millis=None):
+
+    # a whole pipeline execution, or what is left of it, reported back to the execution waiting on its task token
+    try:
+        results = client.evaluate_batch(
+            codebuild_inputs = message['Inputs'],
+            context = message.get('Context'),
+            fail_fast = message.get('FailFast', False),
+            dimensions = metric_dimensions(pipeline=message.get('Pipeline'),source_iac=message.get('SourceIac')),
+            remaining_millis = remaining_millis,
+        )
+    except DeadlineApproachingException as e:
+        # a request that made no progress would only be continued again
+        if not e.results or not continue_service_request(message=message,results=e.results):
+            send_task_result(
+                task_token = message['TaskToken'],
+                error = type(e).__name__,
+                cause = str(e),
+            )
+        return
+    except input_exceptions + (InputNotCompliant,) as e:
+        send_task_result(
+            task_token = message['TaskToken'],
+            error = type(e).__name__,
+            cause = str(e),
+        )
+        return
+    except Exception as e:
+        # redelivered, except on the last receive before the dead-letter queue, which fails the waiting execution;
+        # MaxReceiveCount is the queue's redrive setting, set by the stack that owns the queue
+        if receive_count >= int(os.environ['MaxReceiveCount']):
+            send_task_result(
+                task_token = message['TaskToken'],
+                error = type(e).__name__,
+                cause = str(e),
+            )
+        raise
+
+    send_task_result(
+        task_token = message['TaskToken'],
+        results = message.get('Results', []) + results,
+    )
+
+import_seconds = time.perf_counter() - import_started
+cold_start = True
+
+def lambda_handler(event,context):
+
+    global cold_start
+
+    logger.start_invocation(context)
+    logger.payload('event', event)
+    tracer.start_invocation(event)
+
+    started = time.perf_counter()
+    try:
+        return client.evaluate_records(
+            records = event['Records'],
+            evaluate_message = lambda *, message, receive_count: evaluate_service_request(
+                message = message,
+                receive_count = receive_count,
+                remaining_millis = context.get_remaining_time_in_millis,
+            ),
+        )
+    finally:
+        # the first invocation of a container also builds the client, signer and connection pool
+        if cold_start:
+            logger.info('cold start', ImportSeconds=round(import_seconds, 3), FirstInvocationSeconds=round(time.perf_counter() - started, 3))
+            cold_start = False
@@ -1,30 +1,50 @@
+import gzip
 import json
+import os
+import time
 import boto3
 from botocore.exceptions import ClientError
 
+from evaluation_metrics import emit_metrics, metric_dimensions
+from structured_logging import Logger
+
+logger = Logger(name='get_object')
+
 s3 = boto3.client('s3')
 
-def get_object(*,bucket,key):
+def get_object(*,bucket,key,content_encoding=None):
     
-    print(f'begin get_object:\nbucket:\n{bucket}\nkey:\n{key}')
+    logger.debug('get_object', Bucket=bucket, Key=key)
+    started = time.perf_counter()
     try:
         r = s3.get_object(
             Bucket = bucket,
             Key = key
         )
     except ClientError as e:
-        print(e)
+        logger.warning('get_object ClientError', Bucket=bucket, Key=key, Error=str(e))
         if e.response['ResponseMetadata']['HTTPStatusCode'] == 403:
-            print(f'403 as proxy for nonexistance, but may hide actual actual IAM issues')
+            logger.warning('403 as proxy for nonexistance, but may hide actual actual IAM issues')
             return False
         if e.response['ResponseMetadata']['HTTPStatusCode'] == 404:
             return False
         else:
             raise
     else:
-        print(f'no ClientError get_object:\nbucket:\n{bucket}\nkey:\n{key}')
         body = r['Body']
-        content = json.loads(body.read().decode('utf-8'))
+        # decompressed as it is read, so only the uncompressed document is held in memory
+        if content_encoding == 'gzip':
+            content = json.load(gzip.GzipFile(fileobj=body))
+        else:
+            content = json.loads(body.read().decode('utf-8'))
+        emit_metrics(
+            dimensions = metric_dimensions(pipeline=os.environ.get('Pipeline'),source_iac=os.environ.get('SourceIac')),
+            metrics = {
+                'S3ReadSeconds': (time.perf_counter() - started, 'Seconds'),
+                'S3ReadBytes': (r['ContentLength'], 'Bytes'),
+            }
+        )
+        logger.payload('object read', content, Bucket=bucket, Key=key, Bytes=r['ContentLength'])
         return content
 
 def s3_uri_to_bucket_key(*,uri):
@@ -38,7 +58,8 @@ def lambda_handler(event,context):
     class ObjectDoesNotExistException(Exception):
         pass
     
-    print(event)
+    logger.start_invocation(context)
+    logger.payload('event', event)
     
     bucket = event.get('Bucket')
     key = event.get('Key')
@@ -46,9 +67,7 @@ def lambda_handler(event,context):
     if not bucket and not key:
         bucket, key = s3_uri_to_bucket_key(uri=event['S3Uri'])
 
-    object_ = get_object(bucket=bucket,key=key)
-    
-    print(f'object_:\n{object_}')
+    object_ = get_object(bucket=bucket,key=key,content_encoding=event.get('ContentEncoding'))
     
     if not object_:
         raise ObjectDoesNotExistException
@@ -1,15 +1,57 @@
+import os
+
+from evaluation_metrics import emit_metrics, metric_dimensions
+from evaluation_results import is_compliant
+from structured_logging import Logger
+from tracing import Tracer
+
+logger = Logger(name='parse_results_determine_compliance')
+tracer = Tracer(name='parse_results_determine_compliance')
+
+def is_carried_forward(result):
+    # unchanged since the last green execution, so not evaluated in this one
+    if 'CarriedForward' in result:
+        return result['CarriedForward']
+    return result.get('CodeBuildInput', {}).get('CarriedForward', False)
+
+def input_key(result):
+    return result.get('CodeBuildInput', result)['Key']
+
 def lambda_handler(event,context):
     
-    print(event)
+    logger.start_invocation(context)
+    logger.payload('event', event)
+    tracer.start_invocation(event)
     
-    all_codebuild_inputs = [i['GetIsCompliant']['Payload']['EvalEngineLambdalith']['Evaluation']['IsCompliant'] for i in event['ForEachCodeBuildInput']]
+    with tracer.subsegment('DetermineCompliance', Inputs=len(event['ForEachCodeBuildInput'])):
+        
+        all_codebuild_inputs = [is_compliant(i) for i in event['ForEachCodeBuildInput']]
 
-    print(all_codebuild_inputs)
+        logger.debug('verdicts', Verdicts=all_codebuild_inputs)
+        
+        all_codebuild_inputs_compliant = all(all_codebuild_inputs)
+        
+        evaluated = [input_key(i) for i in event['ForEachCodeBuildInput'] if not is_carried_forward(i)]
+        carried_forward = [input_key(i) for i in event['ForEachCodeBuildInput'] if is_carried_forward(i)]
+    
+    logger.info('compliance', AllCodeBuildInputsCompliant=all_codebuild_inputs_compliant, Evaluated=len(evaluated), CarriedForward=len(carried_forward))
     
-    all_codebuild_inputs_compliant = all(all_codebuild_inputs)
+    # the keys grow with the input count, so they are logged rather than returned into the execution state
+    logger.info('inputs', Evaluated=evaluated, CarriedForward=carried_forward)
     
-    print(f'all_codebuild_inputs_compliant:\n{all_codebuild_inputs_compliant}')
+    emit_metrics(
+        dimensions = metric_dimensions(pipeline=os.environ.get('Pipeline'),source_iac=os.environ.get('SourceIac')),
+        metrics = {
+            'Inputs': (len(all_codebuild_inputs), 'Count'),
+            'CompliantInputs': (sum(all_codebuild_inputs), 'Count'),
+            'NonCompliantInputs': (len(all_codebuild_inputs) - sum(all_codebuild_inputs), 'Count'),
+            'EvaluatedInputs': (len(evaluated), 'Count'),
+            'CarriedForwardInputs': (len(carried_forward), 'Count'),
+        }
+    )
     
     return {
-        "AllCodeBuildInputsCompliant": all_codebuild_inputs_compliant
-    }
\ No newline at end of file
+        "AllCodeBuildInputsCompliant": all_codebuild_inputs_compliant,
+        "EvaluatedInputs": len(evaluated),
+        "CarriedForwardInputs": len(carried_forward),
+    }
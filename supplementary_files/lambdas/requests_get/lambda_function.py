@@ -1,17 +1,52 @@
-from time import sleep
 import json
+import os
+import time
 import requests
+import boto3
 
-def requests_get(url):
-    print(f'url:\n{url}')
-    r = requests.get(url)
+from evaluation_metrics import emit_metrics, metric_dimensions
+from evaluation_results import compact_verdict
+from structured_logging import Logger
+from tracing import Tracer
+
+logger = Logger(name='requests_get')
+tracer = Tracer(name='requests_get')
+
+s3 = boto3.client('s3')
+
+def requests_get(url,retry_count=0):
+    # without the presigned query string
+    logger.debug('requests_get', Url=url.split('?')[0])
+    started = time.perf_counter()
+    with tracer.subsegment('ResultsReportGet', Url=url.split('?')[0]) as span:
+        r = requests.get(url)
+        span.set('StatusCode', r.status_code)
+    dimensions = metric_dimensions(pipeline=os.environ.get('Pipeline'),source_iac=os.environ.get('SourceIac'))
+    # one poll attempt, Step Functions retries this function until the report exists
+    emit_metrics(
+        dimensions = dict(dimensions, StatusCode=str(r.status_code)),
+        metrics = {
+            'ResultsReportGetSeconds': (time.perf_counter() - started, 'Seconds'),
+            'ResultsReportBytes': (len(r.content), 'Bytes'),
+        }
+    )
+    # the GetIsCompliant Retry passes its count, so the whole poll is reported once, by its last attempt
+    found = r.status_code == 200
+    if found or retry_count >= int(os.environ.get('ResultsPollMaxAttempts', 8)):
+        emit_metrics(
+            dimensions = dimensions,
+            metrics = {
+                'ResultsPollAttempts': (retry_count + 1, 'Count'),
+                'ResultsReportMissing': (0 if found else 1, 'Count'),
+            }
+        )
     try:
         assert r.status_code == 200
     except AssertionError:
         return False
     else:
         response_content = json.loads(r.content)
-        print(f'response_content:\n{response_content}')
+        logger.payload('response_content', response_content, Bytes=len(r.content))
         return response_content
 
 def lambda_handler(event,context):
@@ -19,13 +54,17 @@ def lambda_handler(event,context):
     class StatusCodeNot200Exception(Exception):
         pass
     
-    print(f'event:\n{event}\ncontext:\n{context}')
+    logger.start_invocation(context)
+    logger.payload('event', event)
+    tracer.start_invocation(event)
     
     url = event['Url']
     
-    response = requests_get(url)
+    response = requests_get(url,retry_count=event.get('RetryCount', 0))
     
     if not response:
         raise StatusCodeNot200Exception
+    if os.environ.get('CompactResults') == 'true':
+        return compact_verdict(s3=s3,bucket=os.environ['ResultsReportsBucket'],url=url,results_report=response)
     else:
         return response
\ No newline at end of file
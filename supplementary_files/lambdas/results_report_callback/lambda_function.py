@@ -0,0 +1,158 @@
+import json
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import boto3
+from botocore.exceptions import ClientError
+
+from evaluation_results import compact_verdict
+from structured_logging import Logger
+
+logger = Logger(name='results_report_callback')
+
+dynamodb = boto3.client('dynamodb')
+sfn = boto3.client('stepfunctions')
+s3 = boto3.client('s3')
+
+def presigned_url_to_bucket_key(*,url):
+    # virtual-hosted (bucket.s3[.region].amazonaws.com/key) or path-style (s3[.region].amazonaws.com/bucket/key)
+    parsed = urllib.parse.urlparse(url)
+    path = urllib.parse.unquote(parsed.path.lstrip('/'))
+    host = parsed.netloc
+    if host.startswith('s3.') or host.startswith('s3-'):
+        bucket, _, key = path.partition('/')
+        return bucket, key
+    return host.split('.s3')[0], path
+
+def result_key(*,bucket,key):
+    return f'{bucket}/{key}'
+
+def s3_object_created_event(*,bucket,key):
+    # the EventBridge notification S3 sends when the results report lands, usable as a local stand-in
+    return {
+        "source": "aws.s3",
+        "detail-type": "Object Created",
+        "detail": {
+            "bucket": {"name": bucket},
+            "object": {"key": key},
+        }
+    }
+
+def get_results_report(*,url):
+    try:
+        with urllib.request.urlopen(url, timeout=float(os.environ.get('HttpTimeoutSeconds', 10))) as r:
+            return json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        # without the presigned query string
+        logger.info('results report not readable', Url=url.split('?')[0], StatusCode=e.code)
+        return False
+    except (urllib.error.URLError, TimeoutError) as e:
+        # unreachable or timed out, the waiting task falls back to polling
+        logger.warning('results report not reachable', Url=url.split('?')[0], Error=str(e))
+        return False
+
+def send_task_success(*,task_token,results_report):
+    try:
+        sfn.send_task_success(
+            taskToken = task_token,
+            output = json.dumps(results_report)
+        )
+    except sfn.exceptions.TaskTimedOut:
+        # the execution already fell back to polling
+        logger.warning('TaskTimedOut', TaskToken=task_token[:32])
+
+def register(*,task_token,url):
+
+    bucket, key = presigned_url_to_bucket_key(url=url)
+
+    try:
+        dynamodb.put_item(
+            TableName = os.environ['ResultCallbacksTable'],
+            Item = {
+                'ResultKey': {'S': result_key(bucket=bucket,key=key)},
+                'TaskToken': {'S': task_token},
+                'Url': {'S': url},
+                'ExpiresAt': {'N': str(int(time.time()) + int(os.environ['CallbackTimeoutSeconds']))},
+            }
+        )
+    except ClientError as e:
+        logger.error('register ClientError', Bucket=bucket, Key=key, Error=str(e))
+        raise
+
+    # the report may have landed before the token was registered, in which case no notification is coming
+    results_report = get_results_report(url=url)
+
+    if results_report:
+        complete(bucket=bucket,key=key,results_report=results_report)
+
+    return {
+        "Registered": result_key(bucket=bucket,key=key)
+    }
+
+def complete(*,bucket,key,results_report=None):
+
+    try:
+        r = dynamodb.delete_item(
+            TableName = os.environ['ResultCallbacksTable'],
+            Key = {
+                'ResultKey': {'S': result_key(bucket=bucket,key=key)},
+            },
+            ReturnValues = 'ALL_OLD'
+        )
+    except ClientError as e:
+        logger.error('complete ClientError', Bucket=bucket, Key=key, Error=str(e))
+        raise
+
+    # deleting first means a racing register and notification resume the task once
+    item = r.get('Attributes')
+
+    if not item:
+        logger.info('no task waiting on', Bucket=bucket, Key=key)
+        return {
+            "Completed": False
+        }
+
+    results_report = results_report or get_results_report(url=item['Url']['S'])
+
+    if not results_report:
+        # fails the wait task, whose Catch falls back to polling
+        sfn.send_task_failure(
+            taskToken = item['TaskToken']['S'],
+            error = 'ResultsReportUnreadable'
+        )
+        return {
+            "Completed": False
+        }
+
+    if os.environ.get('CompactResults') == 'true':
+        results_report = compact_verdict(s3=s3,bucket=os.environ['ResultsReportsBucket'],url=item['Url']['S'],results_report=results_report)
+
+    send_task_success(
+        task_token = item['TaskToken']['S'],
+        results_report = results_report
+    )
+
+    return {
+        "Completed": True
+    }
+
+def lambda_handler(event,context):
+
+    logger.start_invocation(context)
+    logger.payload('event', event)
+
+    # from the GetIsCompliant .waitForTaskToken task
+    if 'TaskToken' in event:
+        return register(
+            task_token = event['TaskToken'],
+            url = event['Url']
+        )
+
+    # S3 Object Created notification via EventBridge, or a Control Broker callback of the same shape
+    return complete(
+        bucket = event['detail']['bucket']['name'],
+        key = event['detail']['object']['key']
+    )
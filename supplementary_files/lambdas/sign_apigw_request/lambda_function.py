@@ -1,95 +1,56 @@
-import json
-import re
-import os
+import time
 
-import boto3
-from botocore.exceptions import ClientError
+import_started = time.perf_counter()
 
-import requests
-from aws_requests_auth.boto_utils import BotoAWSRequestsAuth
+from control_broker_client import ControlBrokerClient
+from structured_logging import Logger
+from tracing import Tracer
 
-s3 = boto3.client('s3')
+logger = Logger(name='sign_apigw_request')
+tracer = Tracer(name='sign_apigw_request')
 
-session = boto3.session.Session()
-region = session.region_name
-account_id = boto3.client('sts').get_caller_identity().get('Account')
+# reads, signs, POSTs and polls, shared with StreamEvaluate and the evaluation service workers
+client = ControlBrokerClient(logger=logger,tracer=tracer)
 
-def get_host(*,full_invoke_url):
-    m = re.search('https://(.*)/.*',full_invoke_url)
-    return m.group(1)
+def handle(event,remaining_millis=None):
 
-def get_object(*,bucket,key):
-    
-    try:
-        r = s3.get_object(
-            Bucket = bucket,
-            Key = key
+    logger.debug('full_invoke_url', Url=client.invoke_url)
+
+    # a whole execution's inputs in one invocation, in place of the Map
+    if 'Inputs' in event:
+        return client.evaluate_batch(
+            codebuild_inputs = event['Inputs'],
+            remaining_millis = remaining_millis,
         )
-    except ClientError as e:
-        print(f'ClientError:\nbucket:\n{bucket}\nkey:\n{key}\n{e}')
-        raise
-    else:
-        print(f'no ClientError get_object:\nbucket:\n{bucket}\nkey:\n{key}')
-        body = r['Body']
-        content = json.loads(body.read().decode('utf-8'))
-        return content
 
-    
-def lambda_handler(event,context):
-    
-    print(f'event:\n{event}\ncontext:\n{context}')
-    
-    full_invoke_url = os.environ.get('ApigwInvokeUrl')
-    
-    print(f'full_invoke_url:\n{full_invoke_url}')
-    
-    host = get_host(full_invoke_url=full_invoke_url)
-    
-    auth = BotoAWSRequestsAuth(
-        aws_host= host,
-        aws_region=region,
-        aws_service='execute-api'
-    )
-    
-    print(f'BotoAWSRequestsAuth:\n{auth}')
-    
-    input_to_be_evaluated_object = get_object(
+    input_to_be_evaluated_object = client.get_object(
         bucket = event['Input']['Bucket'],
         key = event['Input']['Key'],
+        content_encoding = event['Input'].get('ContentEncoding'),
+        sha256 = event['Input'].get('Sha256'),
     )
-    
-    cb_input_object = {
-        "Context":{
-            "EnvironmentEvaluation":"Prod",
-            "PipelineOwnershipMetadata" : json.loads(os.environ['PipelineOwnershipMetadata']),
-        },
-        "Input": input_to_be_evaluated_object
-    }
-    
-    r = requests.post(
-        full_invoke_url,
-        auth = auth,
-        json = cb_input_object
+
+    return client.post_to_control_broker(
+        input_to_be_evaluated_object = input_to_be_evaluated_object,
+        remaining_millis = remaining_millis,
     )
-    
-    print(f'headers:\n{dict(r.request.headers)}')
-    
-    content = json.loads(r.content)
-    
-    status_code = r.status_code
-    
-    apigw_response = {
-        'StatusCode':status_code,
-        'Content': content
-    }
-    
-    print(f'apigw_response:\n{apigw_response}')
-    
-    class APIGWNot200Exception(Exception):
-        # caught by invoking SFN
-        pass
-    
-    if status_code != 200:
-        raise APIGWNot200Exception
-    else:
-        return content
\ No newline at end of file
+
+import_seconds = time.perf_counter() - import_started
+cold_start = True
+
+def lambda_handler(event,context):
+
+    global cold_start
+
+    logger.start_invocation(context)
+    logger.payload('event', event)
+    tracer.start_invocation(event)
+
+    started = time.perf_counter()
+    try:
+        return handle(event,remaining_millis=context.get_remaining_time_in_millis)
+    finally:
+        # the first invocation of a container also builds the client, signer and connection pool
+        if cold_start:
+            logger.info('cold start', ImportSeconds=round(import_seconds, 3), FirstInvocationSeconds=round(time.perf_counter() - started, 3))
+            cold_start = False
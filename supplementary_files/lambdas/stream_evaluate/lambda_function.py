@@ -0,0 +1,107 @@
+import time
+
+import_started = time.perf_counter()
+
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+from control_broker_client import ControlBrokerClient, input_exceptions
+from evaluation_results import verdict_record
+from structured_logging import Logger
+from tracing import Tracer
+
+logger = Logger(name='stream_evaluate')
+tracer = Tracer(name='stream_evaluate')
+
+# reads, signs, POSTs and polls, shared with SignApigwRequest
+client = ControlBrokerClient(logger=logger,tracer=tracer)
+
+# DynamoDB items are capped at 400 KB, larger streamed records keep only the verdict
+streamed_record_max_bytes = 350 * 1024
+
+def streamed_record(result):
+    record = json.dumps(result)
+    if len(record) <= streamed_record_max_bytes:
+        return record
+    return json.dumps(verdict_record(result))
+
+def put_streamed_verdict(*,execution_id,codebuild_input,result):
+
+    try:
+        client.get_dynamodb().put_item(
+            TableName = os.environ['StreamedVerdictsTable'],
+            Item = {
+                'ExecutionId': {'S': execution_id},
+                'InputKey': {'S': codebuild_input['Key']},
+                'Record': {'S': streamed_record(result)},
+                'ExpiresAt': {'N': str(int(time.time()) + int(os.environ.get('StreamedVerdictsTtlSeconds', 86400)))},
+            }
+        )
+    except ClientError as e:
+        logger.error('put_streamed_verdict ClientError', ExecutionId=execution_id, Key=codebuild_input['Key'], Error=str(e))
+        raise
+
+def evaluate_streamed_record(*,message,receive_count=1,remaining_millis=None):
+
+    # one input, sent by the parse scripts as soon as it was uploaded
+    codebuild_input = message['CodeBuildInput']
+
+    try:
+        result = client.evaluate_codebuild_input(
+            codebuild_input = codebuild_input,
+            remaining_millis = remaining_millis,
+        )
+    except input_exceptions as e:
+        # retries already used up or not worth one, recorded so the collector fails rather than waits
+        result = {
+            "CodeBuildInput": codebuild_input,
+            "Error": type(e).__name__,
+        }
+    except Exception as e:
+        # redelivered, except on the last receive before the dead-letter queue, which is recorded too;
+        # MaxReceiveCount is the queue's redrive setting, set by the stack that owns the queue
+        if receive_count >= int(os.environ['MaxReceiveCount']):
+            put_streamed_verdict(
+                execution_id = message['ExecutionId'],
+                codebuild_input = codebuild_input,
+                result = {
+                    "CodeBuildInput": codebuild_input,
+                    "Error": type(e).__name__,
+                },
+            )
+        raise
+
+    put_streamed_verdict(
+        execution_id = message['ExecutionId'],
+        codebuild_input = codebuild_input,
+        result = result,
+    )
+
+import_seconds = time.perf_counter() - import_started
+cold_start = True
+
+def lambda_handler(event,context):
+
+    global cold_start
+
+    logger.start_invocation(context)
+    logger.payload('event', event)
+    tracer.start_invocation(event)
+
+    started = time.perf_counter()
+    try:
+        return client.evaluate_records(
+            records = event['Records'],
+            evaluate_message = lambda *, message, receive_count: evaluate_streamed_record(
+                message = message,
+                receive_count = receive_count,
+                remaining_millis = context.get_remaining_time_in_millis,
+            ),
+        )
+    finally:
+        # the first invocation of a container also builds the client, signer and connection pool
+        if cold_start:
+            logger.info('cold start', ImportSeconds=round(import_seconds, 3), FirstInvocationSeconds=round(time.perf_counter() - started, 3))
+            cold_start = False
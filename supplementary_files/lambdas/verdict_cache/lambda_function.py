@@ -0,0 +1,99 @@
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+from evaluation_metrics import emit_metrics, metric_dimensions
+from structured_logging import Logger
+
+logger = Logger(name='verdict_cache')
+
+dynamodb = boto3.client('dynamodb')
+
+def get_verdict(*,input_hash):
+
+    try:
+        r = dynamodb.get_item(
+            TableName = os.environ['VerdictCacheTable'],
+            Key = {
+                'InputHash': {'S': input_hash},
+                'PolicyFingerprint': {'S': os.environ['PolicyFingerprint']},
+            }
+        )
+    except ClientError as e:
+        logger.error('verdict cache ClientError', InputHash=input_hash, Error=str(e))
+        raise
+    else:
+        item = r.get('Item')
+        # TTL deletion lags expiry, so expired items can still be returned
+        if not item or int(item['ExpiresAt']['N']) <= int(time.time()):
+            return None
+        return item['IsCompliant']['BOOL']
+
+def put_verdict(*,input_hash,is_compliant):
+
+    try:
+        dynamodb.put_item(
+            TableName = os.environ['VerdictCacheTable'],
+            Item = {
+                'InputHash': {'S': input_hash},
+                'PolicyFingerprint': {'S': os.environ['PolicyFingerprint']},
+                'IsCompliant': {'BOOL': is_compliant},
+                'ExpiresAt': {'N': str(int(time.time()) + int(os.environ['VerdictCacheTtlSeconds']))},
+            }
+        )
+    except ClientError as e:
+        logger.error('verdict cache ClientError', InputHash=input_hash, Error=str(e))
+        raise
+
+def lambda_handler(event,context):
+
+    logger.start_invocation(context)
+    logger.payload('event', event)
+
+    # an input without a hash is always evaluated
+    input_hash = event['CodeBuildInput'].get('Sha256')
+
+    if event['Action'] == 'Get':
+
+        is_compliant = get_verdict(input_hash=input_hash) if input_hash else None
+
+        if is_compliant is None:
+            emit_metrics(
+                dimensions = metric_dimensions(pipeline=os.environ.get('Pipeline'),source_iac=os.environ.get('SourceIac'),PolicyFingerprint=os.environ['PolicyFingerprint']),
+                metrics = {'VerdictCacheMiss': (1, 'Count')}
+            )
+            return {
+                "Hit": False
+            }
+
+        emit_metrics(
+            dimensions = metric_dimensions(pipeline=os.environ.get('Pipeline'),source_iac=os.environ.get('SourceIac'),PolicyFingerprint=os.environ['PolicyFingerprint']),
+            metrics = {'VerdictCacheHit': (1, 'Count')}
+        )
+        return {
+            "Hit": True,
+            # same shape as the GetIsCompliant payload, a cached verdict has no report of its own
+            "Verdict": {
+                "EvalEngineLambdalith": {
+                    "Evaluation": {
+                        "IsCompliant": is_compliant
+                    }
+                },
+                "ResultUrl": None,
+                "ReportS3Uri": None,
+            }
+        }
+
+    if event['Action'] == 'Put':
+
+        if not input_hash:
+            return {
+                "Stored": False
+            }
+
+        put_verdict(input_hash=input_hash,is_compliant=event['IsCompliant'])
+        return {
+            "Stored": True
+        }
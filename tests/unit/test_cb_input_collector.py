@@ -0,0 +1,194 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, "./supplementary_files/codebuild_utils")
+
+from cb_input_collector import Collector, CollectorConfig
+from cb_input_collector.collector import last_green_manifest_key
+
+
+class FakeStore:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = []
+
+    def upload_file(self, *, bucket, key, file_path):
+        with open(file_path, "rb") as f:
+            self.objects[(bucket, key)] = f.read()
+        self.uploads.append((bucket, key))
+        return True
+
+    def object_exists(self, *, bucket, key):
+        return (bucket, key) in self.objects
+
+    def get_json(self, *, bucket, key):
+        body = self.objects.get((bucket, key))
+        return None if body is None else json.loads(body)
+
+    def shutdown(self):
+        pass
+
+
+class FakeQueue:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, *, execution_id, item):
+        self.sent.append((execution_id, item["Key"]))
+
+
+def write_json(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(content, f)
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    cdk_out = tmp_path / "cdk.out"
+    write_json(str(cdk_out / "manifest.json"), {"artifacts": {
+        "B": {"type": "aws:cloudformation:stack", "properties": {"templateFile": "B.template.json"}},
+        "A": {"type": "aws:cloudformation:stack", "properties": {"templateFile": "A.template.json"}},
+        "Stage": {"type": "cdk:cloud-assembly", "properties": {"directoryName": "assembly-Stage"}},
+    }})
+    write_json(str(cdk_out / "A.template.json"), {"Resources": {"Queue": {"Type": "AWS::SQS::Queue"}}})
+    write_json(str(cdk_out / "B.template.json"), {"Resources": {"Topic": {"Type": "AWS::SNS::Topic"}}})
+    write_json(str(cdk_out / "assembly-Stage" / "manifest.json"), {"artifacts": {
+        "A": {"type": "aws:cloudformation:stack", "properties": {"templateFile": "A.template.json"}},
+    }})
+    write_json(str(cdk_out / "assembly-Stage" / "A.template.json"), {"Resources": {"Queue": {"Type": "AWS::SQS::Queue"}}})
+    # bundled dependencies are not templates
+    write_json(str(cdk_out / "asset.abc" / "package.template.json"), {})
+    write_json(str(tmp_path / "sam_packaged_template.json"), {"Resources": {}})
+    return str(tmp_path)
+
+
+def collector(source_dir, store=None, queue=None, **kwargs):
+    config = CollectorConfig(
+        source_dir=source_dir,
+        buckets={"CDK": "synthed", "SAM": "sam"},
+        upload_max_workers=2,
+        **kwargs,
+    )
+    return Collector(config=config, execution_id="exec-1", store=store or FakeStore(), queue=queue)
+
+
+def test_cdk_templates_follow_the_assembly_manifests(source_dir):
+    c = collector(source_dir)
+    inputs = c.collect(["CDK"])
+    assert [i["Key"] for i in inputs] == [
+        "exec-1/A.template.json",
+        "exec-1/B.template.json",
+        "exec-1/assembly-Stage/A.template.json",
+    ]
+    assert sorted(c.store.uploads) == sorted(("synthed", i["Key"]) for i in inputs)
+
+
+def test_every_input_records_its_digest(source_dir):
+    c = collector(source_dir)
+    item = c.collect(["SAM"])[0]
+    assert item["Name"] == "sam_packaged_template.json"
+    assert item["Sha256"] == hashlib.sha256(c.store.objects[("sam", item["Key"])]).hexdigest()
+
+
+def test_several_iac_types_share_one_run(source_dir):
+    queue = FakeQueue()
+    c = collector(source_dir, queue=queue)
+    inputs = c.collect(["CDK", "SAM"])
+    assert [i["Bucket"] for i in inputs] == ["synthed"] * 3 + ["sam"]
+    assert inputs[-1]["Key"] == "exec-1/sam_packaged_template.json"
+    assert len(queue.sent) == 4
+
+
+def test_identical_content_addressed_templates_upload_once(source_dir):
+    c = collector(source_dir, content_addressed_uploads=True)
+    inputs = c.collect(["CDK"])
+    assert inputs[0]["Key"] == inputs[2]["Key"]
+    assert inputs[0]["Name"] != inputs[2]["Name"]
+    assert len(c.store.uploads) == 2
+
+
+def test_gzip_inputs_keep_the_uncompressed_digest(source_dir):
+    c = collector(source_dir, content_addressed_uploads=True, cb_inputs_encoding="gzip")
+    item = c.collect(["SAM"])[0]
+    assert item["ContentEncoding"] == "gzip"
+    assert item["Key"] == f"sha256/{item['Sha256']}.gz"
+    assert json.loads(gzip.decompress(c.store.objects[("sam", item["Key"])])) == {"Resources": {}}
+
+
+def test_unchanged_inputs_are_carried_forward(source_dir):
+    store = FakeStore()
+    first = collector(source_dir, store=store, incremental_evaluation=True, policy_fingerprint="p1")
+    inputs = first.collect(["CDK"])
+    manifest = first.codebuild_to_sfn_artifact(inputs)["CodeBuildToSfnArtifact"]
+    store.objects[("synthed", last_green_manifest_key)] = json.dumps(manifest).encode()
+
+    write_json(os.path.join(source_dir, "cdk.out", "B.template.json"), {"Resources": {}})
+    store.uploads.clear()
+    second = collector(source_dir, store=store, incremental_evaluation=True, policy_fingerprint="p1")
+    inputs = second.collect(["CDK"])
+    assert [i.get("CarriedForward", False) for i in inputs] == [True, False, True]
+    assert store.uploads == [("synthed", "exec-1/B.template.json")]
+
+    store.uploads.clear()
+    third = collector(source_dir, store=store, incremental_evaluation=True, policy_fingerprint="p2")
+    assert not any(i.get("CarriedForward") for i in third.collect(["CDK"]))
+    assert len(store.uploads) == 3
+
+
+def test_config_from_environ(source_dir):
+    config = CollectorConfig.from_environ({
+        "CODEBUILD_SRC_DIR": source_dir,
+        "TFPlanBucket": "tfplan",
+        "PipelineOwnershipMetadata": json.dumps({"Team": "a"}),
+        "UploadMaxWorkers": "4",
+        "UploadPartSizeMB": "16",
+        "ContentAddressedUploads": "true",
+        "TFPlanShardBy": "module",
+    })
+    assert config.buckets == {"Terraform": "tfplan"}
+    assert config.pipeline_ownership_metadata == {"Team": "a"}
+    assert config.upload_max_workers == 4
+    assert config.upload_part_size_mb == 16
+    assert config.upload_max_concurrency == 10
+    assert config.content_addressed_uploads
+    assert config.tfplan_shard_by == "module"
+    assert not config.incremental_evaluation
+
+
+def test_module_shards_keep_few_files_open(tmp_path, monkeypatch):
+    from cb_input_collector import tfplan
+
+    monkeypatch.setattr(tfplan, "max_open_shards", 2)
+    resource_changes = [
+        {"address": f"module.m{i % 5}.aws_sqs_queue.q{i}", "module_address": f"module.m{i % 5}", "change": {"actions": ["create"]}}
+        for i in range(20)
+    ]
+    write_json(str(tmp_path / "tfplan.json"), {
+        "format_version": "1.1",
+        "variables": {"env": {"value": "prod"}},
+        "configuration": {"root_module": {}},
+        "resource_changes": resource_changes,
+    })
+
+    shards = tfplan.shard_tfplan(
+        tfplan_path=str(tmp_path / "tfplan.json"),
+        shard_dir=str(tmp_path / "shards"),
+        shard_by="module",
+        shard_size=500,
+        slim=False,
+    )
+
+    assert [shard_id for shard_id, path in shards] == [f"module.m{i}" for i in range(5)]
+    for shard_id, path in shards:
+        with open(path) as f:
+            shard = json.load(f)
+        assert shard["format_version"] == "1.1"
+        assert shard["variables"] == {"env": {"value": "prod"}}
+        assert "configuration" not in shard
+        assert [r["module_address"] for r in shard["resource_changes"]] == [shard_id] * 4
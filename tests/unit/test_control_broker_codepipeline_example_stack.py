@@ -1,15 +1,67 @@
+import json
+
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
+
+from stacks.iac_pipeline_stack import ControlBrokerCodepipelineExampleStack
 
-from control_broker_codepipeline_example.control_broker_codepipeline_example_stack import ControlBrokerCodepipelineExampleStack
 
-# example tests. To run these tests, uncomment this file along with the example
-# resource in control_broker_codepipeline_example/control_broker_codepipeline_example_stack.py
-def test_sqs_queue_created():
-    app = core.App()
-    stack = ControlBrokerCodepipelineExampleStack(app, "control-broker-codepipeline-example")
+def test_evaluation_state_machine_created():
+    # skip bundling, PythonFunction would otherwise build its assets in Docker
+    app = core.App(context={"aws:cdk:bundling-stacks": []})
+    stack = ControlBrokerCodepipelineExampleStack(
+        app,
+        "control-broker-codepipeline-example",
+        pipeline_ownership_metadata={"Team": "a"},
+        control_broker_apigw_url="https://abc.execute-api.us-east-1.amazonaws.com/SAM",
+        source_iac="SAM",
+        sam_cli_sha256="0" * 64,
+    )
     template = assertions.Template.from_stack(stack)
 
-#     template.has_resource_properties("AWS::SQS::Queue", {
-#         "VisibilityTimeout": 300
-#     })
+    template.resource_count_is("AWS::StepFunctions::StateMachine", 1)
+    state_machine = next(iter(template.find_resources("AWS::StepFunctions::StateMachine").values()))
+    definition = state_machine["Properties"]["DefinitionString"]
+    parts = definition["Fn::Join"][1] if isinstance(definition, dict) else [definition]
+    assert '"StartAt": "ForEachCodeBuildInput"' in "".join(p for p in parts if isinstance(p, str))
+
+
+def test_results_callback_needs_results_bucket():
+    app = core.App(context={"aws:cdk:bundling-stacks": []})
+    with pytest.raises(ValueError, match="results_bucket"):
+        ControlBrokerCodepipelineExampleStack(
+            app,
+            "control-broker-codepipeline-example",
+            pipeline_ownership_metadata={"Team": "a"},
+            control_broker_apigw_url="https://abc.execute-api.us-east-1.amazonaws.com/SAM",
+            source_iac="SAM",
+            sam_cli_sha256="0" * 64,
+            results_callback=True,
+        )
+
+
+def test_sam_cli_checksum_is_checked():
+    app = core.App(context={"aws:cdk:bundling-stacks": []})
+    with pytest.raises(ValueError, match="sam_cli_sha256"):
+        ControlBrokerCodepipelineExampleStack(
+            app,
+            "control-broker-codepipeline-example",
+            pipeline_ownership_metadata={"Team": "a"},
+            control_broker_apigw_url="https://abc.execute-api.us-east-1.amazonaws.com/SAM",
+            source_iac="SAM",
+            sam_cli_sha256="not-a-digest",
+        )
+
+
+def test_sam_cli_without_checksum_synthesizes_with_a_warning():
+    app = core.App(context={"aws:cdk:bundling-stacks": []})
+    stack = ControlBrokerCodepipelineExampleStack(
+        app,
+        "control-broker-codepipeline-example",
+        pipeline_ownership_metadata={"Team": "a"},
+        control_broker_apigw_url="https://abc.execute-api.us-east-1.amazonaws.com/SAM",
+        source_iac="SAM",
+        sam_cli_sha256="",
+    )
+    assertions.Annotations.from_stack(stack).has_warning("*", assertions.Match.string_like_regexp("sam_cli_sha256 is not set"))
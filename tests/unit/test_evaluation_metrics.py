@@ -0,0 +1,67 @@
+import contextlib
+import json
+import os
+from collections import defaultdict
+
+import pytest
+
+from benchmarks.workflow import LocalWorkflow, synthesize
+
+
+@pytest.fixture(scope="module")
+def templates():
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        return synthesize(source_iac="Terraform")
+
+
+def emitted_metrics(output):
+    # every embedded metric format line, by metric name
+    metrics = defaultdict(list)
+    for line in output.splitlines():
+        if not line.startswith('{"_aws"'):
+            continue
+        record = json.loads(line)
+        for directive in record["_aws"]["CloudWatchMetrics"]:
+            assert directive["Namespace"] == "ControlBrokerConsumer"
+            for dimension_set in directive["Dimensions"]:
+                assert all(name in record for name in dimension_set)
+            for metric in directive["Metrics"]:
+                metrics[metric["Name"]].append(record)
+    return metrics
+
+
+def test_each_stage_is_metered_by_pipeline_and_iac(templates, capsys):
+    workflow = LocalWorkflow(templates, wait_scale=0.001, evaluation_delay=0.01, non_compliant_rate=0.0)
+    codebuild_inputs = workflow.put_inputs(execution_id="exec-1", count=3)
+    report = workflow.run(execution_id="exec-1", codebuild_inputs=codebuild_inputs, show_logs=True)
+    assert report["status"] == "SUCCEEDED"
+
+    metrics = emitted_metrics(capsys.readouterr().out)
+    for name in ["S3ReadSeconds", "S3ReadBytes", "SigV4SigningSeconds", "ControlBrokerPostAttempts"]:
+        assert len(metrics[name]) == 3
+    assert {r["StatusCode"] for r in metrics["ControlBrokerPostSeconds"]} == {"200"}
+    assert "200" in {r["StatusCode"] for r in metrics["ResultsReportGetSeconds"]}
+    assert [r["ResultsReportMissing"] for r in metrics["ResultsPollAttempts"]] == [0, 0, 0]
+    assert sum(r["ResultsPollAttempts"] for r in metrics["ResultsPollAttempts"]) == len(metrics["ResultsReportGetSeconds"])
+
+    (summary,) = metrics["Inputs"]
+    assert summary["Inputs"] == 3
+    assert summary["CompliantInputs"] == 3
+    assert summary["SourceIac"] == "Terraform"
+    assert summary["Pipeline"] != "Unknown"
+
+
+def test_verdict_cache_is_metered_by_pipeline_and_iac(capsys):
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        templates = synthesize(source_iac="Terraform", verdict_cache=True)
+    workflow = LocalWorkflow(templates, wait_scale=0.001, evaluation_delay=0.01, non_compliant_rate=0.0)
+    codebuild_inputs = workflow.put_inputs(execution_id="exec-1", count=2)
+    report = workflow.run(execution_id="exec-1", codebuild_inputs=codebuild_inputs, show_logs=True)
+    assert report["status"] == "SUCCEEDED"
+
+    metrics = emitted_metrics(capsys.readouterr().out)
+    assert len(metrics["VerdictCacheMiss"]) == 2
+    for record in metrics["VerdictCacheMiss"]:
+        assert record["SourceIac"] == "Terraform"
+        assert record["Pipeline"] != "Unknown"
+        assert "PolicyFingerprint" in record
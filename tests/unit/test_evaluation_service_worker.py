@@ -0,0 +1,104 @@
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, "./supplementary_files/lambda_layers/evaluation_results/python")
+sys.path.insert(0, "./supplementary_files/lambda_layers/structured_logging/python")
+sys.path.insert(0, "./supplementary_files/lambda_layers/tracing/python")
+
+import control_broker_client
+
+
+def load_lambda(name):
+    spec = importlib.util.spec_from_file_location(
+        name, f"./supplementary_files/lambdas/{name}/lambda_function.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeSQS:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, **parameters):
+        self.sent.append(parameters)
+
+
+class FakeStepFunctions:
+    class exceptions:
+        class TaskTimedOut(Exception):
+            pass
+
+        class InvalidToken(Exception):
+            pass
+
+    def __init__(self):
+        self.succeeded = {}
+        self.failed = {}
+
+    def send_task_success(self, taskToken, output):
+        self.succeeded[taskToken] = json.loads(output)
+
+    def send_task_failure(self, taskToken, error, cause):
+        self.failed[taskToken] = error
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    monkeypatch.setenv("BatchChunkSize", "2")
+    monkeypatch.setenv("MaxReceiveCount", "2")
+    monkeypatch.setenv("EvaluationQueueUrl", "https://sqs.local/evaluation-service.fifo")
+    module = load_lambda("evaluation_service_worker")
+    module.client.clients.update({"sqs": FakeSQS(), "stepfunctions": FakeStepFunctions()})
+
+    def evaluate_codebuild_input(*, codebuild_input, context=None, dimensions=None, remaining_millis=None):
+        return {"Key": codebuild_input["Key"], "IsCompliant": True}
+
+    monkeypatch.setattr(module.client, "evaluate_codebuild_input", evaluate_codebuild_input)
+    return module
+
+
+def fail_with(module, monkeypatch, exception):
+    def evaluate_codebuild_input(*, codebuild_input, context=None, dimensions=None, remaining_millis=None):
+        raise exception
+
+    monkeypatch.setattr(module.client, "evaluate_codebuild_input", evaluate_codebuild_input)
+
+
+codebuild_inputs = [{"Bucket": "cb-inputs", "Key": f"exec-1/Stack{i}.template.json"} for i in range(5)]
+
+
+def test_service_request_continues_in_a_new_message_before_the_deadline(worker):
+    message = {"TaskToken": "token-1", "Pipeline": "pipeline-a", "Inputs": codebuild_inputs}
+
+    remaining = iter([60000, 5000])
+    worker.evaluate_service_request(message=message, remaining_millis=lambda: next(remaining))
+    (continuation,) = worker.client.clients["sqs"].sent
+    assert continuation["MessageGroupId"] == "pipeline-a"
+    body = json.loads(continuation["MessageBody"])
+    assert len(body["Results"]) == 2
+    assert body["Inputs"] == codebuild_inputs[2:]
+    assert worker.client.clients["stepfunctions"].succeeded == {}
+
+    worker.evaluate_service_request(message=body)
+    results = worker.client.clients["stepfunctions"].succeeded["token-1"]
+    assert [r["Key"] for r in results] == [i["Key"] for i in codebuild_inputs]
+
+
+def test_service_request_fails_the_task_on_the_last_receive(worker, monkeypatch):
+    fail_with(worker, monkeypatch, TimeoutError("read timed out"))
+    message = {"TaskToken": "token-2", "Inputs": codebuild_inputs}
+
+    with pytest.raises(TimeoutError):
+        worker.evaluate_service_request(message=message, receive_count=1)
+    assert worker.client.clients["stepfunctions"].failed == {}
+
+    with pytest.raises(TimeoutError):
+        worker.evaluate_service_request(message=message, receive_count=2)
+    assert worker.client.clients["stepfunctions"].failed == {"token-2": "TimeoutError"}
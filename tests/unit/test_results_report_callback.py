@@ -0,0 +1,107 @@
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, "./supplementary_files/lambda_layers/evaluation_results/python")
+sys.path.insert(0, "./supplementary_files/lambda_layers/structured_logging/python")
+
+
+def load_lambda(name):
+    spec = importlib.util.spec_from_file_location(
+        name, f"./supplementary_files/lambdas/{name}/lambda_function.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, TableName, Item):
+        self.items[Item["ResultKey"]["S"]] = Item
+
+    def delete_item(self, TableName, Key, ReturnValues):
+        item = self.items.pop(Key["ResultKey"]["S"], None)
+        return {"Attributes": item} if item else {}
+
+
+class FakeStepFunctions:
+    class exceptions:
+        class TaskTimedOut(Exception):
+            pass
+
+    def __init__(self):
+        self.succeeded = {}
+        self.failed = {}
+
+    def send_task_success(self, taskToken, output):
+        self.succeeded[taskToken] = json.loads(output)
+
+    def send_task_failure(self, taskToken, error):
+        self.failed[taskToken] = error
+
+
+@pytest.fixture
+def callback(monkeypatch):
+    monkeypatch.setenv("ResultCallbacksTable", "ResultCallbacks")
+    monkeypatch.setenv("CallbackTimeoutSeconds", "300")
+    module = load_lambda("results_report_callback")
+    module.dynamodb = FakeDynamoDB()
+    module.sfn = FakeStepFunctions()
+    module.reports = {}
+    monkeypatch.setattr(module, "get_results_report", lambda *, url: module.reports.get(url, False))
+    return module
+
+
+url = "https://cb-results.s3.amazonaws.com/evaluations/abc/opa.json?X-Amz-Signature=x"
+report = {"EvalEngineLambdalith": {"Evaluation": {"IsCompliant": True}}}
+
+
+def test_presigned_url_to_bucket_key(callback):
+    assert callback.presigned_url_to_bucket_key(url=url) == ("cb-results", "evaluations/abc/opa.json")
+    assert callback.presigned_url_to_bucket_key(
+        url="https://s3.us-east-1.amazonaws.com/cb-results/evaluations/abc/opa.json?X-Amz-Signature=x"
+    ) == ("cb-results", "evaluations/abc/opa.json")
+
+
+def test_notification_resumes_waiting_task(callback):
+    callback.lambda_handler({"TaskToken": "token-1", "Url": url}, None)
+    assert callback.sfn.succeeded == {}
+
+    callback.reports[url] = report
+    event = callback.s3_object_created_event(bucket="cb-results", key="evaluations/abc/opa.json")
+    assert callback.lambda_handler(event, None) == {"Completed": True}
+    assert callback.sfn.succeeded == {"token-1": report}
+
+    # a duplicate notification finds no waiting task
+    assert callback.lambda_handler(event, None) == {"Completed": False}
+
+
+def test_report_already_present_completes_on_register(callback):
+    callback.reports[url] = report
+    callback.lambda_handler({"TaskToken": "token-2", "Url": url}, None)
+    assert callback.sfn.succeeded == {"token-2": report}
+    assert callback.dynamodb.items == {}
+
+
+def test_unreadable_report_fails_task_for_polling_fallback(callback):
+    callback.lambda_handler({"TaskToken": "token-3", "Url": url}, None)
+    event = callback.s3_object_created_event(bucket="cb-results", key="evaluations/abc/opa.json")
+    callback.lambda_handler(event, None)
+    assert callback.sfn.failed == {"token-3": "ResultsReportUnreadable"}
+
+
+def test_unreachable_report_is_not_readable(monkeypatch):
+    module = load_lambda("results_report_callback")
+
+    def urlopen(url, timeout):
+        raise module.urllib.error.URLError("timed out")
+
+    monkeypatch.setattr(module.urllib.request, "urlopen", urlopen)
+    assert module.get_results_report(url=url) is False
@@ -0,0 +1,147 @@
+import contextlib
+import json
+import os
+import threading
+
+import pytest
+
+from benchmarks.sfn_interpreter import Interpreter
+from benchmarks.workflow import LocalWorkflow, synthesize
+
+
+class Flaky:
+    def __init__(self, failures, error=RuntimeError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self, parameters):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("not yet")
+        return {"Value": parameters["Value"] * 2}
+
+
+def task(**state):
+    return dict({"Type": "Task", "Resource": "arn:local:flaky", "End": True}, **state)
+
+
+def run(definition, resources, execution_input=None):
+    interpreter = Interpreter(definition, resources=resources, wait_scale=0)
+    return interpreter, interpreter.start_execution(execution_input or {"Value": 2})
+
+
+def test_retry_until_max_attempts():
+    flaky = Flaky(failures=2)
+    retry = [{"ErrorEquals": ["RuntimeError"], "MaxAttempts": 2}]
+    interpreter, outcome = run({"StartAt": "T", "States": {"T": task(Retry=retry)}}, {"arn:local:flaky": flaky})
+    assert outcome["status"] == "SUCCEEDED"
+    assert outcome["output"] == {"Value": 4}
+    assert interpreter.retries["T"] == 2
+
+    flaky = Flaky(failures=3)
+    _, outcome = run({"StartAt": "T", "States": {"T": task(Retry=retry)}}, {"arn:local:flaky": flaky})
+    assert outcome["status"] == "FAILED"
+    assert outcome["error"] == "RuntimeError"
+    assert flaky.calls == 3
+
+
+def test_catch_records_the_error_at_its_result_path():
+    definition = {
+        "StartAt": "T",
+        "States": {
+            "T": task(
+                ResultPath="$.Result",
+                Catch=[{"ErrorEquals": ["States.TaskFailed"], "ResultPath": "$.Error", "Next": "Caught"}],
+            ),
+            "Caught": {"Type": "Pass", "End": True},
+        },
+    }
+    interpreter, outcome = run(definition, {"arn:local:flaky": Flaky(failures=1, error=ValueError)})
+    assert outcome["output"]["Value"] == 2
+    assert outcome["output"]["Error"]["Error"] == "ValueError"
+    assert interpreter.state_entries == {"T": 1, "Caught": 1}
+
+
+def test_map_choice_and_fail():
+    definition = {
+        "StartAt": "Each",
+        "States": {
+            "Each": {
+                "Type": "Map",
+                "ItemsPath": "$.Items",
+                "MaxConcurrency": 2,
+                "Parameters": {"Value.$": "$$.Map.Item.Value", "Limit.$": "$.Limit"},
+                "Iterator": {
+                    "StartAt": "Double",
+                    "States": {
+                        "Double": task(End=False, Next="Check", ResultPath="$.Doubled"),
+                        "Check": {
+                            "Type": "Choice",
+                            "Default": "Ok",
+                            "Choices": [{"Variable": "$.Doubled.Value", "NumericGreaterThan": 6, "Next": "TooBig"}],
+                        },
+                        "Ok": {"Type": "Pass", "Parameters": {"Value.$": "$.Doubled.Value"}, "End": True},
+                        "TooBig": {"Type": "Fail", "Error": "TooBig", "CausePath": "States.JsonToString($.Doubled)"},
+                    },
+                },
+                "ResultPath": "$.Results",
+                "End": True,
+            }
+        },
+    }
+    _, outcome = run(definition, {"arn:local:flaky": Flaky(failures=0)}, {"Items": [1, 2, 3], "Limit": 6})
+    assert outcome["output"]["Results"] == [{"Value": 2}, {"Value": 4}, {"Value": 6}]
+
+    _, outcome = run(definition, {"arn:local:flaky": Flaky(failures=0)}, {"Items": [1, 4, 2], "Limit": 6})
+    assert outcome["status"] == "FAILED"
+    assert outcome["error"] == "TooBig"
+    assert json.loads(outcome["cause"]) == {"Value": 8}
+
+
+def test_wait_for_task_token():
+    definition = {
+        "StartAt": "Wait",
+        "States": {
+            "Wait": {
+                "Type": "Task",
+                "Resource": "arn:local:callback.waitForTaskToken",
+                "Parameters": {"Token.$": "$$.Task.Token"},
+                "TimeoutSeconds": 5,
+                "End": True,
+            }
+        },
+    }
+    interpreter = Interpreter(definition, resources={}, wait_scale=1)
+
+    def callback(parameters):
+        threading.Timer(0.01, interpreter.task_tokens.succeed, args=(parameters["Token"], {"Done": True})).start()
+
+    interpreter.resources["arn:local:callback"] = callback
+    assert interpreter.start_execution({})["output"] == {"Done": True}
+
+    interpreter.resources["arn:local:callback"] = lambda parameters: None
+    interpreter.wait_scale = 0.001
+    assert interpreter.start_execution({})["error"] == "States.Timeout"
+
+
+@pytest.fixture(scope="module")
+def templates():
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        return synthesize(source_iac="SAM")
+
+
+def test_workflow_runs_the_synthesized_definition(templates):
+    workflow = LocalWorkflow(templates, wait_scale=0.001, evaluation_delay=0.01, non_compliant_rate=0.0)
+    codebuild_inputs = workflow.put_inputs(execution_id="exec-1", count=5)
+    report = workflow.run(execution_id="exec-1", codebuild_inputs=codebuild_inputs)
+    assert report["status"] == "SUCCEEDED"
+    assert report["state_entries"]["SignApigwRequest"] == 5
+    assert report["api_calls"]["ControlBroker:Evaluate"] == 5
+    assert report["api_calls"]["s3:GetObject"] == 5
+
+    workflow = LocalWorkflow(templates, wait_scale=0.001, non_compliant_rate=1.0)
+    codebuild_inputs = workflow.put_inputs(execution_id="exec-2", count=2)
+    report = workflow.run(execution_id="exec-2", codebuild_inputs=codebuild_inputs)
+    assert report["status"] == "FAILED"
+    assert report["failed_state"] == "AllCodeBuildInputsCompliantFalse"
@@ -0,0 +1,100 @@
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, "./supplementary_files/lambda_layers/evaluation_results/python")
+sys.path.insert(0, "./supplementary_files/lambda_layers/structured_logging/python")
+sys.path.insert(0, "./supplementary_files/lambda_layers/tracing/python")
+
+import control_broker_client
+
+
+def load_lambda(name):
+    spec = importlib.util.spec_from_file_location(
+        name, f"./supplementary_files/lambdas/{name}/lambda_function.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def sign(monkeypatch):
+    monkeypatch.setenv("BatchChunkSize", "2")
+    monkeypatch.setenv("ApigwBackoffMaxSeconds", "20")
+    monkeypatch.setenv("PipelineOwnershipMetadata", "{}")
+    monkeypatch.setenv("ApigwInvokeUrl", "https://control-broker.local")
+    module = load_lambda("sign_apigw_request")
+    module.evaluated = []
+
+    def evaluate_codebuild_input(*, codebuild_input, context=None, dimensions=None, remaining_millis=None):
+        module.evaluated.append(codebuild_input["Key"])
+        return {"Key": codebuild_input["Key"], "IsCompliant": True}
+
+    monkeypatch.setattr(module.client, "evaluate_codebuild_input", evaluate_codebuild_input)
+    return module
+
+
+codebuild_inputs = [{"Bucket": "cb-inputs", "Key": f"exec-1/Stack{i}.template.json"} for i in range(5)]
+
+
+def test_batch_stops_between_chunks_before_the_deadline(sign):
+    remaining = iter([60000, 60000, 5000])
+    with pytest.raises(control_broker_client.DeadlineApproachingException, match="4 of 5"):
+        sign.handle({"Inputs": codebuild_inputs}, remaining_millis=lambda: next(remaining))
+    assert len(sign.evaluated) == 4
+
+
+def test_batch_without_deadline_evaluates_every_input(sign):
+    results = sign.handle({"Inputs": codebuild_inputs})
+    assert [r["Key"] for r in results] == [i["Key"] for i in codebuild_inputs]
+
+
+class ThrottledHttp:
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        self.requests = 0
+
+    def request(self, method, url, body=None, headers=None):
+        self.requests += 1
+        return type("Response", (), {"status": 429, "data": b"throttled", "headers": {"Retry-After": self.retry_after}})()
+
+
+class NoopSigner:
+    def add_auth(self, request):
+        pass
+
+
+def test_retry_after_is_capped_at_the_backoff_max(sign):
+    assert sign.client.backoff_seconds(attempt=0, retry_after="60") == 20
+
+
+def test_throttled_post_gives_up_before_the_lambda_timeout(sign, monkeypatch):
+    monkeypatch.setattr(control_broker_client.time, "sleep", lambda seconds: None)
+    sign.client.clients.update({"http": ThrottledHttp("60"), "signer": NoopSigner()})
+    with pytest.raises(control_broker_client.APIGWNot200Exception):
+        sign.client.post_to_control_broker(
+            input_to_be_evaluated_object={},
+            remaining_millis=lambda: 25000,
+        )
+    assert sign.client.clients["http"].requests == 1
+
+
+class OneObjectS3:
+    def __init__(self, body):
+        self.body = body
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.body), "ContentLength": len(self.body)}
+
+
+def test_checksum_mismatch_is_raised_before_the_input_is_parsed(sign):
+    sign.client.clients.update({"s3": OneObjectS3(b"not json")})
+    with pytest.raises(control_broker_client.ChecksumMismatchException):
+        sign.client.get_object(bucket="cb-inputs", key="exec-1/Stack0.template.json", sha256=hashlib.sha256(b"{}").hexdigest())
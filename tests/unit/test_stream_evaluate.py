@@ -0,0 +1,62 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, "./supplementary_files/lambda_layers/evaluation_results/python")
+sys.path.insert(0, "./supplementary_files/lambda_layers/structured_logging/python")
+sys.path.insert(0, "./supplementary_files/lambda_layers/tracing/python")
+
+import control_broker_client
+
+
+def load_lambda(name):
+    spec = importlib.util.spec_from_file_location(
+        name, f"./supplementary_files/lambdas/{name}/lambda_function.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    monkeypatch.setenv("MaxReceiveCount", "3")
+    module = load_lambda("stream_evaluate")
+    module.verdicts = {}
+    monkeypatch.setattr(
+        module,
+        "put_streamed_verdict",
+        lambda *, execution_id, codebuild_input, result: module.verdicts.__setitem__(codebuild_input["Key"], result),
+    )
+    return module
+
+
+def fail_with(module, monkeypatch, exception):
+    def evaluate_codebuild_input(*, codebuild_input, context=None, dimensions=None, remaining_millis=None):
+        raise exception
+
+    monkeypatch.setattr(module.client, "evaluate_codebuild_input", evaluate_codebuild_input)
+
+
+message = {"ExecutionId": "exec-1", "CodeBuildInput": {"Bucket": "cb-inputs", "Key": "exec-1/Stack0.template.json"}}
+
+
+def test_missing_results_report_is_recorded_as_an_error(stream, monkeypatch):
+    fail_with(stream, monkeypatch, control_broker_client.StatusCodeNot200Exception())
+    stream.evaluate_streamed_record(message=message)
+    assert stream.verdicts[message["CodeBuildInput"]["Key"]]["Error"] == "StatusCodeNot200Exception"
+
+
+def test_other_failures_are_redelivered_then_recorded_on_the_last_receive(stream, monkeypatch):
+    fail_with(stream, monkeypatch, TimeoutError("read timed out"))
+    for receive_count in [1, 2]:
+        with pytest.raises(TimeoutError):
+            stream.evaluate_streamed_record(message=message, receive_count=receive_count)
+    assert stream.verdicts == {}
+
+    with pytest.raises(TimeoutError):
+        stream.evaluate_streamed_record(message=message, receive_count=3)
+    assert stream.verdicts[message["CodeBuildInput"]["Key"]]["Error"] == "TimeoutError"
@@ -0,0 +1,55 @@
+import json
+import sys
+
+import pytest
+
+sys.path.insert(0, "./supplementary_files/lambda_layers/structured_logging/python")
+
+from structured_logging import Logger
+
+
+def records(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_payloads_are_summarized_at_info(capsys):
+    logger = Logger(name="test", level="INFO", sample_rate=0)
+    logger.start_invocation()
+    template = {"Resources": {"Bucket": {"Type": "AWS::S3::Bucket"}}, "Outputs": {}}
+    logger.payload("object read", template, Bytes=123)
+    logger.payload("body", b"{}")
+    logger.debug("not logged")
+
+    summary, body = records(capsys)
+    assert "Payload" not in summary
+    assert summary["Keys"] == ["Resources", "Outputs"]
+    assert summary["Bytes"] == 123
+    assert body["Bytes"] == 2
+    assert len(body["Sha256"]) == 64
+
+
+def test_payloads_are_logged_at_debug_or_when_sampled(capsys):
+    logger = Logger(name="test", level="DEBUG", sample_rate=0)
+    logger.start_invocation()
+    logger.payload("event", {"Input": 1})
+    assert records(capsys)[0]["Payload"] == {"Input": 1}
+
+    logger = Logger(name="test", level="ERROR", sample_rate=1)
+    logger.start_invocation()
+    logger.debug("sampled")
+    logger.payload("event", {"Input": 1})
+    sampled, event = records(capsys)
+    assert sampled["Sampled"] is True
+    assert event["Payload"] == {"Input": 1}
+
+    logger = Logger(name="test", level="ERROR", sample_rate=0)
+    logger.start_invocation()
+    logger.warning("not logged")
+    assert records(capsys) == []
+
+
+def test_level_aliases_are_accepted_and_unknown_levels_named():
+    assert Logger(name="test", level="warn").level == Logger(name="test", level="WARNING").level
+    assert Logger(name="test", level="CRITICAL").level == Logger(name="test", level="ERROR").level
+    with pytest.raises(ValueError, match="DEBUG, INFO, WARNING, ERROR"):
+        Logger(name="test", level="VERBOSE")
@@ -0,0 +1,53 @@
+import contextlib
+import json
+import os
+
+from benchmarks.throughput import main
+from benchmarks.workloads import generate_source_dir
+
+tiny = {
+    "cdk_stacks": 6,
+    "cdk_stages": 2,
+    "cdk_stage_depth": 1,
+    "cdk_resources_per_stack": 3,
+    "cdk_asset_dirs": 2,
+    "cdk_asset_files_per_dir": 3,
+    "cdk_asset_file_bytes": 64,
+    "tf_resource_changes": 40,
+    "tf_modules": 4,
+    "sam_functions": 5,
+}
+
+
+def test_generated_workload_is_deterministic(tmp_path):
+    first = generate_source_dir(str(tmp_path / "a"), scale="small", seed=3, **tiny)
+    second = generate_source_dir(str(tmp_path / "b"), scale="small", seed=3, **tiny)
+    assert first == second
+    assert first["generated"]["CDK"] == 6
+    for name in ["tfplan.json", "sam_packaged_template.json"]:
+        with open(tmp_path / "a" / name, "rb") as a, open(tmp_path / "b" / name, "rb") as b:
+            assert a.read() == b.read()
+
+    with open(tmp_path / "a" / "tfplan.json") as f:
+        assert len(json.load(f)["resource_changes"]) == 40
+    with open(tmp_path / "a" / "sam_packaged_template.json") as f:
+        functions = [r for r in json.load(f)["Resources"].values() if r["Type"] == "AWS::Serverless::Function"]
+    assert len(functions) == 5
+
+
+def test_throughput_cases_and_baseline(tmp_path):
+    workload_dir = str(tmp_path / "workload")
+    generate_source_dir(workload_dir, scale="small", **tiny)
+    output = str(tmp_path / "baseline.json")
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        results = main(["--workload-dir", workload_dir, "--no-memory", "--output", output])
+    cases = results["cases"]
+    # the asset directories' decoy templates are not collected
+    assert cases["collector:CDK"]["inputs"] == 6
+    assert cases["collector:SAM"]["inputs"] == 1
+    assert cases["collector:Terraform:shard-module"]["inputs"] > 1
+    assert cases["sign_apigw_request:read_post:CDK"]["errors"] == 0
+
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        main(["--workload-dir", workload_dir, "--no-memory", "--case", "SAM", "--baseline", output, "--max-regression", "1000"])
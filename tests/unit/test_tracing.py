@@ -0,0 +1,57 @@
+import contextlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, "./supplementary_files/lambda_layers/tracing/python")
+
+import tracing
+from benchmarks.workflow import LocalWorkflow, synthesize
+
+
+def test_subsegments_keep_their_annotations_and_parent_across_threads():
+    tracing.local_exporter.clear()
+    tracer = tracing.Tracer(name="test", exporter="local")
+    tracer.start_invocation({"CodeBuildToSfnArtifact": {"CodePipelineExecutionId": "exec-1"}})
+
+    def read(key):
+        with tracer.subsegment("S3Read", Key=key) as span:
+            span.set("Bytes", 1)
+
+    with tracer.subsegment("Batch"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(tracer.propagate(read), ["a", "b"]))
+
+    with pytest.raises(ValueError):
+        with tracer.subsegment("Fails"):
+            raise ValueError()
+
+    reads = [s for s in tracing.local_exporter.spans if s["Name"] == "S3Read"]
+    (batch,) = [s for s in tracing.local_exporter.spans if s["Name"] == "Batch"]
+    (fails,) = [s for s in tracing.local_exporter.spans if s["Name"] == "Fails"]
+    assert sorted(s["Metadata"]["Key"] for s in reads) == ["a", "b"]
+    assert all(s["ParentId"] == batch["Id"] for s in reads)
+    assert all(s["Annotations"] == {"CodePipelineExecutionId": "exec-1"} for s in reads)
+    assert fails["Error"] == "ValueError"
+    assert fails["ParentId"] is None
+
+
+@pytest.mark.parametrize("stack_kwargs", [{}, {"batch_evaluation": True}])
+def test_every_subsegment_is_annotated_with_the_pipeline_execution(stack_kwargs):
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        templates = synthesize(source_iac="SAM", tracing=True, **stack_kwargs)
+    resources = templates[0]["Resources"].values()
+    (state_machine,) = [r for r in resources if r["Type"] == "AWS::StepFunctions::StateMachine"]
+    assert state_machine["Properties"]["TracingConfiguration"] == {"Enabled": True}
+
+    workflow = LocalWorkflow(templates, wait_scale=0.001, evaluation_delay=0.01)
+    codebuild_inputs = workflow.put_inputs(execution_id="exec-1", count=3)
+    report = workflow.run(execution_id="exec-1", codebuild_inputs=codebuild_inputs)
+    assert report["status"] == "SUCCEEDED"
+    assert report["subsegments"]["sign_apigw_request:S3Read"]["count"] == 3
+    assert report["subsegments"]["sign_apigw_request:ControlBrokerPost"]["count"] == 3
+    assert tracing.local_exporter.spans
+    for span in tracing.local_exporter.spans:
+        assert span["Annotations"] == {"CodePipelineExecutionId": "exec-1"}